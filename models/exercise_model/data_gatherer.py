@@ -6,7 +6,12 @@ from PySide6.QtCore import QTimer, Qt
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTextEdit, QFrame, QSlider, QFileDialog)
 from PySide6.QtGui import QImage, QPixmap
+import os
 import enumop2
+# Shared feature extraction and frame preparation from the source folder, same ones the game uses
+sys.path.append(os.path.join(enumop2.root_dir, 'source'))
+import features as ft
+from preprocess import Frame_Preprocessor
 # Windows specific import to play beeps on countdown - playsound would also work but i dont have the wav files for pure beeps
 try:
     import winsound
@@ -18,49 +23,13 @@ MP_LITE = enumop2.Model_Paths.MP_LITE.value
 MP_FULL = enumop2.Model_Paths.MP_FULL.value
 MP_HEAVY = enumop2.Model_Paths.MP_HEAVY.value
 
-# DATA CLEANUP AND PREPROCESSING FUNCTION - IMPORTANT
-def preprocess(result):
-    '''
-    Reformats data into ordered list of numbers to be put into a csv.
-
-    Might be worth adding in a check for head visibility (points 1 thru 10) and
-    discarding them if too low. The BlazePose neural network architecture that
-    MediaPipe relies on uses face detection as a proxy for person detection, so
-    points that can't detect a face may be unreliable.  
-    '''
-    # Abbreviation for...
-    body_pt = mp.solutions.pose.PoseLandmark        # the body landmark enumerations in mediapipe
-    pose_landmarks_list = result.pose_landmarks     # the result list in the media pipe return
-    # Values our model will ignore - basically eyes, lips, hands, and feet
-    ignore = [1, 2, 3, 4, 5, 6, 9, 10, 17, 18, 19, 20, 21, 22, 29, 30, 31, 32]
-    # What we return
-    parsed_list = []
-
-    # INPUT HANDLING AND DATA DISCARDING 
-    # TODO: Implement discarding the invisible head data - have a lot of pts to check, 0-10
-    # Maybe for efficiency only check nose vis (point 0) 
-    if (len(pose_landmarks_list) == 0) or (False):
-        return None
-
-    # Parsing the results object that google has insanely poor documentation for
-    # to extract the landmark values we're interested int
-    for idx in range(len(pose_landmarks_list)):
-        pose_landmarks = pose_landmarks_list[idx]   # for some god unknown reason it's a 2d list with only one column
-
-        # Loop through the inner list of landmarks and add each value to the list
-        for part in body_pt:
-            # Only the values we care about
-            if part.value not in ignore:
-                parsed_list.append(pose_landmarks[part.value].x)
-                parsed_list.append(pose_landmarks[part.value].y)
-                parsed_list.append(pose_landmarks[part.value].z)
-                parsed_list.append(pose_landmarks[part.value].visibility)
-            else:
-                pass
-    
-    # Return simple list of numbers corresponding to [x coord, y coord, visibility, x coord, y coord, visibility...]
-    # each body point landmark corresponding to some four consecutive values
-    return parsed_list
+# DATA CLEANUP AND PREPROCESSING - IMPORTANT
+# The feature extraction lives in source/features.py so the game and this app always make identical vectors.
+# To change which body points get collected, change KEEP_PARTS there (and bump FEATURE_SCHEMA).
+extractor = ft.Feature_Extractor()
+# Same cropping and colour conversion the game does before landmarking (see source/preprocess.py) - every file
+# this writes to gets marked with that version (see PREPROCESSING in source/features.py)
+preprocessor = Frame_Preprocessor()
 
 # Just an append convenience function
 def append_list_to_csv(file_path, list_data):
@@ -300,24 +269,46 @@ class MyApp(QWidget):
         elif not data_file.lower().endswith('.csv'):
             self.label.setText('ONLY CSV FILES ACCEPTED AS OF NOW')
             return
+        # Don't mix data from frames prepared different ways in one file, models can't be trained on both
+        if (os.path.isfile(data_file) and os.path.getsize(data_file) > 0
+                and ft.data_preprocessing(data_file) != ft.PREPROCESSING):
+            self.label.setText('THIS FILE HAS DATA FROM AN OLDER VERSION - CLEAR IT OR PICK ANOTHER ONE')
+            return
+        ft.mark_data(data_file)
 
-        # iterations == points of data
+        # New landmarker, so start looking for the player in the whole frame again
+        preprocessor.reset()
+
+        # iterations == frames read, each one with somebody in it is a point of data
+        skipped = 0
         for i in range(iterations):
             # Get image frame and time from video feed
             ret, cv_frame = cap.read()
             timestamp_ms = int(cap.get(cv2.CAP_PROP_POS_MSEC))
 
-            # Convert the frame received from OpenCV to a MediaPipe’s Image object.
-            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=cv_frame)
+            # Crop, convert BGR to RGB, and wrap the frame in a MediaPipe Image object, same as the game
+            mp_image, region = preprocessor.prepare(cv_frame)
 
             # Send live image data to perform pose landmarking - treating it as video
             # rather than live feed because blocking makes things simpler than async
             pose_landmarker_result = landmarker.detect_for_video(mp_image, timestamp_ms)
-
-            # Clean up formatting
-            clean_data = preprocess(pose_landmarker_result)
+            preprocessor.remap(pose_landmarker_result, region)
+            preprocessor.track(pose_landmarker_result)
+
+            # Clean up formatting (skipping frames with nobody in them)
+            clean_data = extractor.extract(pose_landmarker_result)
+            if clean_data is None:
+                skipped += 1
+                continue
             # Append to csv file
-            append_list_to_csv(data_file, clean_data)
+            append_list_to_csv(data_file, clean_data[0].tolist())
+
+        # Letting the user know if it came up short
+        message = f'DATA GATHERING FINISHED! {iterations - skipped} points saved'
+        if skipped > 0:
+            message += f', {skipped} frames skipped because nobody was detected in them'
+        print(message)
+        self.label.setText(message)
     
     # Controlling slider variable
     def slide(self, value):
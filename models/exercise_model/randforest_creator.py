@@ -5,6 +5,11 @@ import joblib
 import pandas as pd
 import enumop2 
 import os
+import sys
+# Shared feature extraction from the source folder, so the column names and schema match the game
+sys.path.append(os.path.join(enumop2.root_dir, 'source'))
+import features as ft
+import forest as fst
 
 ''' 
 This python file uses scikit learn to make a random forest classifier based on all the pose data. It combines the data
@@ -38,24 +43,10 @@ class_labels = [DEFAULT, STATE_A, STATE_B]
 # then there's no need to change this.
 
 # Feature Labels - NO NEED TO EDIT THIS
-features = ['x0', 'y0', 'z0', 'v0',
-            'x1', 'y1', 'z1', 'v1',
-            'x2', 'y2', 'z2', 'v2',
-            'x3', 'y3', 'z3', 'v3',
-            'x4', 'y4', 'z4', 'v4',
-            'x5', 'y5', 'z5', 'v5',
-            'x6', 'y6', 'z6', 'v6',
-            'x7', 'y7', 'z7', 'v7',
-            'x8', 'y8', 'z8', 'v8',
-            'x9', 'y9', 'z9', 'v9',
-            'x10', 'y10', 'z10', 'v10',
-            'x11', 'y11', 'z11', 'v11',
-            'x12', 'y12', 'z12', 'v12',
-            'x13', 'y13', 'z13', 'v13',
-            'x14', 'y14', 'z14', 'v14',]
+features = ft.feature_names()
 # x, y, z are spatial coords, v is visibility, and the number shows which body landmark they belong to.
-# My lack of foresight caused me to forget pandas has column labels so I'm just manually adding them in here.
-# Only change if you already altered the body points collected/thrown away in data_gatherer.py - in which case you're not a beginner.
+# These come from source/features.py, which is also what data_gatherer.py and the game use to make the data - only change
+# the body points collected/thrown away there, in which case you're not a beginner.
 
 #
 #
@@ -91,6 +82,13 @@ def load_and_concatenate_data(file_paths:list, labels:list, col_names:list):
     data = pd.concat(data_frames)
     return data
 
+# Data gathered from differently prepared frames (see PREPROCESSING in source/features.py) can't be mixed in one model
+preprocessing = {file_path: ft.data_preprocessing(file_path) for file_path in files}
+if len(set(preprocessing.values())) > 1:
+    print("These files were gathered from frames prepared different ways, gather them all again with the current "
+          f"data_gatherer.py: {preprocessing}")
+    sys.exit(1)
+
 # Making DataFrame
 data = load_and_concatenate_data(files, class_labels, features)
 # Putting all pose data in one var and all the corresponding classes in another
@@ -111,8 +109,14 @@ accuracy = rf_model.score(pose_data_test, pose_class_test)
 print(data)
 print(f"Accuracy: {accuracy}")
 
+# Remember which feature layout (and frame preparation) the model was trained on, the game checks this when loading it
+rf_model.feature_schema_ = ft.FEATURE_SCHEMA
+rf_model.preprocessing_ = preprocessing[files[0]]
+
 # Save the dummy model using joblib
 joblib.dump(rf_model, 'randomforest_model.joblib')
+# Also export it as memory mappable arrays next to it, so the game can load it in milliseconds (see source/forest.py)
+fst.export_forest('randomforest_model.joblib')
 
 print("Random Forest model created and saved successfully!")
 print("Just check the parent folders, it might be saved to the project root.")
@@ -1,16 +1,25 @@
-from PySide6.QtWidgets import (
-    QApplication,
-    QLabel,
-    QMainWindow,
-    QVBoxLayout,
-    QWidget,
-    QPushButton,
-    QStackedWidget,
-)
-from PySide6.QtGui import Qt
-from helpers import Level_Widget # Just a custom widget that can delete its own children
+import warmup # Standard library only, so it can time everything imported after it
+with warmup.timed("import PySide6"):
+    from PySide6.QtWidgets import (
+        QApplication,
+        QLabel,
+        QMainWindow,
+        QVBoxLayout,
+        QWidget,
+        QPushButton,
+        QStackedWidget,
+    )
+    from PySide6.QtCore import QTimer
+    from PySide6.QtGui import Qt
+with warmup.timed("import helpers"):
+    import helpers as hlp
+    from helpers import Level_Widget # Just a custom widget that can delete its own children
 import sys
-import levels # So we can call the start_level function
+import os
+import assetpack # Packed assets, if any were built (see assetpack.py)
+import enumoptions as op
+# levels (and with it MediaPipe, OpenCV, scikit-learn...) isn't imported here - the warm-up thread imports it while
+# the menu is up, see warmup.py and the bottom of this file
 
 # Subclassing QMainWindow
 class MainWindow(QMainWindow):
@@ -21,7 +30,9 @@ class MainWindow(QMainWindow):
         # Important variables for functioning of app
         self.started = False        # Is a level currently in progress?
         self.cam_thread = None      # Placeholder for camera thread
+        self.pipeline = None        # Camera thread every level attaches to, started with the first level (see close_app)
         self.lvl_thread = None      # Placeholder for level thread
+        self.warm_up = None         # Warm_Up loading the heavy stuff in the background, set once the menu is up
 
         self.setWindowTitle("My App")
 
@@ -103,16 +114,27 @@ class MainWindow(QMainWindow):
         if not self.started:
             self.started = True
             self.navigate_to(4)
-            self.game_loop, self.cam_thread, self.lvl_thread, s, v, o = levels.start_level(self.play_page, value)
+            # Normally the warm-up has imported it already - if it's still going, this waits for it to finish
+            import levels # So we can call the start_level function
+            # One camera thread for the whole run - only started again if it couldn't open the camera last time
+            if self.pipeline is None or not self.pipeline.is_alive():
+                # The first one takes over the landmarker the warm-up already made
+                take = self.warm_up.take_landmarker if self.warm_up is not None else None
+                self.pipeline = levels.start_pipeline(landmarker=take)
+            self.game_loop, self.cam_thread, self.lvl_thread, s, v, o = levels.start_level(self.play_page, value, self.pipeline)
             # If anything goes wrong, check to make sure it's not the garbage collector deleting s v o
 
     def close_level(self):
         # The custom widget should have already killed its children at this point (thus deleting Qt's C++ objects)
-        # Safely closing threads
-        self.cam_thread.stop()
+        # Safely closing the level thread - the camera thread just lets go of the level and idles until the
+        # next one, it only gets stopped when the app closes
+        # Anything the level thread invokes from here on is dropped - it could be waiting for room in a full
+        # invoke queue, which we can't empty while we're stuck in join
+        hlp.abort_invokes()
+        self.cam_thread.detach()
         self.game_loop.clear()
-        self.cam_thread.join()
         self.lvl_thread.join()
+        hlp.resume_invokes()
         # Freeing up name space (relying on python garbage collector to delete python objects after this)
         self.cam_thread = None
         self.lvl_thread = None
@@ -128,9 +150,24 @@ class MainWindow(QMainWindow):
     def close_app(self):
         self.started = False
         # TODO Add code to save progress here, if needed
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline.join(timeout=2)
+            self.pipeline = None
         super().close()
 
 app = QApplication(sys.argv)
+assetpack.mount_all() # Any assets/*.pack - everything else still loads from the loose files
 window = MainWindow()
 window.show()
+
+# Once the menu is up and drawn, load the heavy stuff in the background and report how long start up took
+# (appended to saves/startup_times.jsonl too, to keep an eye on cold starts over time)
+warm_up = warmup.Warm_Up(log_path=os.path.join(op.root_dir, "saves", "startup_times.jsonl"))
+window.warm_up = warm_up
+def menu_ready():
+    warmup.mark("main menu shown")
+    warm_up.start()
+QTimer.singleShot(0, menu_ready)
+
 app.exec()
\ No newline at end of file
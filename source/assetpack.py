@@ -0,0 +1,274 @@
+from PySide6.QtGui import QImage, QColorSpace
+from pathlib import Path
+import argparse
+import struct
+import mmap
+import json
+import os
+import enumoptions as op
+
+'''
+Packs a bunch of asset files (a level's sprites, backgrounds, sounds...) into one indexed archive, and reads them
+back out of it through a memory map. A cold start off a slow disk, or out of the PyInstaller bundle, then opens
+one file per level instead of one per asset.
+
+Images can also be stored already decoded (raw pixels, in the same format a QPixmap holds them in), so loading
+one is just making a QImage over the mapped bytes - no PNG decode at all. That makes the pack bigger, so it's
+optional.
+
+Build a pack (from source/, paths relative to the project root or absolute):
+
+    python assetpack.py ../assets/demo.pack ../assets/backgrounds ../assets/characters
+
+Any *.pack in assets/ gets mounted by mount_all (app.py does it on start up). After that, anything asking for an
+image by its normal path (ie os.path.join(op.root_dir, "assets", "backgrounds", "gym.png")) gets it from the pack
+if one has it, and from disk otherwise, so nothing else has to change - see Sprite_Cache in helpers.py.
+
+File layout (all integers little endian):
+- 16 byte header: MAGIC, version (uint32), offset of the index (uint64)
+- the data, every block starting on an ALIGN byte boundary
+- the index, UTF-8 JSON: {"entries": {name: {"offset", "length", "raw"}}}, where name is the path relative to
+  the project root with forward slashes, and raw is None or {"offset", "width", "height", "stride", "format",
+  "dpm", "icc"} - dpm is the dots per meter (x, y) and icc is (offset, length) of the colour profile or None,
+  so the QImage comes back exactly like a decoded one, metadata and all
+'''
+
+MAGIC = b"PKPK"
+VERSION = 1
+ALIGN = 64          # So raw image rows start aligned, like Qt's own buffers
+HEADER = struct.Struct("<4sIQ")
+
+IMAGE_TYPES = (".png", ".jpg", ".jpeg", ".bmp")
+# Raw formats we write, by the name stored in the index
+RAW_FORMATS = {
+    "argb32_premultiplied": QImage.Format_ARGB32_Premultiplied,
+    "rgb32": QImage.Format_RGB32,
+}
+
+def asset_name(path, root=op.root_dir):
+    '''
+    The name an asset is stored under in a pack - its path relative to the project root, with forward
+    slashes. Returns None for paths outside the root.
+    '''
+    try:
+        rel = Path(path).resolve().relative_to(Path(root).resolve())
+    except ValueError:
+        return None
+    return rel.as_posix()
+
+def _collect(paths):
+    '''
+    Expands directories into the files under them (sorted, so packs come out the same every time). "Private"
+    function.
+    '''
+    files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob("*") if p.is_file() and p.suffix != ".pack"))
+        else:
+            files.append(path)
+    return files
+
+def _pad(out):
+    '''
+    Writes zeros up to the next ALIGN boundary and returns the offset there. "Private" function.
+    '''
+    extra = -out.tell() % ALIGN
+    out.write(b"\0" * extra)
+    return out.tell()
+
+def pack_assets(out_path, paths, raw=True, root=op.root_dir):
+    '''
+    Builds a pack at out_path from a list of files and/or directories (everything under the root). With raw
+    on, images get a pre-decoded copy of their pixels stored too. Returns the number of files packed.
+    '''
+    entries = {}
+    with open(out_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, 0)) # Index offset filled in at the end
+
+        for path in _collect(paths):
+            name = asset_name(path, root)
+            if name is None:
+                raise ValueError(f"{path} isn't under the project root {root}, can't be packed")
+            data = path.read_bytes()
+
+            # The file itself, as is
+            offset = _pad(out)
+            out.write(data)
+            entry = {"offset": offset, "length": len(data), "raw": None}
+
+            # Decoded pixels, converted the same way Sprite_Cache does so nothing has to be converted on load
+            if raw and path.suffix.lower() in IMAGE_TYPES:
+                image = QImage.fromData(data)
+                if not image.isNull():
+                    fmt = "argb32_premultiplied" if image.hasAlphaChannel() else "rgb32"
+                    image = image.convertToFormat(RAW_FORMATS[fmt])
+                    raw_offset = _pad(out)
+                    out.write(image.constBits().tobytes())
+                    icc = None
+                    if image.colorSpace().isValid():
+                        profile = image.colorSpace().iccProfile().data()
+                        icc = (out.tell(), len(profile))
+                        out.write(profile)
+                    entry["raw"] = {"offset": raw_offset, "width": image.width(), "height": image.height(),
+                                    "stride": image.bytesPerLine(), "format": fmt,
+                                    "dpm": (image.dotsPerMeterX(), image.dotsPerMeterY()), "icc": icc}
+            entries[name] = entry
+
+        # Index at the end, then point the header at it
+        index_offset = _pad(out)
+        out.write(json.dumps({"entries": entries}).encode("utf-8"))
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, index_offset))
+    return len(entries)
+
+class Asset_Pack():
+    '''
+    One pack, memory mapped read only. Opening it only reads the index - the data is paged in by the OS as it
+    gets used.
+
+    Keep it open for as long as anything made from it might be around (mounted packs stay open for the whole
+    run) - the memoryviews and QImages it hands out point straight into the map.
+
+    Arguments:
+    - path: str, the .pack file
+
+    READ-ONLY Public Variables:
+    - path: str
+    - root: the project root names are relative to
+
+    Protected Variables:
+    - _file: the open file
+    - _map: mmap over all of it
+    - _entries: dict, name -> entry from the index
+    '''
+    def __init__(self, path, root=op.root_dir):
+        # READ-ONLY Public Variables
+        self.path = str(path)
+        self.root = root
+
+        # Protected Variables
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{self.path} isn't a version {VERSION} asset pack")
+        self._entries = json.loads(self._map[index_offset:].decode("utf-8"))["entries"]
+
+    def names(self):
+        return list(self._entries)
+
+    def _entry(self, path):
+        '''
+        Index entry for a path (or a name), None if this pack doesn't have it. "Private" function.
+        '''
+        entry = self._entries.get(str(path).replace("\\", "/"))
+        if entry is None:
+            name = asset_name(path, self.root)
+            entry = self._entries.get(name) if name is not None else None
+        return entry
+
+    def __contains__(self, path):
+        return self._entry(path) is not None
+
+    def read(self, path):
+        '''
+        The file's bytes, as a read only memoryview into the map (no copy). None if it isn't in here.
+        '''
+        entry = self._entry(path)
+        if entry is None:
+            return None
+        return memoryview(self._map)[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def image(self, path):
+        '''
+        A QImage of an image in the pack, or None if it isn't in here. If the pack has it pre-decoded, the
+        QImage sits right on the mapped bytes (read only - don't paint on it, copy() it first). Otherwise it's
+        decoded from the packed file.
+        '''
+        entry = self._entry(path)
+        if entry is None:
+            return None
+        raw = entry["raw"]
+        if raw is None:
+            return QImage.fromData(self.read(path).tobytes())
+        size = raw["stride"] * raw["height"]
+        pixels = memoryview(self._map)[raw["offset"]:raw["offset"] + size]
+        image = QImage(pixels, raw["width"], raw["height"], raw["stride"], RAW_FORMATS[raw["format"]])
+        # Metadata only, the pixels stay where they are
+        image.setDotsPerMeterX(raw["dpm"][0])
+        image.setDotsPerMeterY(raw["dpm"][1])
+        if raw["icc"] is not None:
+            icc_offset, icc_length = raw["icc"]
+            image.setColorSpace(QColorSpace.fromIccProfile(self._map[icc_offset:icc_offset + icc_length]))
+        return image
+
+    def close(self):
+        '''
+        Only once nothing made from the pack is still around (the map can't close while views into it exist).
+        '''
+        self._map.close()
+        self._file.close()
+
+# Mounted packs, newest first, so a newer pack can override an asset in an older one
+packs = []
+
+def mount(path):
+    '''
+    Opens a pack and makes its assets available to find/image/read. Returns the Asset_Pack.
+    '''
+    pack = Asset_Pack(path)
+    packs.insert(0, pack)
+    return pack
+
+def mount_all(directory=os.path.join(op.root_dir, "assets")):
+    '''
+    Mounts every .pack file in a directory (the assets folder by default). Returns how many it mounted - zero
+    just means everything gets loaded from loose files like before.
+    '''
+    if not os.path.isdir(directory):
+        return 0
+    mounted = 0
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".pack"):
+            mount(os.path.join(directory, name))
+            mounted += 1
+    return mounted
+
+def find(path):
+    '''
+    The mounted pack holding an asset, or None if it's only on disk (or nothing is mounted).
+    '''
+    for pack in packs:
+        if path in pack:
+            return pack
+    return None
+
+def image(path):
+    '''
+    QImage for an asset from the mounted packs, or None if none of them have it (then load it off disk).
+    '''
+    pack = find(path)
+    return pack.image(path) if pack is not None else None
+
+def read(path):
+    '''
+    The bytes of an asset - from a mounted pack if one has it (no copy), otherwise read off disk.
+    '''
+    pack = find(path)
+    if pack is not None:
+        return pack.read(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+# Build step
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack asset files into one memory mappable archive.")
+    parser.add_argument("out", help="the .pack file to write")
+    parser.add_argument("paths", nargs="+", help="files and/or directories to pack (under the project root)")
+    parser.add_argument("--no-raw", action="store_true", help="don't store pre-decoded image pixels")
+    args = parser.parse_args()
+    count = pack_assets(args.out, args.paths, raw=not args.no_raw)
+    print(f"Packed {count} files into {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB)")
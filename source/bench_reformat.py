@@ -0,0 +1,115 @@
+from time import perf_counter
+import numpy as np
+import cv2
+import sys
+from helpers import reformat_image, reformat_shape
+
+'''
+Checks and times helpers.reformat_image against the original version of it (reformat_image_legacy below), which
+resized the whole frame, cropped, then converted the colour and mirrored, allocating a new array at every step.
+
+Run it directly after touching reformat_image:
+
+    python bench_reformat.py
+
+It first checks the outputs still match the original's (exits with an error if they don't), then prints how long
+each version takes in every mode.
+'''
+
+def reformat_image_legacy(image: np.ndarray, new_height = 150, new_width = 150, reformat_mode = 3):
+    '''
+    The original reformat_image, kept as is to compare against.
+    '''
+    # Set up return variable
+    new_image = None
+
+    # Getting current image shape
+    image_shape = image.shape
+    height = image_shape[0]
+    width = image_shape[1]
+
+    # Deciding how to resize image
+    if reformat_mode == 0:
+        # Stretch
+        new_res = (new_height, new_width)
+        new_image = cv2.resize(image, new_res, interpolation= cv2.INTER_AREA)
+    elif reformat_mode == 1:
+        # Perserve ratio, scale down to specified width
+        ratio = (new_width / width)
+
+        new_image = cv2.resize(image, None, fx= ratio, fy= ratio, interpolation= cv2.INTER_AREA)
+    else:
+        # Default, scale down to height and crop to get a square, perserving the center
+        ratio = (new_height / height)
+        scaled_width = int(width * ratio)
+
+        temp = cv2.resize(image, None, fx= ratio, fy= ratio, interpolation= cv2.INTER_AREA)
+
+        # Cropping so as to leave a strip of the center equal to height
+        left = int((scaled_width / 2) - (new_height / 2))
+        right = left + new_height
+        new_image = temp[0:new_height, left:right]
+
+    # Fixing the color and mirroring it
+    new_image = cv2.cvtColor(new_image, cv2.COLOR_BGR2RGB)
+    new_image = cv2.flip(new_image, 1)
+
+    return new_image
+
+def benchmark_reformat(frame_shape=(720, 1280, 3), new_height=200, new_width=200, runs=200):
+    '''
+    Micro-benchmark of reformat_image against reformat_image_legacy on a random camera sized frame, in every
+    mode. Prints the average milliseconds per call and how far apart their outputs are (the fused version crops
+    before scaling, so edge pixels can differ by a little).
+    '''
+    frame = np.random.default_rng(0).integers(0, 256, frame_shape, dtype=np.uint8)
+    for mode in (0, 1, 2):
+        dst = np.empty(reformat_shape(frame_shape, new_height, new_width, mode), dtype=np.uint8)
+        timings = []
+        for fn, args in ((reformat_image_legacy, {}), (reformat_image, {}), (reformat_image, {'dst': dst})):
+            fn(frame, new_height, new_width, mode, **args)
+            start = perf_counter()
+            for _ in range(runs):
+                fn(frame, new_height, new_width, mode, **args)
+            timings.append((perf_counter() - start) / runs * 1000)
+        legacy = reformat_image_legacy(frame, new_height, new_width, mode)
+        fused = reformat_image(frame, new_height, new_width, mode)
+        diff = np.abs(legacy.astype(np.int16) - fused.astype(np.int16)).mean() if legacy.shape == fused.shape else None
+        print(f"Mode {mode}: legacy {timings[0]:.3f} ms, fused {timings[1]:.3f} ms, fused with dst {timings[2]:.3f} ms "
+              f"(output {fused.shape}, mean difference {diff})")
+
+def check_reformat(frame_shapes=((640, 480, 3), (1280, 720, 3), (333, 101, 3), (480, 480, 3), (500, 499, 3)),
+                   sizes=((150, 150), (200, 120), (101, 77)), tolerance=8.0):
+    '''
+    Checks reformat_image against reformat_image_legacy on frames that aren't landscape (vertical cameras and
+    square ones), in every mode - the output has to be exactly the legacy shape (and reformat_shape has to agree),
+    and the pixels can only be off by resampling (mean difference under tolerance, on a smooth camera-like
+    frame - random noise exaggerates it). Prints anything that fails and returns whether everything passed.
+    '''
+    passed = True
+    rng = np.random.default_rng(0)
+    for frame_shape in frame_shapes:
+        # Blown up noise, so neighbouring pixels are similar like in a real frame
+        coarse = rng.integers(0, 256, (max(2, frame_shape[0] // 40), max(2, frame_shape[1] // 40), 3), dtype=np.uint8)
+        frame = cv2.resize(coarse, (frame_shape[1], frame_shape[0]), interpolation=cv2.INTER_CUBIC)
+        for new_height, new_width in sizes:
+            for mode in (0, 1, 2):
+                legacy = reformat_image_legacy(frame, new_height, new_width, mode)
+                fused = reformat_image(frame, new_height, new_width, mode)
+                shape = reformat_shape(frame_shape, new_height, new_width, mode)
+                if not legacy.shape == fused.shape == shape:
+                    print(f"{frame_shape} to {new_height}x{new_width} mode {mode}: legacy {legacy.shape}, "
+                          f"fused {fused.shape}, reformat_shape {shape}")
+                    passed = False
+                    continue
+                diff = np.abs(legacy.astype(np.int16) - fused.astype(np.int16)).mean()
+                if diff > tolerance:
+                    print(f"{frame_shape} to {new_height}x{new_width} mode {mode}: mean difference {diff:.2f}")
+                    passed = False
+    print("reformat_image matches reformat_image_legacy" if passed else "reformat_image check FAILED")
+    return passed
+
+if __name__ == '__main__':
+    if not check_reformat():
+        sys.exit(1)
+    benchmark_reformat()
@@ -30,6 +30,22 @@ class Exercises(Enum): # Edit if making new exercise
     CAST_SPELL = 6
     SWING_SWORD = 7
 
+# Ways the MediaPipe pose landmarker can be run by the camera thread
+class Pose_Engines(Enum):
+    VIDEO = 0           # Blocking detect_for_video, one frame in and one result out before the next read
+    LIVE_STREAM = 1     # Async detect_async, results come back through a callback and MP drops frames when behind
+
+# How far along the camera thread is in getting going (see Pose_Estimation.wait_until). In order, so a state
+# being reached means every one before it was too - the negative ones mean it isn't running (anymore)
+class Pipeline_States(Enum):
+    STOPPED = -2        # Stopped (or finished), on purpose
+    FAILED = -1         # Couldn't start, see the thread's state_error
+    STARTING = 0        # Created, not running yet
+    CAMERA_OPENED = 1   # Camera is open and being read
+    LANDMARKER_READY = 2# MediaPipe landmarker created
+    MODEL_WARMED = 3    # First frame went all the way through MediaPipe and the exercise model
+    FIRST_RESULT = 4    # First result with an actual person in it - ready to play
+
 # MediaPipe's result numbering
 class Body_Parts(Enum): 
     NOSE = 0
@@ -96,3 +112,11 @@ exercise_to_model = {
     Exercises.CAST_SPELL.value: Model_Paths.HACK_N_SLASH.value,
     Exercises.SWING_SWORD.value: Model_Paths.HACK_N_SLASH.value,
 }
+
+# Which classes a rep goes through for each exercise, (first, second) - a rep is first -> second -> first (see
+# Rep_Counter in predictions.py). Models trained on rest/first/second (0/1/2) don't need an entry, (1, 2) is the
+# default. The knees and legs model only knows rest (0) and the exercise (1), so there a rep is 1 -> 0 -> 1.
+exercise_rep_phases = {
+    Exercises.HIGH_KNEES.value: (1, 0),
+    Exercises.SQUAT.value: (1, 0),
+}
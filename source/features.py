@@ -0,0 +1,142 @@
+from itertools import chain
+from operator import attrgetter
+import numpy as np
+
+'''
+Turns MediaPipe's pose results into the flat feature vector the exercise classifiers are trained on and fed with.
+
+Both the game (poseestim.py) and the training data collector (models/exercise_model/data_gatherer.py) import this
+file, so the vectors used for training and the vectors used for playing can never drift apart. If you change what
+gets kept here, bump FEATURE_SCHEMA and retrain your models - the game refuses to load a model made with a
+different schema rather than quietly feeding it garbage.
+
+PREPROCESSING is the same idea for how frames are prepared before landmarking (see preprocess.py). The vectors
+look the same either way, so an older model still loads, but the landmarks in them land somewhere slightly
+different - the game warns about it, and the training data gets marked with it so old and new data can't get
+mixed up (see mark_data).
+'''
+
+# Version of the feature layout below, saved alongside every trained model (see randforest_creator.py)
+# Models trained before the schema existed have no version saved, and they all used the layout of schema 1
+FEATURE_SCHEMA = 1
+
+# How many landmarks MediaPipe gives back for a pose
+N_LANDMARKS = 33
+
+# Version of the frame preparation the landmarks come from, saved alongside every trained model and data file
+# 1 - the whole camera frame, straight from OpenCV (BGR) - what every model and data file without a version used
+# 2 - cropped to the player and converted to RGB (Frame_Preprocessor in preprocess.py)
+PREPROCESSING = 2
+
+# MediaPipe landmark numbers the models actually look at - everything except eyes, mouth, hands, and feet
+# (see Body_Parts in enumoptions.py for which number is which)
+KEEP_PARTS = np.array([0, 7, 8, 11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28], dtype=np.intp)
+
+# Values kept for each of those landmarks, in the order they appear in the vector
+PART_VALUES = ('x', 'y', 'z', 'v')
+
+# Pulls PART_VALUES out of one MediaPipe landmark, as a tuple
+_landmark_values = attrgetter('x', 'y', 'z', 'visibility')
+
+# Total length of one feature vector (15 landmarks * 4 values = 60)
+N_FEATURES = len(KEEP_PARTS) * len(PART_VALUES)
+
+# Column names for the training data, x0 y0 z0 v0 x1 y1... where the number is the position in KEEP_PARTS
+def feature_names():
+    '''
+    Returns the list of column names for a feature vector - x, y, z are spatial coords, v is visibility, and the
+    number is which kept landmark they belong to (its position in KEEP_PARTS, not its MediaPipe number).
+    '''
+    return [f'{value}{idx}' for idx in range(len(KEEP_PARTS)) for value in PART_VALUES]
+
+# Models already warned about by check_schema, so switching back and forth doesn't repeat it
+_warned = set()
+
+# Checking a loaded model was trained on vectors made the same way
+def check_schema(model, source='model'):
+    '''
+    Raises a ValueError if a loaded exercise model was trained with a different feature schema than this file
+    produces. Models store their schema in a feature_schema_ attribute; models without one count as schema 1.
+    Also warns (once per source) if it was trained on frames prepared differently (preprocessing_, 1 if missing,
+    see PREPROCESSING).
+
+    Arguments
+    - model, the loaded model object
+    - source, a name for the model to put in the error message (like its file path)
+    '''
+    schema = getattr(model, 'feature_schema_', 1)
+    if schema != FEATURE_SCHEMA:
+        raise ValueError(f"{source} was trained on feature schema {schema}, but this version extracts schema "
+                         f"{FEATURE_SCHEMA} - retrain it with the current data_gatherer.py and randforest_creator.py")
+    preprocessing = getattr(model, 'preprocessing_', 1)
+    if preprocessing != PREPROCESSING and source not in _warned:
+        _warned.add(source)
+        print(f"WARNING: {source} was trained on frames prepared the version {preprocessing} way, the game prepares "
+              f"them the version {PREPROCESSING} way (see PREPROCESSING in features.py) - it still works, but "
+              f"retraining it with the current data_gatherer.py should make it more accurate")
+
+# Telling training data gathered from differently prepared frames apart
+def mark_data(csv_path):
+    '''
+    Records that a training data file holds vectors from frames prepared the current (PREPROCESSING) way, in a
+    small file next to it (csv_path + '.preprocessing').
+    '''
+    with open(csv_path + '.preprocessing', 'w') as file:
+        file.write(str(PREPROCESSING))
+
+def data_preprocessing(csv_path):
+    '''
+    The PREPROCESSING version a training data file was gathered with (see mark_data). Files that were never
+    marked count as version 1, since they were all gathered before the versions existed.
+    '''
+    try:
+        with open(csv_path + '.preprocessing') as file:
+            return int(file.read().strip())
+    except FileNotFoundError:
+        return 1
+
+# The actual extraction
+class Feature_Extractor():
+    '''
+    Reformats a **MediaPipe Results object** into the feature vector the exercise models expect, writing it into
+    the same preallocated float32 buffer every time.
+
+    The buffer is already shaped (1, N_FEATURES), one sample, so it can be handed straight to a model's predict.
+    It gets overwritten on the next extract call, so copy it if you need to keep it around.
+
+    Only one thread should call extract on a given extractor - make one per thread if you need more.
+
+    Might be worth adding in a check for head visibility (points 1 thru 10) and discarding them if too low. The
+    BlazePose neural network architecture that MediaPipe relies on uses face detection as a proxy for person
+    detection, so points that can't detect a face may be unreliable.
+
+    READ-ONLY Public Variables:
+    - buffer: ndarray (1, N_FEATURES) float32
+
+    Protected Variables:
+    - _rows: ndarray (len(KEEP_PARTS), 4), view of the buffer with one row per kept landmark
+    '''
+    def __init__(self):
+        self.buffer = np.zeros((1, N_FEATURES), dtype=np.float32)
+        self._rows = self.buffer.reshape(len(KEEP_PARTS), len(PART_VALUES))
+
+    def extract(self, result):
+        '''
+        Fills the buffer from a MediaPipe results object and returns it. If there was no detection, returns None
+        and leaves the buffer as it was.
+
+        Only the first detected pose is used (the camera thread only ever asks MediaPipe for one).
+        '''
+        pose_landmarks_list = result.pose_landmarks     # the result list in the media pipe return
+        if len(pose_landmarks_list) == 0:
+            return None
+        pose_landmarks = pose_landmarks_list[0]          # for some god unknown reason it's a 2d list with only one column
+
+        # Every landmark into one (N_LANDMARKS, 4) array in a single go, then the kept rows straight into the buffer
+        # with one fancy index (landmarks[KEEP_PARTS], written in place) - four consecutive values per kept
+        # landmark, [x, y, z, visibility, x, y, z, visibility...]
+        landmarks = np.fromiter(chain.from_iterable(map(_landmark_values, pose_landmarks)), dtype=np.float32,
+                                count=N_LANDMARKS * len(PART_VALUES)).reshape(N_LANDMARKS, len(PART_VALUES))
+        np.take(landmarks, KEEP_PARTS, axis=0, out=self._rows)
+
+        return self.buffer
@@ -0,0 +1,407 @@
+from threading import Thread, Event, Lock
+from collections import OrderedDict
+import numpy as np
+import joblib
+import json
+import os
+import time
+
+'''
+A small random forest inference engine for the exercise classifiers.
+
+Scikit learn's RandomForestClassifier.predict is built for big batches - on the single 60 value row the camera thread
+sends it every frame, input validation and dispatching work out to the 100 trees costs far more than the tree walks
+themselves. This file flattens a trained forest into a handful of plain NumPy node arrays and walks every tree at once,
+one tree level per step, giving exactly the same predictions in a fraction of the time.
+
+Only the converted arrays are used at prediction time, scikit learn is only needed to do the conversion (and to check
+the results against, see verify_against_sklearn). Run this file directly to check and time all the bundled models.
+
+Converted forests can also be exported to disk (export_forest) as a folder of raw .npy arrays next to the .joblib file,
+with float32 thresholds and the smallest integer types that fit. load_model memory maps those in a few milliseconds
+instead of unpickling megabytes, and falls back to the .joblib file when there's no export (or it's out of date).
+Run this file with "export" as an argument to export all the bundled models.
+'''
+
+# Version of the exported folder layout, bump if the arrays saved by export_forest change
+EXPORT_FORMAT = 1
+
+# The converted forest
+class Compact_Forest():
+    '''
+    A random forest classifier flattened into node arrays. All the trees are stored back to back in the same arrays,
+    and each tree's leaves point to themselves so a walk can just keep stepping until the deepest tree is done.
+
+    Has predict and predict_proba like the scikit learn model it came from, so it can be dropped in wherever the joblib
+    model was used. Make one with compact_forest(model) rather than calling this directly.
+
+    Arguments (and READ-ONLY Public Variables):
+    - feature: ndarray (n_nodes,) int, feature each node splits on (0 for leaves)
+    - threshold: ndarray (n_nodes,) float32, go left if the feature is <= this (+inf for leaves)
+    - children: ndarray (n_nodes, 2) int, index of the left and right child (the node itself for leaves)
+    - value: ndarray (n_nodes, n_classes) float64, class probabilities at each node
+    - roots: ndarray (n_trees,) int, index of each tree's root node
+    - classes_: ndarray, the class labels, same as the scikit learn model's
+    - max_depth: int, depth of the deepest tree
+    - n_features_in_: int, length of an input row
+    - feature_schema_: int, feature schema the model was trained on (see features.py)
+    - preprocessing_: int, how the frames its training data came from were prepared (see features.py)
+    '''
+    def __init__(self, feature, threshold, children, value, roots, classes_, max_depth, n_features_in_,
+                 feature_schema_=1, preprocessing_=1):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes_
+        self.max_depth = int(max_depth)
+        self.n_features_in_ = int(n_features_in_)
+        self.feature_schema_ = int(feature_schema_)
+        self.preprocessing_ = int(preprocessing_)
+
+    def _leaves(self, X):
+        '''
+        Walks every tree for every row of X and returns the leaf each one ends up in, shape (n_rows, n_trees).
+        "Private" function.
+        '''
+        # One row per sample, every tree starting at its root
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.broadcast_to(self.roots, (X.shape[0], self.roots.shape[0]))
+
+        # Step every tree down one level at a time - leaves point to themselves so finished trees just stay put
+        for _ in range(self.max_depth):
+            go_right = X[rows, self.feature[node]] > self.threshold[node]
+            node = self.children[node, go_right.view(np.int8)]
+        return node
+
+    def predict_proba(self, X):
+        '''
+        Returns the class probabilities for each row of X (averaged over the trees, same as scikit learn).
+
+        X can be one row or a 2d array of rows. It is compared as float32, which is what scikit learn's trees do too.
+        '''
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        # Add up the leaf probabilities tree by tree, in tree order, the same way scikit learn accumulates them
+        proba = self.value[self._leaves(X)].sum(axis=1)
+        proba /= self.roots.shape[0]
+        return proba
+
+    def predict(self, X):
+        '''
+        Returns the predicted class label for each row of X, an ndarray just like scikit learn's predict returns.
+        '''
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+# Converting a scikit learn model
+def compact_forest(model):
+    '''
+    Converts a trained scikit learn RandomForestClassifier into a Compact_Forest. Raises a TypeError for anything
+    else (use compile_model if you might be handed other kinds of models).
+    '''
+    # Input handling - only single output forests of decision trees are supported
+    if not hasattr(model, "estimators_") or not hasattr(model, "classes_"):
+        raise TypeError("compact_forest only accepts a fitted scikit learn RandomForestClassifier")
+    if getattr(model, "n_outputs_", 1) != 1:
+        raise TypeError("compact_forest only supports forests with a single output")
+
+    n_classes = len(model.classes_)
+    trees = [estimator.tree_ for estimator in model.estimators_]
+
+    # Each tree's nodes get placed after the previous tree's nodes
+    sizes = np.array([tree.node_count for tree in trees], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    n_nodes = int(sizes.sum())
+
+    feature = np.zeros(n_nodes, dtype=np.int32)
+    threshold = np.full(n_nodes, np.inf, dtype=np.float32)
+    children = np.zeros((n_nodes, 2), dtype=np.int32)
+    value = np.zeros((n_nodes, n_classes), dtype=np.float64)
+
+    for tree, offset in zip(trees, offsets):
+        end = offset + tree.node_count
+        own = np.arange(offset, end)
+        is_leaf = tree.children_left == -1
+
+        # Leaves point to themselves and always "go left"
+        children[offset:end, 0] = np.where(is_leaf, own, tree.children_left + offset)
+        children[offset:end, 1] = np.where(is_leaf, own, tree.children_right + offset)
+        feature[offset:end] = np.where(is_leaf, 0, tree.feature)
+        threshold[offset:end] = np.where(is_leaf, np.inf, _floor_to_float32(tree.threshold))
+
+        # Normalizing each node's class counts into probabilities like DecisionTreeClassifier.predict_proba does
+        node_value = tree.value[:, 0, :n_classes]
+        normalizer = node_value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        value[offset:end] = node_value / normalizer
+
+    return Compact_Forest(feature, threshold, children, value,
+                          roots=offsets.astype(np.int32),
+                          classes_=np.asarray(model.classes_),
+                          max_depth=max(tree.max_depth for tree in trees),
+                          n_features_in_=model.n_features_in_,
+                          feature_schema_=getattr(model, "feature_schema_", 1),
+                          preprocessing_=getattr(model, "preprocessing_", 1))
+
+def compile_model(model):
+    '''
+    Returns a Compact_Forest version of a model if it is a random forest, or the model untouched if it's something
+    else (so a custom classifier with a predict function still works, just without the speed up).
+    '''
+    try:
+        return compact_forest(model)
+    except TypeError:
+        return model
+
+# Saving and loading converted forests
+def exported_path(model_path):
+    '''
+    Returns where the exported version of a .joblib model lives - the same path with .forest instead of .joblib.
+    '''
+    return os.path.splitext(str(model_path))[0] + ".forest"
+
+def export_forest(model_path, compact=None):
+    '''
+    Converts a .joblib random forest and writes it next to the original as a folder of .npy arrays plus a small
+    meta.json (see exported_path). Returns the folder path.
+
+    Arguments
+    - model_path, path to the .joblib file
+    - compact, an already converted Compact_Forest of that model, if you have one (skips loading it again)
+    '''
+    if compact is None:
+        compact = compact_forest(joblib.load(model_path))
+    folder = exported_path(model_path)
+    os.makedirs(folder, exist_ok=True)
+
+    # Smallest integer types that can hold the node and feature numbers
+    node_type = np.int16 if compact.threshold.shape[0] <= np.iinfo(np.int16).max else np.int32
+    feature_type = np.int8 if compact.n_features_in_ <= np.iinfo(np.int8).max else np.int16
+
+    np.save(os.path.join(folder, "feature.npy"), compact.feature.astype(feature_type))
+    np.save(os.path.join(folder, "threshold.npy"), compact.threshold.astype(np.float32))
+    np.save(os.path.join(folder, "children.npy"), compact.children.astype(node_type))
+    np.save(os.path.join(folder, "value.npy"), compact.value)
+    np.save(os.path.join(folder, "roots.npy"), compact.roots.astype(node_type))
+
+    # Meta written last, so a half written export never looks complete
+    meta = {
+        "format": EXPORT_FORMAT,
+        "classes": compact.classes_.tolist(),
+        "max_depth": compact.max_depth,
+        "n_features_in": compact.n_features_in_,
+        "feature_schema": compact.feature_schema_,
+        "preprocessing": compact.preprocessing_,
+    }
+    with open(os.path.join(folder, "meta.json"), "w") as file:
+        json.dump(meta, file)
+    return folder
+
+def load_forest(folder):
+    '''
+    Loads an exported forest folder as a Compact_Forest, memory mapping the arrays rather than reading them in.
+    '''
+    with open(os.path.join(folder, "meta.json")) as file:
+        meta = json.load(file)
+    if meta["format"] != EXPORT_FORMAT:
+        raise ValueError(f"{folder} was exported in format {meta['format']}, expected {EXPORT_FORMAT} - export it again")
+
+    # asarray drops the memmap subclass (just a plain view of the same memory), which keeps indexing fast
+    def mapped(name):
+        return np.asarray(np.load(os.path.join(folder, name + ".npy"), mmap_mode="r"))
+
+    return Compact_Forest(mapped("feature"), mapped("threshold"), mapped("children"), mapped("value"),
+                          roots=mapped("roots"),
+                          classes_=np.asarray(meta["classes"]),
+                          max_depth=meta["max_depth"],
+                          n_features_in_=meta["n_features_in"],
+                          feature_schema_=meta["feature_schema"],
+                          preprocessing_=meta.get("preprocessing", 1))
+
+def load_model(model_path):
+    '''
+    Loads an exercise model the fastest way available. Uses the exported folder if there is one that is newer than
+    the .joblib file, otherwise loads the .joblib file and converts it (see compile_model).
+    '''
+    folder = exported_path(model_path)
+    meta = os.path.join(folder, "meta.json")
+    if os.path.isfile(meta) and os.path.getmtime(meta) >= os.path.getmtime(model_path):
+        return load_forest(folder)
+    return compile_model(joblib.load(model_path))
+
+# Keeping models loaded between exercises and levels
+class Model_Cache():
+    '''
+    Keeps recently used exercise models loaded so switching exercises never has to wait on the disk. Models are
+    loaded with load_model and warmed up with one dummy prediction (so the first real frame doesn't pay for page
+    faults and lazy setup), and the least recently used ones are dropped once there are more than max_models.
+
+    A level can preload every model it will need up front (preload runs in a background thread), and get then just
+    hands back the already loaded model. Asking for a model that isn't loaded yet loads it right there in the
+    calling thread, or waits for the background load if one is already running. Safe to use from any thread.
+
+    Arguments:
+    - max_models: int, how many models to keep loaded at once
+
+    Protected Variables:
+    - _models: OrderedDict, model path -> loaded model, least recently used first
+    - _loading: dict, model path -> Event that gets set when its background load finishes
+    - _lock: Lock (threading)
+    '''
+    def __init__(self, max_models=3):
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._loading = {}
+        self._lock = Lock()
+
+    def _load(self, model_path):
+        '''
+        Loads, warms, and stores one model, unless someone else is already on it. "Private" function.
+        '''
+        model_path = str(model_path)
+        with self._lock:
+            # Already loaded, or already being loaded by another thread
+            if model_path in self._models:
+                self._models.move_to_end(model_path)
+                return self._models[model_path]
+            done = self._loading.get(model_path)
+            if done is None:
+                done = self._loading[model_path] = Event()
+                mine = True
+            else:
+                mine = False
+
+        # Someone else is loading it - wait for them and take theirs
+        if not mine:
+            done.wait()
+            with self._lock:
+                if model_path in self._models:
+                    return self._models[model_path]
+            # Their load failed, try it ourselves
+            return self._load(model_path)
+
+        try:
+            model = load_model(model_path)
+            # Warm up - one throwaway prediction on an empty row
+            model.predict(np.zeros((1, model.n_features_in_), dtype=np.float32))
+            with self._lock:
+                self._models[model_path] = model
+                # Evict least recently used models past the limit
+                while len(self._models) > self.max_models:
+                    self._models.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._loading[model_path]
+            done.set()
+        return model
+
+    def get(self, model_path):
+        '''
+        Returns the loaded model for a path, loading it first if it isn't cached yet.
+        '''
+        return self._load(model_path)
+
+    def preload(self, model_paths, wait=False):
+        '''
+        Loads and warms a list of model paths in a background thread, so they're ready by the time they're needed.
+        Pass wait=True to block until they're all loaded instead. Returns the thread doing the loading.
+        '''
+        def load_all():
+            for model_path in model_paths:
+                try:
+                    self._load(model_path)
+                except Exception as e:
+                    print(f"Could not preload model {model_path}: {e}")
+
+        loader = Thread(target=load_all, daemon=True)
+        loader.start()
+        if wait:
+            loader.join()
+        return loader
+
+    def is_loaded(self, model_path):
+        '''
+        True if the model is already loaded (so get will return instantly).
+        '''
+        with self._lock:
+            return str(model_path) in self._models
+
+def _floor_to_float32(threshold):
+    '''
+    Rounds float64 thresholds down to the nearest float32. Inputs are float32, and for any float32 x, x <= t is
+    the same as x <= (largest float32 not above t), so this keeps every split exactly the same as scikit learn's
+    while halving the threshold size. Plain rounding to nearest could round up and flip a split. "Private" function.
+    '''
+    rounded = threshold.astype(np.float32)
+    too_big = rounded.astype(np.float64) > threshold
+    rounded[too_big] = np.nextafter(rounded[too_big], np.float32(-np.inf))
+    return rounded
+
+# Checking the conversion
+def verify_against_sklearn(model, compact, n_samples=5000, seed=0):
+    '''
+    Compares a Compact_Forest's predictions against the scikit learn model it was made from and returns how many
+    rows disagreed (0 means they're identical).
+
+    Half the rows are random poses, and the other half are built out of the forest's own split thresholds (and the
+    float32 values just above them), since that's where a conversion would go wrong if it was going to.
+    '''
+    rng = np.random.default_rng(seed)
+    n_features = model.n_features_in_
+
+    # Random landmark-ish values: x and y in about [0, 1], z in about [-1, 1], visibility in [0, 1]
+    random_rows = rng.uniform(-1.0, 1.5, size=(n_samples // 2, n_features)).astype(np.float32)
+
+    # Values sitting right on top of (or a hair above) real thresholds, placed in the feature they split on
+    splits = compact.threshold != np.inf
+    split_features = compact.feature[splits]
+    split_values = compact.threshold[splits]
+    edge_rows = np.tile(np.median(random_rows, axis=0), (n_samples - n_samples // 2, 1))
+    for row in edge_rows:
+        picks = rng.integers(0, split_values.shape[0], size=n_features)
+        values = split_values[picks]
+        nudge = rng.random(n_features) < 0.5
+        values[nudge] = np.nextafter(values[nudge], np.float32(np.inf))
+        row[split_features[picks]] = values
+
+    X = np.concatenate((random_rows, edge_rows))
+    return int(np.count_nonzero(model.predict(X) != compact.predict(X)))
+
+# Run this file directly to check the bundled models convert exactly and see how much faster they are
+# Run it as "python forest.py export" to also export them for fast loading
+if __name__ == "__main__":
+    import sys
+    import enumoptions as op
+
+    for path in (op.Model_Paths.EX_DEFAULT, op.Model_Paths.KNEES_N_LEGS,
+                 op.Model_Paths.SIT_N_PUSHUP, op.Model_Paths.HACK_N_SLASH):
+        start = time.perf_counter()
+        model = joblib.load(path.value)
+        joblib_ms = (time.perf_counter() - start) * 1000
+        compact = compact_forest(model)
+        mismatches = verify_against_sklearn(model, compact)
+
+        # Exporting, then checking what comes back off disk still matches
+        if "export" in sys.argv[1:] and mismatches == 0:
+            folder = export_forest(path.value, compact)
+            start = time.perf_counter()
+            compact = load_forest(folder)
+            mapped_ms = (time.perf_counter() - start) * 1000
+            mismatches = verify_against_sklearn(model, compact)
+            print(f"{path.name}: exported to {folder}, joblib load {joblib_ms:.1f} ms, mapped load {mapped_ms:.1f} ms")
+
+        # Timing single rows, which is how the camera thread uses them
+        row = np.random.default_rng(1).uniform(0.0, 1.0, size=(1, model.n_features_in_)).astype(np.float32)
+        timings = []
+        for predictor in (model, compact):
+            predictor.predict(row)
+            start = time.perf_counter()
+            for _ in range(200):
+                predictor.predict(row)
+            timings.append((time.perf_counter() - start) / 200 * 1000)
+
+        print(f"{path.name}: {mismatches} mismatches, sklearn {timings[0]:.3f} ms/frame, "
+              f"compact {timings[1]:.3f} ms/frame ({timings[0] / timings[1]:.1f}x)")
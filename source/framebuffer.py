@@ -0,0 +1,88 @@
+from threading import Lock
+from contextlib import contextmanager
+import numpy as np
+
+'''
+A double buffered image that one thread writes into and another reads from, without either side allocating
+anything per frame or sending the image across threads in an event.
+
+The camera thread writes the player portrait into it once per new result (see annotate and frame_buffer in
+poseestim.py), and the portrait widget reads the newest one on its own timer (see Player_Portrait.start_pull in
+helpers.py). This file imports neither of those, so it can sit between them without breaking the rule that pose
+estimation and the GUI helpers stay out of each other's business.
+'''
+
+class Shared_Frame_Buffer():
+    '''
+    Two preallocated images of a fixed size - the front one holds the newest finished frame for readers, the back
+    one is where the writer puts the next one. The writer fills the back buffer with no lock held (drawing straight
+    into it with writing, or copying a finished image in with write), then swaps the two under a lock that's only
+    held for the swap and for reads, so the writer never draws over an image someone is in the middle of reading.
+
+    Only one thread should write. Any number can read, but keep reads short (the writer waits on them to swap).
+
+    Arguments:
+    - width: int
+    - height: int
+    - channels: int (3 for RGB)
+
+    READ-ONLY Public Variables:
+    - frame_id: int, id of the frame in the front buffer (0 means nothing written yet)
+    - shape: tuple (height, width, channels)
+
+    Protected Variables:
+    - _buffers: list of two ndarrays
+    - _front: int, index of the front buffer
+    - _lock: Lock (threading)
+    '''
+    def __init__(self, width, height, channels=3):
+        # READ-ONLY Public Variables
+        self.shape = (height, width, channels)
+        self.frame_id = 0
+
+        # Protected variables
+        self._buffers = [np.zeros(self.shape, dtype=np.uint8), np.zeros(self.shape, dtype=np.uint8)]
+        self._front = 0
+        self._lock = Lock()
+
+    @contextmanager
+    def writing(self, frame_id=None):
+        '''
+        Context manager giving the back buffer to draw the next frame straight into, so it never has to be copied
+        in - it becomes the newest frame once the with block is done (nothing changes if the block raises).
+        Overwrite all of it, it still holds whatever was drawn two frames ago. frame_id defaults to one more
+        than the last one.
+
+            with buffer.writing() as image:
+                cv2.flip(drawing, 1, dst=image)
+        '''
+        # Back buffer isn't visible to readers, so no lock needed to fill it
+        back = 1 - self._front
+        yield self._buffers[back]
+
+        # Swap it to the front (waits for any read in progress to finish)
+        with self._lock:
+            self._front = back
+            self.frame_id = self.frame_id + 1 if frame_id is None else frame_id
+
+    def write(self, image, frame_id=None):
+        '''
+        Copies an image (same shape as the buffer, uint8) in as the newest frame. frame_id defaults to one more
+        than the last one. If you're drawing the image just for this, draw it into writing's buffer instead.
+        '''
+        if image.shape != self.shape:
+            raise ValueError(f"Image of shape {image.shape} doesn't fit a frame buffer of shape {self.shape}")
+        with self.writing(frame_id) as back:
+            np.copyto(back, image)
+
+    @contextmanager
+    def latest(self):
+        '''
+        Context manager giving (image, frame_id) for the newest frame. The image is only safe to use inside the
+        with block - convert or copy it there, and keep it quick:
+
+            with buffer.latest() as (image, frame_id):
+                pixmap = QPixmap.fromImage(QImage(image.data, ...))
+        '''
+        with self._lock:
+            yield self._buffers[self._front], self.frame_id
@@ -8,6 +8,7 @@ from PySide6.QtCore import (
     QPoint,
     QRectF,
     Signal,
+    QTimer,
 )
 from PySide6.QtGui import (
     QImage,
@@ -31,11 +32,14 @@ from PySide6.QtWidgets import (
     QTextEdit,
     QFrame,
 )
-from time import sleep
+from threading import Condition, Event, Lock, RLock, current_thread, main_thread, local
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
+from time import perf_counter
 import numpy as np
-import cv2
 import os
 import enumoptions as op
+import assetpack as ap
 
 '''
 These are helper functions to aid in building the GUI, creating animations, and changing the existing GUI in a thread 
@@ -61,36 +65,186 @@ class InvokeEvent(QEvent):
         self.fn = fn
         self.args = args
         self.kwargs = kwargs
+        self.key = None     # Set for coalesced calls - the real fn and args are waiting in _pending_calls
+        self.ack = None     # Invoke_Ack to fill in once the call is done, if anyone asked for one
 
 class Invoker(QObject):
     def event(self, event):
-        event.fn(*event.args, **event.kwargs)
+        if event.type() != InvokeEvent.EVENT_TYPE:
+            return super().event(event)
+        global _queued
+
+        # Coalesced calls run with whatever arguments are newest by now
+        fn, args, kwargs = event.fn, event.args, event.kwargs
+        if event.key is not None:
+            with _queue_cond:
+                fn, args, kwargs = _pending_calls.pop(event.key)
+
+        result, error = None, None
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # One less in the queue - wake up anyone waiting for room
+            with _queue_cond:
+                _queued -= 1
+                _queue_cond.notify_all()
+            if event.ack is not None:
+                event.ack._done(result, error)
 
         return True
 
 _invoker = Invoker()
 
+# Queue bookkeeping, so the event queue can't grow forever (see invoke)
+max_queued = 256            # Most calls allowed to wait in the queue before invoke blocks for room
+_queued = 0                 # Calls posted but not run yet
+_pending_calls = {}         # key -> [fn, args, kwargs] for coalesced calls not run yet (see invoke_latest)
+_queue_cond = Condition()   # Guards the three above, notified whenever a call finishes
+_aborting = Event()         # Set while a level is closing - calls from other threads get dropped (see abort_invokes)
+
+class Invoke_Ack():
+    '''
+    Acknowledgement for a call sent with invoke_acked. Wait on it to know the main thread has actually run the
+    call, and to get its return value.
+
+    READ-ONLY Public Variables:
+    - result: whatever the function returned (None until done)
+    - error: the exception it raised, if it did
+    '''
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self._event = Event()
+
+    def _done(self, result, error):
+        self.result = result
+        self.error = error
+        self._event.set()
+
+    def wait(self, timeout=None):
+        '''
+        Blocks until the main thread has run the call (or timeout seconds pass). Returns True if it's done - if the
+        call got dropped by abort_invokes, error is a RuntimeError.
+
+        Also gives up (returning False) once abort_invokes is called, since the main thread might be busy waiting
+        for this very thread to finish.
+        '''
+        deadline = None if timeout is None else perf_counter() + timeout
+        while not self._event.is_set():
+            if _aborting.is_set():
+                return False
+            left = 0.05 if deadline is None else min(0.05, deadline - perf_counter())
+            if left <= 0:
+                break
+            self._event.wait(left)
+        return self._event.is_set()
+
+    def is_done(self):
+        return self._event.is_set()
+
+def _post(event, block):
+    '''
+    Posts an event to the main thread, first waiting for room in the queue if block is set. The main thread
+    itself never waits (it's the one that makes room). While abort_invokes is in effect, calls from other threads
+    are dropped instead, waiting or not. Returns whether the call was posted. "Private" function.
+    '''
+    global _queued
+    in_main = current_thread() is main_thread()
+    with _queue_cond:
+        # Short waits, so an abort gets noticed even though nothing notifies us about it
+        while not in_main and not _aborting.is_set():
+            if not block or _queued < max_queued:
+                break
+            _queue_cond.wait(0.05)
+        if not in_main and _aborting.is_set():
+            if event.key is not None:
+                _pending_calls.pop(event.key, None)
+            if event.ack is not None:
+                event.ack._done(None, RuntimeError("Call dropped, invokes were aborted"))
+            return False
+        _queued += 1
+    QCoreApplication.postEvent(_invoker, event)
+    return True
+
+def abort_invokes():
+    '''
+    Makes every invoke from a thread other than main get dropped (and any waiting invoke give up) until
+    resume_invokes is called. Call this on the main thread right before joining a thread that invokes things -
+    otherwise, if that thread is waiting for room in a full queue, it waits on main while main waits on it.
+    '''
+    _aborting.set()
+    with _queue_cond:
+        _queue_cond.notify_all()
+
+def resume_invokes():
+    '''
+    Undoes abort_invokes, once the thread it was for is done.
+    '''
+    _aborting.clear()
+
 def invoke_in_main_thread(fn, *args, **kwargs):
     '''
     Function to invoke an event in the main GUI thread safely from another thread. Don't use too
     often too quickly or you'll overwhelm main and cause a memory leak. 
     
     # Use invoke(fn, args) instead,
-    it has built in buffering of 1 millisecond.
+    it waits for room in the queue when the main thread falls behind.
     '''
-    QCoreApplication.postEvent(_invoker,
-        InvokeEvent(fn, *args, **kwargs))
+    _post(InvokeEvent(fn, *args, **kwargs), False)
 
-def invoke(fn, *args, **kwargs): # Just the above func but with a buffer built in
+def invoke(fn, *args, **kwargs): # Just the above func but with backpressure built in
     '''
     Same as invoke_in_main_thread but with throttling built in so main thread isn't overwhelmed.
 
-    Our game loop is way faster than the main thread, we have to buffer with sleep. Otherwise, the 
-    events we invoke would pile up faster than qt can take care of them, causing a memory leak.
-    Might experiment with a feedback 'ack' system later, but for now this works fine.
+    Calls run in the order they were invoked. Our game loop can be way faster than the main thread, so if more
+    than max_queued calls are already waiting, this blocks until the main thread catches up. That keeps the
+    event queue (and memory) bounded, without slowing the loop down at all while the main thread keeps up.
+
+    For things that get updated over and over (like the player portrait or HP bar), use invoke_latest instead.
+    While a level is closing (see abort_invokes) the call is just dropped.
     '''
-    invoke_in_main_thread(fn, *args, **kwargs)
-    sleep(0.001)
+    _post(InvokeEvent(fn, *args, **kwargs), True)
+
+def invoke_latest(fn, *args, **kwargs):
+    '''
+    Like invoke, but for updates where only the newest one matters. If a call to the same function (same object
+    and method) is still waiting to run, it just gets the new arguments instead of queueing another call behind
+    it - so the main thread only ever draws the freshest frame, and a slow main thread can't pile them up.
+
+    Never blocks. Since a waiting call keeps its place in line, only use this for functions that just set
+    some state (update_frame, update_stat_bar, set_text...), not ones where the order or count matters.
+    '''
+    key = fn
+    with _queue_cond:
+        pending = _pending_calls.get(key)
+        if pending is not None:
+            pending[1], pending[2] = args, kwargs
+            return
+        _pending_calls[key] = [fn, args, kwargs]
+    event = InvokeEvent(fn)
+    event.key = key
+    _post(event, False)
+
+def invoke_acked(fn, *args, **kwargs):
+    '''
+    Like invoke, but returns an Invoke_Ack you can wait on to know when the main thread has run the call, and
+    to get its return value - handy when the level thread needs something from a QObject, or must be sure
+    something is on screen before carrying on.
+    '''
+    event = InvokeEvent(fn, *args, **kwargs)
+    event.ack = Invoke_Ack()
+    _post(event, True)
+    return event.ack
+
+def pending_depth():
+    '''
+    How many invoked calls are waiting for the main thread to run them. A number that keeps growing means
+    the main thread can't keep up with what the level is asking of it.
+    '''
+    return _queued
 
 ##########
 # LEVEL UI - include classes for video feed, which will eventually take capture input from pose estim but only as input by levels.py
@@ -120,7 +274,66 @@ class Level_Widget(QWidget):
         
         self.SIGNAL.CLOSE.emit()
 
-### Player Portrait 
+### Loading indicator
+class Loading_Indicator(QWidget):
+    '''
+    RETURNS A Q CLASS - DO NOT USE OUTSIDE OF MAIN THREAD
+
+    A line of text over a progress bar in the middle of the screen, for while something is starting up (levels.py
+    uses it while the camera thread gets going). Hides itself once the progress reaches the maximum, and shows
+    itself again if it goes back down. Update it from other threads with invoke_latest(indicator.set_progress, ...)
+    '''
+    def __init__(self, text="Loading...", maximum=100, rel_w=.3, parent=None):
+        super(Loading_Indicator, self).__init__(parent)
+        self.setAttribute(Qt.WA_TranslucentBackground)
+
+        # Text
+        self.label = QLabel(text)
+        self.label.setStyleSheet(
+            "font-family: Helvetica, sans-serif; color: rgb(230, 230, 230);")
+
+        # Bar, same look as the hp bar but white
+        self.bar = QProgressBar()
+        self.bar.setMaximum(maximum)
+        self.bar.setTextVisible(False)
+        self.bar.setStyleSheet("""
+            QProgressBar {
+                background-color: rgba(1, 1, 1, 0);
+                border: 1px solid #ccc;
+                border-radius: 1px;
+            }
+
+            QProgressBar::chunk {
+                background-color: rgb(230, 230, 230);
+                border-radius: 1px;
+            }
+        """)
+        self.bar.setFixedHeight(QFontMetrics(self.label.font()).height())
+
+        # Arranging the layout
+        self.main_layout = QVBoxLayout()
+        self.main_layout.addWidget(self.label, alignment=Qt.AlignVCenter|Qt.AlignHCenter)
+        self.main_layout.addWidget(self.bar)
+        self.setLayout(self.main_layout)
+
+        # Centered on screen
+        w, h = get_avail_geo()
+        self.setFixedWidth(int(w * rel_w))
+        self.adjustSize()
+        self.move(int((w - self.width()) / 2), int((h - self.height()) / 2))
+
+    def set_progress(self, value: int, maximum: int =None, text: str =None):
+        '''
+        Sets how far along it is, and optionally the maximum and the text. Call using invoke_latest().
+        '''
+        if maximum is not None:
+            self.bar.setMaximum(maximum)
+        self.bar.setValue(value)
+        if text is not None:
+            self.label.setText(text)
+        self.setVisible(value < self.bar.maximum())
+
+### Player Portrait
 class Player_Portrait(QWidget):
     '''
     RETURNS A Q CLASS - DO NOT USE OUTSIDE OF MAIN THREAD
@@ -150,6 +363,14 @@ class Player_Portrait(QWidget):
         # Variable to hold new input frame
         self.new_frame = None
 
+        # Reused output of reformat_image in update_frame
+        self._frame_buf = None
+
+        # Pull mode - a timer reading the newest frame out of a shared frame buffer (see start_pull)
+        self._pull_timer = None
+        self._pull_buffer = None
+        self._shown_id = -1
+
         # These can't change dynamically or it breaks
         self._show_name = show_name
         self._show_coords = show_coords
@@ -240,12 +461,66 @@ class Player_Portrait(QWidget):
     # These next few functions are meant to be accessible publicly 
     #
     
+    # Showing frames straight out of a shared buffer instead of being sent each one
+    def start_pull(self, frame_buffer, fps=None):
+        '''
+        Switches the portrait to pull mode - a timer on the main thread checks a Shared_Frame_Buffer (see
+        framebuffer.py) and shows the newest frame in it, instead of the level sending every frame with
+        update_frame. Frames in the buffer should be preformatted (portrait sized, mirrored, RGB), which is
+        what the camera thread writes when it's given the buffer.
+
+        Checks at the screen's refresh rate, or fps if that's lower, and only converts a frame when it's new -
+        so it's at most one conversion per frame actually shown, and no events sent from other threads at all.
+
+        Only call this func from the main thread (or using invoke).
+        '''
+        self.stop_pull()
+        screen = QGuiApplication.primaryScreen()
+        refresh = screen.refreshRate() if screen is not None else 60
+        if fps is not None:
+            refresh = min(refresh, fps)
+        self._pull_buffer = frame_buffer
+        self._shown_id = -1
+        self._pull_timer = QTimer(self)
+        self._pull_timer.setTimerType(Qt.PreciseTimer)
+        self._pull_timer.timeout.connect(self._pull_frame)
+        self._pull_timer.start(max(1, int(1000 / refresh)))
+
+    def stop_pull(self):
+        '''
+        Stops pull mode (see start_pull), the portrait keeps showing the last frame.
+        '''
+        if self._pull_timer is not None:
+            self._pull_timer.stop()
+            self._pull_timer.deleteLater()
+        self._pull_timer = None
+        self._pull_buffer = None
+
+    def _pull_frame(self):
+        '''
+        Timer callback for pull mode - shows the newest frame in the buffer if it hasn't been shown yet.
+        "Private" function.
+        '''
+        frame_buffer = self._pull_buffer
+        # Cheap check first, most ticks have nothing new
+        if frame_buffer is None or self._still_portrait or frame_buffer.frame_id == self._shown_id:
+            return
+        with frame_buffer.latest() as (frame, frame_id):
+            # The one conversion - QImage just wraps the buffer, fromImage copies it into the pixmap
+            image = QImage(frame.data, frame.shape[1], frame.shape[0], frame.strides[0], QImage.Format_RGB888)
+            pixmap = QPixmap.fromImage(image)
+        self._shown_id = frame_id
+        self.frame_label.setPixmap(pixmap)
+
     # Updates the video feed with a new input frame
-    def update_frame(self, mp_frame: np.ndarray):
+    def update_frame(self, mp_frame: np.ndarray, preformatted=False):
         '''
         Pass an annotated mediapipe frame image, or even a plain cam feed frame, to draw onto the UI portrait.
         Takes any image formatted as ndarray or matlike - color should be BGR, because OpenCV and mediapipe
         are weird. 
+
+        If the image is already portrait sized, mirrored, and RGB (like the camera thread's get_annotation),
+        pass preformatted=True to skip all that and just show it.
         
         Only call this func using invoke_in_main_thread().
         
@@ -253,11 +528,18 @@ class Player_Portrait(QWidget):
         '''
         # If player didn't want a live feed and just wants a still portrait, ignore 
         # (ideally do this check in game logic loop to prevent unnecessary calls)
-        if self._still_portrait:
+        if self._still_portrait or mp_frame is None:
             return None
 
-        # Resize down, flip image, and correct BGR to RGB
-        new_frame = reformat_image(mp_frame, self.video_size.width(), self.video_size.height())
+        # Resize down, flip image, and correct BGR to RGB (unless the camera thread already did)
+        if preformatted:
+            new_frame = mp_frame
+        else:
+            # Into the same buffer every time (fromImage below copies it out, so it's free to reuse)
+            shape = reformat_shape(mp_frame.shape, self.video_size.width(), self.video_size.height())
+            if self._frame_buf is None or self._frame_buf.shape != shape:
+                self._frame_buf = np.empty(shape, dtype=np.uint8)
+            new_frame = reformat_image(mp_frame, self.video_size.width(), self.video_size.height(), dst=self._frame_buf)
 
         # Converting from numpy array to Qt's format
         self.image = QImage(new_frame, new_frame.shape[1], new_frame.shape[0], 
@@ -343,6 +625,7 @@ class NPC_Portrait(QWidget):
         self.idx = 0 # Index of first image in list
         self.num_paths = len(img_paths)
         self.img_paths = img_paths
+        sprite_cache.preload(img_paths) # So cycling through them later doesn't touch the disk
 
         #
         self.name = npc_name
@@ -353,7 +636,7 @@ class NPC_Portrait(QWidget):
         # QLabel to hold user NPC img
         self.frame_label = QLabel()
         self.frame_label.setFixedSize(self.img_size)
-        self.pixmap = QPixmap(self.img_paths[0])
+        self.pixmap = sprite_cache.get(self.img_paths[0])
         self.frame_label.setPixmap(self.pixmap)
 
         # Label for NPC name
@@ -381,10 +664,10 @@ class NPC_Portrait(QWidget):
         new image file. If input is None, sets the image to blank.
         '''
         if new_path is None:
-            new_path = [str(os.path.join(op.root_dir, "assets", "characters", "blank.png"))]
+            new_path = str(os.path.join(op.root_dir, "assets", "characters", "blank.png"))
 
-        # Setting an entirely new image, so reassign pixmap
-        self.pixmap = QPixmap(new_path)
+        # Setting an entirely new image, so reassign pixmap (cached, so only the first time hits the disk)
+        self.pixmap = sprite_cache.get(new_path)
         self.frame_label.setPixmap(self.pixmap)
     
     def set_new_name(self, new_name):
@@ -412,6 +695,7 @@ class NPC_Portrait(QWidget):
         self.idx = 0 # Index of first image in list
         self.num_paths = len(img_paths)
         self.img_paths = img_paths
+        sprite_cache.preload(img_paths)
     
     def cycle_img(self, index:int =None):
         '''
@@ -424,14 +708,15 @@ class NPC_Portrait(QWidget):
             # adds one, looping back to zero if out of range
             self.idx = ((self.idx + 1) % self.num_paths)
         else:
-            index = (index % self.num_paths)
+            self.idx = (index % self.num_paths)
 
         # Setting an entirely new image, so reassign pixmap
-        self.pixmap = QPixmap(self.img_paths[index])
+        self.pixmap = sprite_cache.get(self.img_paths[self.idx])
         self.frame_label.setPixmap(self.pixmap)
 
 # Helper functions for portrait      
-def reformat_image(image: np.ndarray, new_height = 150, new_width = 150, reformat_mode = 3):
+def reformat_image(image: np.ndarray, new_height = 150, new_width = 150, reformat_mode = 3, dst = None,
+                   interpolation = None):
     '''
     Reformat image to fit in frame. Takes as input the image ndarray, the new height, the new width, and the 
     reformat mode.
@@ -443,42 +728,108 @@ def reformat_image(image: np.ndarray, new_height = 150, new_width = 150, reforma
     Mode 0 is stretch
     Mode 1 is preserve ratio and scale down to width
     Mode 2 (and the default case) is scale to width, center, and truncate to desired dimensions
-    '''
-    # Set up return variable
-    new_image = None
-
-    # Getting current image shape
-    image_shape = image.shape
-    height = image_shape[0]
-    width = image_shape[1]
-
-    # Deciding how to resize image
-    if reformat_mode == 0: 
-        # Stretch
-        new_res = (new_height, new_width)
-        new_image = cv2.resize(image, new_res, interpolation= cv2.INTER_AREA)
-    elif reformat_mode == 1: 
-        # Perserve ratio, scale down to specified width
-        ratio = (new_width / width)
 
-        new_image = cv2.resize(image, None, fx= ratio, fy= ratio, interpolation= cv2.INTER_AREA)
+    Crops before resizing (so it never resizes pixels that get cut off anyway), resizes into a reused scratch
+    buffer, then mirrors and swaps BGR to RGB straight into the output. Pass a preallocated, contiguous uint8
+    array as dst (see reformat_shape for its shape) and nothing gets allocated at all - the result is dst
+    itself, ready for a QImage to wrap without copying. Without dst a new array is returned, like before.
+    bench_reformat.py checks it against the original version and times them both. interpolation is a cv2 flag
+    (INTER_AREA if None).
+    '''
+    import cv2 # Here instead of at the top, so OpenCV isn't loaded before the menu can show (see warmup.py)
+    if interpolation is None:
+        interpolation = cv2.INTER_AREA
+
+    # Getting current image shape, and the output's (reformat_shape is the one place sizes get worked out, so a
+    # preallocated dst always fits and cv2 never picks a size of its own)
+    height = image.shape[0]
+    width = image.shape[1]
+    shape = reformat_shape(image.shape, new_height, new_width, reformat_mode)
+    out_h, out_w = shape[0], shape[1]
+
+    # Output buffer
+    if dst is None:
+        dst = np.empty(shape, dtype=np.uint8)
+    elif dst.shape != shape or not dst.flags['C_CONTIGUOUS']:
+        raise ValueError(f"reformat_image needs a contiguous dst of shape {shape}, got {dst.shape}")
+
+    # Deciding what part of the image to keep, then resizing it into scratch
+    strip = _reformat_strip(image.shape, new_height) if reformat_mode not in (0, 1) else None
+    if strip is not None:
+        # Taller than it is wide (vertical camera) - scale the whole thing to height keeping its aspect ratio,
+        # then take the same strip of it the original always did
+        scaled_h, scaled_w, rows, left, right = strip
+        scratch = _reformat_scratch((scaled_h, scaled_w, image.shape[2]))
+        cv2.resize(image, (scaled_w, scaled_h), dst=scratch, interpolation=interpolation)
+        scratch = scratch[:rows, left:right]
     else:
-        # Default, scale down to height and crop to get a square, perserving the center
-        ratio = (new_height / height)
-        scaled_width = int(width * ratio)
-
-        temp = cv2.resize(image, None, fx= ratio, fy= ratio, interpolation= cv2.INTER_AREA)
-
-        # Cropping so as to leave a strip of the center equal to height
-        left = int((scaled_width / 2) - (new_height / 2))
-        right = left + new_height
-        new_image = temp[0:new_height, left:right]
-
-    # Fixing the color and mirroring it
-    new_image = cv2.cvtColor(new_image, cv2.COLOR_BGR2RGB)
-    new_image = cv2.flip(new_image, 1)
-    
-    return new_image
+        if reformat_mode in (0, 1):
+            # Stretch, or preserve ratio and scale down to width - the whole image either way
+            source = image
+        else:
+            # Default, a square of new_height from the center - cropped out of the original before scaling it down
+            ratio = (new_height / height)
+            scaled_width = int(width * ratio)
+            left = max(0, int((scaled_width / 2) - (new_height / 2)))
+            src_left = int(round(left / ratio))
+            src_right = min(width, src_left + int(round(new_height / ratio)))
+            source = image[:, src_left:src_right]
+        scratch = _reformat_scratch(shape)
+        cv2.resize(source, (out_w, out_h), dst=scratch, interpolation=interpolation)
+
+    # Mirror into the output, then swap the colour channels in place
+    cv2.flip(scratch, 1, dst=dst)
+    cv2.cvtColor(dst, cv2.COLOR_BGR2RGB, dst=dst)
+    return dst
+
+def reformat_shape(image_shape, new_height = 150, new_width = 150, reformat_mode = 3):
+    '''
+    The shape reformat_image's output will have for an input of image_shape, for preallocating its dst. Always
+    the same shape the original version gave back (see bench_reformat.py).
+    '''
+    height, width, channels = image_shape[0], image_shape[1], image_shape[2]
+    if reformat_mode == 0:
+        return (new_width, new_height, channels)
+    if reformat_mode == 1:
+        # Rounded like cv2 sizes a resize by a scale factor
+        ratio = (new_width / width)
+        return (int(round(height * ratio)), int(round(width * ratio)), channels)
+    strip = _reformat_strip(image_shape, new_height)
+    if strip is not None:
+        scaled_h, scaled_w, rows, left, right = strip
+        return (rows, right - left, channels)
+    return (new_height, new_height, channels)
+
+def _reformat_strip(image_shape, new_height):
+    '''
+    For the default reformat mode - None if the image is wide enough for a centered square of new_height (the
+    usual case). Otherwise (a vertical camera), the original scaled it to height and its crop went off the
+    left edge, so slicing wrapped around and kept a strip off the right instead. Returns where that strip is:
+    (scaled height, scaled width, rows, left, right), sizes rounded like cv2. "Private" function.
+    '''
+    height, width = image_shape[0], image_shape[1]
+    ratio = (new_height / height)
+    left = int((int(width * ratio) / 2) - (new_height / 2))
+    if left >= 0:
+        return None
+    scaled_h, scaled_w = int(round(height * ratio)), int(round(width * ratio))
+    left, right, _ = slice(left, left + new_height).indices(scaled_w)
+    return scaled_h, scaled_w, min(new_height, scaled_h), left, max(left, right)
+
+# Scratch buffers for reformat_image, one set per thread so threads never share one
+_reformat_local = local()
+
+def _reformat_scratch(shape):
+    '''
+    The calling thread's scratch buffer for a given shape, made the first time it's asked for. "Private" function.
+    '''
+    buffers = getattr(_reformat_local, 'buffers', None)
+    if buffers is None:
+        buffers = _reformat_local.buffers = {}
+    scratch = buffers.get(shape)
+    if scratch is None:
+        scratch = buffers[shape] = np.empty(shape, dtype=np.uint8)
+    return scratch
 
 def trunc_float_to_str(f_val: float, n=2):
     '''
@@ -844,13 +1195,17 @@ class Q_NPC(QGraphicsObject):
         self.num_paths = len(img_paths)
         self.img_paths = img_paths
 
-        # Setting image and scaling it
-        self.pixmap = QPixmap(img_paths[0])
+        # Setting image and scaling it (the rest get decoded at the same scale in the background, since
+        # cycle_img keeps the height by default)
         # TODO: give option for wonky stretch/scale if both width and height given (only true scale if one is none)
         if height_norm is not None:
-            self.pixmap = self.pixmap.scaledToHeight(norm_to_pixel(height_norm, 1))
+            resize_mode, size = 2, norm_to_pixel(height_norm, 1)
         elif width_norm is not None:
-            self.pixmap = self.pixmap.scaledToWidth(norm_to_pixel(width_norm, 0))
+            resize_mode, size = 1, norm_to_pixel(width_norm, 0)
+        else:
+            resize_mode, size = 0, 0
+        sprite_cache.preload(img_paths[1:], resize_mode, size)
+        self.pixmap = sprite_cache.get(img_paths[0], resize_mode, size)
         
         # Getting initial size
         self.size = self.pixmap.size()
@@ -889,14 +1244,14 @@ class Q_NPC(QGraphicsObject):
         # Store old image dimensions to properly erase it (in case new pix is smaller)
         self._old_bounds = self.boundingRect()
 
-        # Setting an entirely new image, so reassign pixmap
-        self.pixmap = QPixmap(new_path)
-
-        # Resize if desired TODO: give option for wonky resize
+        # Setting an entirely new image, so reassign pixmap, resized if desired (cached per path and size)
+        # TODO: give option for wonky resize
         if new_height_norm is not None:
-            self.pixmap = self.pixmap.scaledToHeight(norm_to_pixel(new_height_norm, 1))
+            self.pixmap = sprite_cache.get(new_path, 2, norm_to_pixel(new_height_norm, 1))
         elif new_width_norm is not None:
-            self.pixmap = self.pixmap.scaledToWidth(norm_to_pixel(new_width_norm, 0))
+            self.pixmap = sprite_cache.get(new_path, 1, norm_to_pixel(new_width_norm, 0))
+        else:
+            self.pixmap = sprite_cache.get(new_path)
 
         # Updating size variables
         self.size = self.pixmap.size()
@@ -921,19 +1276,19 @@ class Q_NPC(QGraphicsObject):
             # adds one, looping back to zero if out of range
             self.idx = ((self.idx + 1) % self.num_paths)
         else:
-            index = (index % self.num_paths)
+            self.idx = (index % self.num_paths)
         
         # Store old image dimensions to properly erase it (in case new pix is smaller)
         self._old_bounds = self.boundingRect()
 
-        # Setting an entirely new image, so reassign pixmap
-        self.pixmap = QPixmap(self.img_paths[index])
-
-        # Resize if desired TODO give option for wonky resize
+        # Setting an entirely new image, so reassign pixmap, resized if desired (cached per path and size)
+        # TODO give option for wonky resize
         if resize_mode == 1:
-            self.pixmap = self.pixmap.scaledToWidth(self.width)
+            self.pixmap = sprite_cache.get(self.img_paths[self.idx], 1, self.width)
         elif resize_mode == 2:
-            self.pixmap = self.pixmap.scaledToHeight(self.height)
+            self.pixmap = sprite_cache.get(self.img_paths[self.idx], 2, self.height)
+        else:
+            self.pixmap = sprite_cache.get(self.img_paths[self.idx])
 
         # Updating size variables
         self.size = self.pixmap.size()
@@ -1012,6 +1367,290 @@ def pixel_to_norm(pixel_value: int, mode: int, resolution: tuple =None):
     else:
         return (pixel_value/height)
 
+##########
+# SPRITE CACHE
+
+class Sprite_Cache():
+    '''
+    Process wide cache of decoded (and scaled) sprites, so swapping an NPC's expression or flipping through
+    animation frames doesn't decode a PNG off disk on the GUI thread every time. Q_NPC and NPC_Portrait go
+    through the shared one at the bottom of this section (sprite_cache), you probably want to as well.
+
+    Sprites are keyed by (path, resize_mode, size) - resize_mode is the same as Q_NPC.cycle_img, 0 is as is,
+    1 is scaled to a width, 2 is scaled to a height. Least recently used sprites get dropped once the total goes
+    over the memory budget (counted as width * height * 4 bytes each).
+
+    preload() can be called from any thread - it decodes and scales QImages in a small worker pool (QImage is
+    fine off the GUI thread, QPixmap is not). get() has to be called from the GUI thread, it turns the QImage
+    into a QPixmap the first time it's asked for and hands back the same pixmap after that. Asking for
+    something that wasn't preloaded still works, it just decodes right there like QPixmap(path) used to.
+
+    Arguments:
+    - budget_mb: float, rough memory cap for everything cached (default 256)
+    - workers: int, decode threads (default 2)
+
+    READ-ONLY Public Variables:
+    - used_bytes: int, current size of everything cached
+    - hits: int, times get() found the sprite ready
+    - misses: int, times get() had to decode on the spot
+
+    Protected Variables:
+    - _entries: OrderedDict, key -> QImage (decoded, not converted yet) or QPixmap, oldest first
+    - _pending: dict, key -> Future for decodes in flight
+    - _lock: RLock (threading), guards the two above and used_bytes
+    - _pool: ThreadPoolExecutor, made on first preload
+    '''
+    def __init__(self, budget_mb=256, workers=2):
+        # Arguments
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.workers = workers
+
+        # READ-ONLY Public Variables
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Protected Variables
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = RLock() # Reentrant, a decode that's already done runs _finish right inside preload
+        self._pool = None
+
+    @staticmethod
+    def key(path, resize_mode=0, size=0):
+        '''
+        The key a sprite is stored under. Size is ignored when resize_mode is 0.
+        '''
+        path = str(path)
+        if not resize_mode:
+            return (path, 0, 0)
+        return (path, int(resize_mode), int(size))
+
+    @staticmethod
+    def _decode(key):
+        '''
+        Reads and scales one sprite as a QImage. Safe on any thread. "Private" function.
+        '''
+        path, resize_mode, size = key
+        # Out of a mounted asset pack if one has it (already decoded if the pack was built with raw pixels)
+        image = ap.image(path)
+        if image is None:
+            image = QImage(path)
+        # Convert to the format a pixmap would hold before scaling, like QPixmap does, so the sprites come out
+        # pixel for pixel the same as before (and fromImage has nothing left to convert on the GUI thread)
+        if not image.isNull():
+            image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied if image.hasAlphaChannel()
+                                          else QImage.Format_RGB32)
+        # Same (fast) transformation QPixmap.scaledTo... used
+        if resize_mode == 1:
+            image = image.scaledToWidth(size)
+        elif resize_mode == 2:
+            image = image.scaledToHeight(size)
+        return image
+
+    def _store(self, key, item):
+        '''
+        Puts a QImage or QPixmap in as the newest entry and trims back to budget. Call with the lock held.
+        "Private" function.
+        '''
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.used_bytes -= old.width() * old.height() * 4
+        self._entries[key] = item
+        self.used_bytes += item.width() * item.height() * 4
+        self._trim(keep=key)
+
+    def _trim(self, keep=None):
+        '''
+        Drops oldest entries until we're under budget. Pixmaps can only be let go of on the GUI thread, so off
+        it this only drops QImages. Call with the lock held. "Private" function.
+        '''
+        on_gui = current_thread() is main_thread()
+        for key in list(self._entries):
+            if self.used_bytes <= self.budget:
+                break
+            item = self._entries[key]
+            if key == keep or (not on_gui and isinstance(item, QPixmap)):
+                continue
+            del self._entries[key]
+            self.used_bytes -= item.width() * item.height() * 4
+
+    def _finish(self, key, future):
+        '''
+        Worker pool callback, files a finished decode away. "Private" function.
+        '''
+        with self._lock:
+            self._pending.pop(key, None)
+            if key in self._entries or future.cancelled() or future.exception() is not None:
+                return
+            image = future.result()
+            if not image.isNull():
+                self._store(key, image)
+
+    def preload(self, paths, resize_mode=0, size=0):
+        '''
+        Starts decoding sprites in the background so a later get() for the same path, resize_mode and size is
+        instant. Takes one path or a list of them. Doesn't wait, safe from any thread.
+
+        Returns a list with a Future per path that's done once that sprite is cached (already done if it was),
+        in case you want to know when (see Asset_Manager).
+        '''
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        futures = []
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sprite")
+            for path in paths:
+                key = self.key(path, resize_mode, size)
+                future = self._pending.get(key)
+                if future is None and key in self._entries:
+                    future = Future()
+                    future.set_result(None)
+                elif future is None:
+                    future = self._pool.submit(self._decode, key)
+                    self._pending[key] = future
+                    future.add_done_callback(lambda f, k=key: self._finish(k, f))
+                futures.append(future)
+        return futures
+
+    def get(self, path, resize_mode=0, size=0):
+        '''
+        GUI THREAD ONLY - returns the QPixmap for a sprite, decoding it now if it isn't cached (or waiting on
+        the decode if a preload of it is still running). Don't draw on the returned pixmap, it's shared.
+        '''
+        key = self.key(path, resize_mode, size)
+        with self._lock:
+            item = self._entries.get(key)
+            future = self._pending.get(key) if item is None else None
+            if item is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if isinstance(item, QPixmap):
+                    return item
+        if item is None:
+            self.misses += 1
+            item = future.result() if future is not None else self._decode(key)
+
+        # First time it's shown - convert, and keep only the pixmap so it isn't stored twice
+        pixmap = QPixmap.fromImage(item)
+        if not pixmap.isNull():
+            with self._lock:
+                self._store(key, pixmap)
+        return pixmap
+
+    def clear(self):
+        '''
+        GUI THREAD ONLY - drops everything cached (decodes in flight still land afterwards).
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+sprite_cache = Sprite_Cache()
+
+class Asset_Manager():
+    '''
+    MAKE IN THE MAIN THREAD (ie in a level setup)
+
+    Holds the images (backgrounds, mostly) a level is going to use, so they're decoded and scaled once ahead of
+    time instead of in the middle of the level. Declare them all up front with add() in the setup - each one
+    gets decoded and scaled to the size you give (work that out from the screen geometry, ie w + 50 or
+    norm_to_pixel) in sprite_cache's worker pool, then turned into a QPixmap on the main thread as soon as it's
+    done. The level thread only ever deals in names, which are the handles:
+
+        assets.add("gym", gym_path, width=w + 50)                       # setup, main thread
+        hlp.invoke(assets.set_background, scene, "gym")                  # level thread
+
+    The pixmaps are kept here for as long as the manager lives, so the cache's memory budget can't evict them
+    in between.
+
+    READ-ONLY Public Variables:
+    - names: list of the names added so far
+
+    Protected Variables:
+    - _specs: dict, name -> (path, resize_mode, size)
+    - _pixmaps: dict, name -> QPixmap, main thread only
+    - _left: int, assets added but not converted yet
+    - _ready: Event (threading), set whenever _left is 0
+    - _lock: Lock (threading), guards _left
+    '''
+    def __init__(self):
+        # READ-ONLY Public Variables
+        self.names = []
+
+        # Protected Variables
+        self._specs = {}
+        self._pixmaps = {}
+        self._left = 0
+        self._ready = Event()
+        self._ready.set()
+        self._lock = Lock()
+
+    def add(self, name, path, width=None, height=None):
+        '''
+        Declares an asset and starts loading it in the background. Scales to height if given, else to width if
+        given, else loads it as is (same as Q_NPC). Returns the name, which is what you pass around after.
+        '''
+        if height is not None:
+            spec = (str(path), 2, int(height))
+        elif width is not None:
+            spec = (str(path), 1, int(width))
+        else:
+            spec = (str(path), 0, 0)
+        if self._specs.get(name) == spec:
+            return name
+        if name not in self._specs:
+            self.names.append(name)
+        self._specs[name] = spec
+
+        with self._lock:
+            self._left += 1
+            self._ready.clear()
+        # Once it's decoded, hop over to the main thread to make the pixmap
+        future = sprite_cache.preload(spec[0], spec[1], spec[2])[0]
+        future.add_done_callback(lambda f: invoke_in_main_thread(self._convert, name, spec))
+        return name
+
+    def _convert(self, name, spec):
+        '''
+        Main thread - turns a decoded asset into its pixmap. "Private" function.
+        '''
+        # Skip it if the asset got re-added with something else in the meantime (that one counts itself)
+        if self._specs.get(name) == spec:
+            self._pixmaps[name] = sprite_cache.get(*spec)
+        with self._lock:
+            self._left -= 1
+            if self._left == 0:
+                self._ready.set()
+
+    def wait(self, timeout=None):
+        '''
+        NOT FROM THE MAIN THREAD (it's the one doing the converting) - blocks until every asset added so far is
+        ready, or timeout seconds pass. Returns True if they're all ready.
+        '''
+        return self._ready.wait(timeout)
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def pixmap(self, name):
+        '''
+        MAIN THREAD ONLY - the QPixmap for an asset. If it isn't converted yet this waits for its decode instead
+        of failing, so it always works, it's just only instant once the asset is ready.
+        '''
+        pixmap = self._pixmaps.get(name)
+        if pixmap is None:
+            pixmap = sprite_cache.get(*self._specs[name])
+            self._pixmaps[name] = pixmap
+        return pixmap
+
+    def set_background(self, scene, name):
+        '''
+        MAIN THREAD ONLY (so invoke it) - sets a QGraphicsScene's background to an asset.
+        '''
+        scene.setBackgroundBrush(self.pixmap(name))
+
 #########
 # TODO Maybe some helper functions for background QImage manipulation?
 # TODO Maybe some helper functions for custom animations?
@@ -21,13 +21,13 @@ from PySide6.QtCore import (
     QSequentialAnimationGroup,
 )
 from PySide6.QtGui import (
-    QPixmap, 
     QTransform,
 )
 from time import sleep
 import numpy as np
 import helpers as hlp
 import poseestim as pe
+import framebuffer as fb
 import enumoptions as op
 import os
 import time
@@ -37,16 +37,19 @@ w = None
 
 # Setting up GUI, signals, and threads to run the level
 # If you want to make drastic changes to level UI, do it here
-def start_level(parent_ref:QObject | None, level=0):
+def start_level(parent_ref:QObject | None, level=0, camera_thread:pe.Pose_Estimation =None):
     '''
     Initializes the GUI elements common to all levels (the dialogue box, NPCs, etc) before
-    starting the pose estimation camera thread and the level thread.
+    attaching the pose estimation camera thread and starting the level thread.
 
-    To prematurely quit a level, call cmr_thrd.stop() and game_loop.clear()
+    To prematurely quit a level, call cmr_thrd.detach() (or cmr_thrd.stop() if you're done with it for
+    good) and game_loop.clear()
 
     Arguments
     - parent_ref, a reference to the widget which will become the parent of the widgets 
     - level, an int corresponding to the level you want to pick (defaults to 0, a demo level)
+    - camera_thread, the already running camera thread to attach to (see start_pipeline) - if None, a new one
+      is started just for this level
 
     Returns
     - game_loop, a threading event which when cleared stops the game loop
@@ -76,9 +79,23 @@ def start_level(parent_ref:QObject | None, level=0):
     overlay.SIGNAL.CLOSE.connect(parent_ref.close_children)
     overlay.show()
 
-    # Starting camera ML thread...
-    camera_thread = pe.Pose_Estimation()
-    camera_thread.daemon = True
+    # Attaching the camera ML thread...
+    # It keeps running from level to level (camera, MediaPipe and models stay loaded), each level just
+    # attaches to it with start_exercise (whose model is already loaded) and its own player portrait
+    # It draws the player portrait once per new result into a shared buffer, and the portrait shows
+    # whatever is newest in there on its own timer - so the level loop never has to send it frames
+    if camera_thread is None:
+        camera_thread = start_pipeline()
+    portrait_buffer = fb.Shared_Frame_Buffer(overlay.pp.video_size.width(), overlay.pp.video_size.height())
+    camera_thread.attach(start_exercise, frame_buffer=portrait_buffer)
+    overlay.pp.start_pull(portrait_buffer)
+
+    # Progress indicator while the camera thread starts up - the level thread waits for it to actually be
+    # producing results before the level starts (see run_when_ready), instead of guessing how long that takes
+    # (if it's already been running for an earlier level, that's right away)
+    loading = hlp.Loading_Indicator(loading_text[op.Pipeline_States.STARTING.value], parent=view)
+    loading.show()
+    camera_thread.add_state_listener(start_up_listener(camera_thread, loading))
 
     # More thread stuff...
     # The invoker was already instantiated on importing helpers.py, and that allows sending GUI commands to execute from main thread
@@ -91,14 +108,15 @@ def start_level(parent_ref:QObject | None, level=0):
         case 0: # Demo Level
             # Setup the level objects needed - returns a list or dict of these objects
             setup_objects = setup_demo(scene)
+            # Load the exercise models the level switches to ahead of time, so switching doesn't freeze tracking
+            camera_thread.preload_exercises(demo_exercises)
 
             # Create thread to run level func in parallel - for target put just the name of the func, for args put the args in []
-            level_thread = Thread(target=level_demo, args=[scene, view, overlay, setup_objects, game_loop, camera_thread])
+            # (run_when_ready holds the level back until the camera thread is producing results)
+            level_thread = Thread(target=run_when_ready, args=[level_demo, scene, view, overlay, setup_objects, game_loop, camera_thread])
             level_thread.daemon = True
             
-            #Starting the threads and game loop... needs some time to properly boot up
-            camera_thread.start()
-            sleep(6)
+            #Starting the level thread and game loop - the level waits for the camera to boot up on its own
             game_loop.set()
             level_thread.start()
 
@@ -106,8 +124,10 @@ def start_level(parent_ref:QObject | None, level=0):
             # # SKELETON CASE - copy/paste and modify as you see fit
             # # Setup the object levels needed
             # setup_objects = setup_1(scene)
+            # # Preload the models for every exercise your level uses
+            # camera_thread.preload_exercises([op.Exercises.SQUAT.value])
             # # Create thread to run level func in parallel - for target put just the name of the func, for args put the args in []
-            # level_thread = Thread(target=level_demo, args=[scene, view, overlay, setup_objects, game_loop, camera_thread])
+            # level_thread = Thread(target=run_when_ready, args=[level_1, scene, view, overlay, setup_objects, game_loop, camera_thread])
             # level_thread.daemon = True
             pass
 
@@ -115,11 +135,12 @@ def start_level(parent_ref:QObject | None, level=0):
             print("\nERROR: Level does not exist")
             print("Starting default level...")
             setup_objects =  setup_demo(scene)
+            camera_thread.preload_exercises(demo_exercises)
             
-            level_thread = Thread(target=level_demo, args=[scene, view, overlay, setup_objects, game_loop, camera_thread])
+            level_thread = Thread(target=run_when_ready, args=[level_demo, scene, view, overlay, setup_objects, game_loop, camera_thread])
             level_thread.daemon = True
             
-            #Starting the thread and game loop
+            #Starting the level thread and game loop
             game_loop.set()
             level_thread.start()
     
@@ -129,6 +150,67 @@ def start_level(parent_ref:QObject | None, level=0):
     # The rest of the QObjects can be handled and deleted in thread with hlprs.invoke_in_main_thread(fn, args)
     return game_loop, camera_thread, level_thread, scene, view, overlay
 
+# Exercise every level attaches with (levels switch from there with set_exercise). Its model is EX_DEFAULT, the
+# one the warm-up loads and start_pipeline starts with, so attaching never loads a model on the GUI thread
+start_exercise = op.Exercises.DEFAULT.value
+
+# Starting the camera thread levels share
+def start_pipeline(landmarker=None):
+    '''
+    Creates and starts the pose estimation camera thread. Levels attach to it and detach from it (see
+    start_level), so it only needs starting once - app.py keeps one for the whole run and stops it when the
+    app closes. Sits idle, camera open and models loaded, until a level attaches.
+
+    landmarker is passed on to Pose_Estimation - app.py gives it the warm-up's take_landmarker, so the first
+    level doesn't have to wait for MediaPipe to build a landmarker all over again.
+
+    The governor picks the lite/full/heavy MediaPipe model that keeps up with 16 FPS on this machine (about
+    what ex_results expects, 32 results = ~2 secs), pass cpu_budget too if the game needs the CPU.
+    '''
+    camera_thread = pe.Pose_Estimation(exercise=start_exercise, ex_model_path=op.exercise_to_model[start_exercise],
+                                       governor=pe.Inference_Governor(target_fps=16), landmarker=landmarker)
+    camera_thread.daemon = True
+    camera_thread.detach()
+    camera_thread.start()
+    return camera_thread
+
+# What the loading indicator says at each step of the camera thread starting up (see Pipeline_States)
+loading_text = {
+    op.Pipeline_States.STARTING.value: "Opening the camera...",
+    op.Pipeline_States.CAMERA_OPENED.value: "Loading pose tracking...",
+    op.Pipeline_States.LANDMARKER_READY.value: "Warming up...",
+    op.Pipeline_States.MODEL_WARMED.value: "Step in front of the camera!",
+    op.Pipeline_States.FIRST_RESULT.value: "Ready!",
+}
+
+def start_up_listener(cam_thread:pe.Pose_Estimation, loading:hlp.Loading_Indicator):
+    '''
+    Makes a state listener for the camera thread that shows its start up progress on the loading indicator
+    (the listener runs in the camera thread, hence invoke). It takes itself off once there's nothing left to show.
+    '''
+    def listener(state):
+        if state == op.Pipeline_States.FAILED.value:
+            hlp.invoke_latest(loading.set_progress, 0, None, f"{cam_thread.state_error} - quit the level and try again")
+        elif state >= 0:
+            hlp.invoke_latest(loading.set_progress, state, op.Pipeline_States.FIRST_RESULT.value, loading_text[state])
+        # Done once it's ready (or stopped, which means the level is closing and the indicator is going away)
+        if state == op.Pipeline_States.FIRST_RESULT.value or state < 0:
+            cam_thread.remove_state_listener(listener)
+    return listener
+
+# Level thread target wrapper
+def run_when_ready(level_func, scene:QGraphicsScene, view:QGraphicsView, overlay:hlp.Overlay, obj_list:list|dict,
+                   game_loop:Event, cam_thread:pe.Pose_Estimation):
+    '''
+    Waits for the camera thread to produce its first result with the player in it, then runs the level
+    function with the same arguments. Gives up if the level gets closed or the camera fails in the meantime.
+    '''
+    while game_loop.is_set():
+        if cam_thread.wait_until(op.Pipeline_States.FIRST_RESULT.value, timeout=0.5):
+            return level_func(scene, view, overlay, obj_list, game_loop, cam_thread)
+        if cam_thread.state < 0:
+            return None
+
 # DEMO SETUP
 # MUST RETURN LIST OF OBJECTS TO BE USED (if you wanna do something else, modify the start_level func accordingly)
 def setup_demo(scene: QGraphicsScene):
@@ -175,12 +257,23 @@ def setup_demo(scene: QGraphicsScene):
     scene.addItem(ghost)
     ghost.setVisible(False)
 
+    # Backgrounds - declared here so they're decoded and scaled to the screen in the background while the
+    # level boots up, and swapping them mid level is instant (the level thread just uses the names)
+    assets = hlp.Asset_Manager()
+    assets.add("gym", os.path.join(op.root_dir, "assets", "backgrounds", "gym.png"), width=w + 50)
+    assets.add("transition", os.path.join(op.root_dir, "assets", "backgrounds", "transition.png"), width=w + 50)
+    assets.add("moonlit", os.path.join(op.root_dir, "assets", "backgrounds", "moonlit.png"), width=w + 50)
+
     q_objects = {"alice": alice, 
                  "bob": bob, 
                  "a_enter": a_enter,
-                 "ghost": ghost}
+                 "ghost": ghost,
+                 "assets": assets}
     return q_objects
 
+# Exercises the demo level switches to - preloaded in start_level so set_exercise is instant
+demo_exercises = [op.Exercises.SWING_SWORD.value]
+
 # DEMO LEVEL + EXPLANATION
 def level_demo(scene:QGraphicsScene, view:QGraphicsView, overlay:hlp.Overlay, obj_list:list|dict,  
                game_loop:Event, cam_thread:pe.Pose_Estimation):
@@ -205,19 +298,19 @@ def level_demo(scene:QGraphicsScene, view:QGraphicsView, overlay:hlp.Overlay, ob
     phase = 0 
     # Used to create different phases within a level by checking this with an if
     # and having conditions for changing it within that if
-    counter = 0
+    counter = 0 # how many new camera results this phase has seen
+    line = 0 # how far along the dialogue in this phase is
     player_hp = 100
     enemy_1_hp = 15
-    results = None
+    reps_seen = 0 # reps the rep counter had finished last time we looked
     combo = 0 # successes in a row
+    last_id = 0 # frame id of the last camera result we handled
+    check_every = 2 # seconds between exercise checks
+    next_check = 0 # time.time() of the next exercise check
 
-    # Setting background
-    trans = os.path.join(op.root_dir, "assets", "backgrounds", "transition.png")
-    bg_path = os.path.join(op.root_dir, "assets", "backgrounds", "moonlit.png")
-    bg_path_2 = os.path.join(op.root_dir, "assets", "backgrounds", "gym.png")
-    bg_pixmap = QPixmap(bg_path_2) 
-    bg_pixmap = bg_pixmap.scaledToWidth(w + 50)
-    hlp.invoke(scene.setBackgroundBrush, bg_pixmap)
+    # Setting background (loaded in setup_demo, so this is just a swap)
+    assets = obj_list["assets"]
+    hlp.invoke(assets.set_background, scene, "gym")
 
     # Showing first NPC + Enter animation
     hlp.invoke(obj_list["alice"].setVisible, True)
@@ -226,36 +319,42 @@ def level_demo(scene:QGraphicsScene, view:QGraphicsView, overlay:hlp.Overlay, ob
     # First line of dialogue
     hlp.invoke(overlay.set_text, "Hi, I'm Alice. Welcome to the gym!")
     sleep(2) # Time for player to read
+    phase_start = time.time()
+    line_time = phase_start # when the last line of dialogue finished
 
     # Game loop begins
     while game_loop.is_set():
-        # Constantly update the UI Overlay (np is NPC portrait, pp is player portrait)
-        frame = cam_thread.get_default_annotation()
-        hlp.invoke(overlay.pp.update_frame, frame)
-
-        # Updating HP constantly based off player head visibility for no reason other than it looks neat
-        nose_pos, nose_vis = cam_thread.get_body_part()
-        hlp.invoke(overlay.pp.update_stat_bar, int(nose_vis * 100))
+        # Sleep until the camera thread has a new result - nothing on screen changes in between anyway
+        # (the timeout just makes sure we notice game_loop being cleared even if the camera stalls)
+        snap = cam_thread.wait_for_result(last_id, timeout=0.5)
+        if snap is None:
+            continue
+        last_id = snap.frame_id
+        now = time.time()
+
+        # The player portrait keeps itself updated (see start_level), the rest of the UI Overlay is up to us
+        # (np is NPC portrait, pp is player portrait)
+
+        # Updating HP based off player head visibility for no reason other than it looks neat
+        nose_pos, nose_vis = cam_thread.get_body_part(mp_rslts=snap.mp_results)
+        hlp.invoke_latest(overlay.pp.update_stat_bar, int(nose_vis * 100))
         
         # Begin first phase
         if phase == 0:
             # Gameplay logic
-            # Updating results list and checking for successes every 200 loops (about every 2 sec on my machine)
-            # this is necessary because our loop is much faster than the machine learning models can inference
-            if (counter % 200) == 0:
-                results = cam_thread.ex_results
-                results = list(results)
-                if len(results) < 32:
-                    extras = 32 - len(results)
-                    for i in range(1, extras):
-                        results.append(0)
+            # Updating results list and checking for successes every 2 seconds, which gives the
+            # models time to fill up ex_results with a fresh batch of detections
+            if now >= next_check:
+                next_check = now + check_every
+                # Sum of the last 32 predictions (missing ones count as 0), straight from the ring's running counts
+                score = cam_thread.ex_results.window_sum(32)
                 
                 # Let's make multiple successes in a row build a combo! 
                 # I'll count over half the results being positive as a success.
-                if sum(results) > 16:
+                if score > 16:
                     # Increase combo
                     combo += 1
-                elif sum(results) == 0:
+                elif score == 0:
                     # If all are fail, let's decrease combo
                     combo += -1
                 
@@ -269,38 +368,43 @@ def level_demo(scene:QGraphicsScene, view:QGraphicsView, overlay:hlp.Overlay, ob
                     combo = 0
             #
 
-            # I'll increment counter each time the if block is executed so these are one time events:
-            if counter == 0:
+            # Each line of dialogue shows once, a set amount of time after the last one finished:
+            if line == 0:
                 hlp.invoke(overlay.set_text, "Here we enter the first phase! Let's start off with some high-knees.")
                 hlp.invoke(obj_list["alice"].cycle_img, 1)
-            elif counter == 600:
+                line, line_time = 1, now
+            elif line == 1 and now - line_time > 6:
                 a = "Each distinct phase of the game is held in a big if statement within the game loop - if phase == 1"
                 b = ": do the checks for the specific exercise, etc. This is nice because each section ends up organized under "
-                c = "it's own if statement, but they can share data. This level uses an additional counter variable to check how many"
-                d = a + b + c + " loops have been spent in one phase. Right now the game is frozen so you have time to read this."
+                c = "it's own if statement, but they can share data. This level uses additional line and time variables to pace"
+                d = a + b + c + " the dialogue within one phase. Right now the game is frozen so you have time to read this."
                 hlp.invoke(overlay.set_text, d)
                 sleep(10)
-            elif counter == 1800:
+                line, line_time = 2, time.time()
+            elif line == 2 and now - line_time > 12:
                 a = "Right now, the level thread is getting the last two seconds of results from the camera thread and seeing "
-                b = "how many frames were successfully doing the exercise. It does this every few seconds by using an "
-                c = "if statement like this in the game loop: if (counter % 200) == 0: results = cam_thread.ex_results"
-                d = a + b + c + ". This is necessary because the game loop is far faster than the ML inference."
+                b = "how many frames were successfully doing the exercise. It does this every couple seconds by using an "
+                c = "if statement like this in the game loop: if now >= next_check: score = cam_thread.ex_results.window_sum(32)"
+                d = a + b + c + ". Between checks the loop just sleeps in cam_thread.wait_for_result until a new frame comes in."
                 hlp.invoke(overlay.set_text, d)
                 sleep(10)
-            elif counter == 3000:
-                a = "It's recommended to use time.time() rather than relying on loop timing to time checks though, so it's consistent "
-                b = "on faster machines. Finally, don't forget an if statement at the very end checking for the criteria to "
+                line, line_time = 3, time.time()
+            elif line == 3 and now - line_time > 12:
+                a = "Timing checks with time.time() rather than counting loops keeps things consistent on faster machines. "
+                b = "Finally, don't forget an if statement at the very end checking for the criteria to "
                 c = "change the level phase or win the level. Otherwise I'm stuck working my shift at this gym for all eternity. "
                 d = a + b + c + " There are lots of if statements when making a game with this but it ends up pretty neat."
                 hlp.invoke(overlay.set_text, d)
                 sleep(10)
-            elif counter == 4200:
+                line, line_time = 4, time.time()
+            elif line == 4 and now - line_time > 12:
                 d = "Now let's get back to exercising!"
                 hlp.invoke(overlay.set_text, d)
+                line, line_time = 5, now
 
             # Incrementing counter and checking for next phase condition
             counter += 1
-            if counter > 20000 or combo > 50:
+            if now - phase_start > 230 or combo > 50:
                 phase = 1
                 counter = 0
                 hlp.invoke(overlay.set_text, "Great job! Let's take a breather.")
@@ -310,22 +414,19 @@ def level_demo(scene:QGraphicsScene, view:QGraphicsView, overlay:hlp.Overlay, ob
                 sleep(5)
                 hlp.invoke(obj_list["alice"].setVisible, False)
                 hlp.invoke(overlay.set_text, " ")
-                bg_pixmap = QPixmap(trans)
-                bg_pixmap = bg_pixmap.scaledToWidth(w + 50)
-                hlp.invoke(scene.setBackgroundBrush, bg_pixmap)
+                hlp.invoke(assets.set_background, scene, "transition")
 
                 # Setting new exercise model
                 cam_thread.set_exercise(op.Exercises.SWING_SWORD.value)
                 sleep(5)
 
                 # Change setting for new phase
-                bg_pixmap = QPixmap(bg_path) 
-                bg_pixmap = bg_pixmap.scaledToWidth(w + 50)
-                hlp.invoke(scene.setBackgroundBrush, bg_pixmap)
+                hlp.invoke(assets.set_background, scene, "moonlit")
 
                 hlp.invoke(obj_list["bob"].setVisible, True)
                 hlp.invoke(overlay.set_text, "Hi, I'm Bob! I found you knocked out cold in this forest.")
                 sleep(5)
+                continue
         
         # Begin second phase
         if phase == 1:
@@ -338,39 +439,36 @@ def level_demo(scene:QGraphicsScene, view:QGraphicsView, overlay:hlp.Overlay, ob
                 sleep(5)
                 hlp.invoke(overlay.set_text, "Quickly, use the sword you have because this is a fantasy RPG setting! TAKE A SWING!")
                 sleep(5)
-            
-            if (counter % 200) == 0:
-                # Getting results
-                results = cam_thread.ex_results
-                results = list(results)
-                if len(results) < 32:
-                    extras = 32 - len(results)
-                    for i in range(1, extras):
-                        results.append(0)
-                
-                # Input check
-                if sum(results) > 16:
-                    enemy_1_hp += -5
-                elif sum(results) == 0:
+                next_check = time.time() + check_every
+                reps_seen = cam_thread.reps.count
+
+            # Every finished rep is a swing that lands, as soon as it's done (the rep counter does the work)
+            reps = cam_thread.reps.count
+            if reps != reps_seen:
+                enemy_1_hp += -5 * max(reps - reps_seen, 0)
+                reps_seen = reps
+
+            if now >= next_check:
+                next_check = now + check_every
+                # Standing around for 2 seconds lets the ghost hit back
+                if cam_thread.ex_results.window_sum(32) == 0:
                     player_hp += -5
                     enemy_1_hp += 5
-                
-                # Health check
-                if enemy_1_hp < 5 or enemy_1_hp > 100: # the second part is just giving you the win if you're losing bc it's a tutorial
-                    hlp.invoke(obj_list["ghost"].setVisible, False)
-                    hlp.invoke(overlay.set_text, "You saved us AND you demonstrated the potential gameplay mechanics!")
-                    hlp.invoke(obj_list["bob"].cycle_img)
-                    sleep(5)
-                    hlp.invoke(overlay.set_text, "Level Complete!")
-                    sleep(5)
-                    # artificially setting counter high so level ends - probably best to use time.time() for these but I'm lazy rn
-                    counter = 19800
-                
-            # Counter and win condition check
-            counter += 1
-            if counter > 19998:
+
+            # Health check
+            if enemy_1_hp < 5 or enemy_1_hp > 100: # the second part is just giving you the win if you're losing bc it's a tutorial
+                hlp.invoke(obj_list["ghost"].setVisible, False)
+                hlp.invoke(overlay.set_text, "You saved us AND you demonstrated the potential gameplay mechanics!")
+                hlp.invoke(obj_list["bob"].cycle_img)
+                sleep(5)
+                hlp.invoke(overlay.set_text, "Level Complete!")
+                sleep(5)
+                # Level won, end it
                 phase = 3
                 game_loop.clear()
+            
+            # Counter
+            counter += 1
         #
 
 #__________________________
@@ -395,6 +493,10 @@ def setup_1(scene: QGraphicsScene):
     name = hlp.Q_NPC("NAME", [img], 0, 0)
     scene.addItem(name)
 
+    # Declaring backgrounds (and any other images) so they load in the background
+    assets = hlp.Asset_Manager()
+    assets.add("background", os.path.join(op.root_dir, "assets", "backgrounds", "YOUR_BACKGROUND_HERE.png"), width=w)
+
     # Making an Animation
     anim1 = QPropertyAnimation(name, b'PROPERTY_NAME_TO_ANIMATE')
     anim1.setStartValue()
@@ -409,7 +511,8 @@ def setup_1(scene: QGraphicsScene):
     # Putting it all in a dict and returning it
     q_objects = {
         "NPC Name": name,
-        "Animation": combo
+        "Animation": combo,
+        "assets": assets
     }
     return q_objects
 
@@ -424,21 +527,24 @@ def level_1(scene:QGraphicsScene, view:QGraphicsView, overlay:hlp.Overlay, obj_l
     phase = 0
     counter = 0
     t = time.time()
-    # Background
-    bg_path = os.path.join(op.root_dir, "assets", "backgrounds", "YOUR_BACKGROUND_HERE.png")
-    bg_pixmap = QPixmap(bg_path) 
-    bg_pixmap = bg_pixmap.scaledToWidth(w)
-    hlp.invoke(scene.setBackgroundBrush, bg_pixmap)
+    # Background (declared in the setup)
+    hlp.invoke(obj_list["assets"].set_background, scene, "background")
     # NPC
     hlp.invoke(obj_list["NPC Name"].setVisible, True)
     # Dialogue
     hlp.invoke(overlay.set_text, "YOUR TEXT HERE")
     
+    last_id = 0
+    
     # Game loop
     while game_loop.is_set():
-        # Update player frame if needed
-        frame = cam_thread.get_default_annotation()
-        hlp.invoke(overlay.pp.update_frame, frame)
+        # Wait for a new camera result instead of spinning (timeout so clearing game_loop still gets noticed)
+        snap = cam_thread.wait_for_result(last_id, timeout=0.5)
+        if snap is None:
+            continue
+        last_id = snap.frame_id
+
+        # No need to update the player frame, the portrait pulls it straight from the camera thread
 
         # YOUR GAME LOGIC HERE
 
@@ -1,8 +1,13 @@
 ### Imports (and mediapipe abbreviations)
 import enumoptions as op
-from threading import Thread, Event, Lock
-from collections import deque
-from mediapipe.framework.formats import landmark_pb2
+import features as ft
+import forest as fst
+import predictions as pr
+from preprocess import Frame_Preprocessor
+from threading import Thread, Event, Condition
+from collections import deque, namedtuple
+import time
+import os
 from mediapipe import solutions
 import mediapipe as mp
 
@@ -10,77 +15,528 @@ import mediapipe as mp
 BaseOptions = mp.tasks.BaseOptions
 PoseLandmarker = mp.tasks.vision.PoseLandmarker
 PoseLandmarkerOptions = mp.tasks.vision.PoseLandmarkerOptions
+PoseLandmarkerResult = mp.tasks.vision.PoseLandmarkerResult
 VisionRunningMode = mp.tasks.vision.RunningMode
 
 import cv2
 import numpy as np
-import joblib
 ###
 
+# Exercise models stay loaded here between exercises (and camera threads), see Model_Cache in forest.py
+model_cache = fst.Model_Cache()
+
+# Fast skeleton drawing
+class Skeleton_Renderer():
+    '''
+    Draws pose landmarks the same way MediaPipe's drawing_utils does (white bones, orange left side, cyan
+    right side, white nose), minus the slow parts. MediaPipe's version copies the image, builds a protobuf
+    landmark by landmark, and draws every bone and joint with its own OpenCV call. This projects all the
+    landmarks to pixels with one NumPy operation, draws every bone with a single cv2.polylines call, and
+    draws into canvases it keeps around instead of allocating new ones every frame.
+
+    Canvases are kept in a small ring per resolution - each render hands back the next one in the ring, so
+    an image that was just handed to the GUI thread isn't drawn over until ring_size more renders later.
+    Don't hold onto a rendered image for longer than that (copy it if you need to).
+
+    Arguments:
+    - ring_size: int, how many canvases to cycle through per resolution
+    - min_visibility: float, landmarks less visible than this aren't drawn (0 draws them all, like MediaPipe)
+    - thickness: int, line thickness in pixels at 480p (scales with the image)
+    - radius: int, joint circle radius in pixels at 480p (scales with the image)
+
+    At 480p with the defaults it draws exactly the same pixels as MediaPipe's default pose style.
+
+    Protected Variables:
+    - _rings: dict, (height, width) -> [list of canvases, index of the last one used]
+    '''
+    # Bones as pairs of landmark numbers, and the BGR colour each landmark gets drawn in
+    CONNECTIONS = np.array(sorted(solutions.pose.POSE_CONNECTIONS), dtype=np.intp)
+    COLORS = np.array([(0, 138, 255) if part.name.startswith('LEFT') or part.name == 'MOUTH_LEFT' else
+                       (231, 217, 0) if part.name.startswith('RIGHT') or part.name == 'MOUTH_RIGHT' else
+                       (224, 224, 224) for part in op.Body_Parts], dtype=np.int32)
+    WHITE = (224, 224, 224)
+
+    def __init__(self, ring_size=3, min_visibility=0.0, thickness=2, radius=2):
+        self.ring_size = ring_size
+        self.min_visibility = min_visibility
+        self.thickness = thickness
+        self.radius = radius
+        self._rings = {}
+
+    def canvas(self, height, width):
+        '''
+        Returns the next reusable (height, width, 3) uint8 canvas for a resolution. Its contents are whatever
+        was drawn on it last time, so clear or overwrite it before use.
+        '''
+        ring = self._rings.get((height, width))
+        if ring is None:
+            ring = self._rings[(height, width)] = [[], -1]
+        ring[1] = (ring[1] + 1) % self.ring_size
+        if ring[1] == len(ring[0]):
+            ring[0].append(np.empty((height, width, 3), dtype=np.uint8))
+        return ring[0][ring[1]]
+
+    def render(self, detection_result, image=None, width=None, frame_shape=(480, 640)):
+        '''
+        Draws the poses in a MediaPipe results object and returns the drawn image (a BGR ndarray, one of the
+        ring's canvases).
+
+        Arguments
+        - detection_result, the mediapipe results object
+        - image, a BGR image to draw on top of (it gets copied, never drawn on), or None for a black background
+        - width, draw at this width instead of the image's (height keeps the image's aspect ratio)
+        - frame_shape, (height, width) of the black background when there's no image
+        '''
+        # Working out output size
+        if image is not None:
+            src_h, src_w = image.shape[:2]
+        else:
+            src_h, src_w = frame_shape[:2]
+        if width is None:
+            height, width = src_h, src_w
+        else:
+            height = max(1, round(width * src_h / src_w))
+
+        # Background - camera image scaled/copied in, or black
+        out = self.canvas(height, width)
+        if image is None:
+            out.fill(0)
+        elif (height, width) == (src_h, src_w):
+            np.copyto(out, image)
+        else:
+            # Linear rather than area - area looks a touch smoother but is ~50x slower at odd ratios
+            cv2.resize(image, (width, height), dst=out, interpolation=cv2.INTER_LINEAR)
+
+        self._draw(out, detection_result)
+        return out
+
+    def portrait(self, detection_result, image, width, height, frame_shape=(480, 640), dst=None):
+        '''
+        Draws the poses straight at portrait size, ready for the player portrait to show as is - the camera
+        image (or black) scaled to fill width x height with the middle kept and the sides cut off, then
+        mirrored and converted to RGB. Returns a brand new array every time, so it's safe to keep - or writes
+        into dst and returns that, if given.
+
+        Arguments
+        - detection_result, the mediapipe results object
+        - image, the BGR camera frame to draw on top of, or None for a black background
+        - width, height, size of the portrait in pixels
+        - frame_shape, (height, width) of the camera frame when there's no image
+        - dst, a contiguous (height, width, 3) uint8 array to put the result in (like a frame buffer's back buffer)
+        '''
+        # Which part of the frame fits the portrait (normalized), scaling it to fill and cutting off the rest
+        src_h, src_w = image.shape[:2] if image is not None else frame_shape[:2]
+        scale = max(width / src_w, height / src_h)
+        crop_w, crop_h = width / (src_w * scale), height / (src_h * scale)
+        region = ((1 - crop_w) / 2, (1 - crop_h) / 2, crop_w, crop_h)
+
+        # Background
+        out = self.canvas(height, width)
+        if image is None:
+            out.fill(0)
+        else:
+            x0, y0 = int(region[0] * src_w), int(region[1] * src_h)
+            x1, y1 = x0 + max(1, round(crop_w * src_w)), y0 + max(1, round(crop_h * src_h))
+            cv2.resize(image[y0:y1, x0:x1], (width, height), dst=out, interpolation=cv2.INTER_LINEAR)
+
+        # Draw, then mirror and swap BGR to RGB in the one copy that makes the new array (or fills dst - mirroring
+        # into it and swapping in place is quicker than the strided copy, same as reformat_image in helpers.py)
+        self._draw(out, detection_result, region)
+        if dst is not None:
+            cv2.flip(out, 1, dst=dst)
+            cv2.cvtColor(dst, cv2.COLOR_BGR2RGB, dst=dst)
+            return dst
+        return np.ascontiguousarray(out[:, ::-1, ::-1])
+
+    def _draw(self, out, detection_result, region=(0.0, 0.0, 1.0, 1.0)):
+        '''
+        Draws the skeletons onto out, in place. region is the (x, y, width, height) part of the frame out
+        shows, normalized like the landmarks are. "Private" function.
+        '''
+        height, width = out.shape[:2]
+
+        # Line sizes scale with the image, so small portraits don't end up all blob
+        scale = min(height, width) / 480
+        thickness = max(1, round(self.thickness * scale))
+        radius = max(1, round(self.radius * scale))
+        border = max(radius + 1, int(radius * 1.2))
+
+        for pose_landmarks in detection_result.pose_landmarks:
+            # Every landmark to pixels at once (same rounding as MediaPipe, off image ones don't get drawn)
+            values = np.array([(lm.x, lm.y, lm.visibility or 0.0) for lm in pose_landmarks], dtype=np.float32)
+            if region[2] != 1.0 or region[3] != 1.0:
+                values[:, 0] = (values[:, 0] - region[0]) / region[2]
+                values[:, 1] = (values[:, 1] - region[1]) / region[3]
+            shown = ((values[:, 0] >= 0) & (values[:, 0] <= 1) & (values[:, 1] >= 0) & (values[:, 1] <= 1)
+                     & (values[:, 2] >= self.min_visibility))
+            pixels = np.minimum(np.floor(values[:, :2] * (width, height)), (width - 1, height - 1)).astype(np.int32)
+
+            # All bones with both ends shown, in one call
+            bones = Skeleton_Renderer.CONNECTIONS[shown[Skeleton_Renderer.CONNECTIONS].all(axis=1)]
+            if len(bones) > 0:
+                cv2.polylines(out, pixels[bones], False, Skeleton_Renderer.WHITE, thickness)
+
+            # Joints on top - white border, then the side colour
+            for idx in np.flatnonzero(shown):
+                point = (int(pixels[idx, 0]), int(pixels[idx, 1]))
+                cv2.circle(out, point, border, Skeleton_Renderer.WHITE, thickness)
+                cv2.circle(out, point, radius, Skeleton_Renderer.COLORS[idx].tolist(), thickness)
+
+# Shared by get_default_annotation and draw_landmarks_on_image (the camera thread has its own)
+renderer = Skeleton_Renderer()
+
 # Default MediaPipe visualization function 
 def draw_landmarks_on_image(rgb_image, detection_result):
   '''
-  Draw pose tracking landmarks on any image
+  Draw pose tracking landmarks on any image (returns a new image, the one passed in isn't changed).
+  Used to go through MediaPipe's drawing_utils, now it's a thin wrapper around Skeleton_Renderer.
   '''
-  pose_landmarks_list = detection_result.pose_landmarks
-  annotated_image = np.copy(rgb_image)
-
-  # Loop through the detected poses to visualize.
-  for idx in range(len(pose_landmarks_list)):
-    pose_landmarks = pose_landmarks_list[idx]
-
-    # Draw the pose landmarks.
-    pose_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-    pose_landmarks_proto.landmark.extend([
-      landmark_pb2.NormalizedLandmark(x=landmark.x, y=landmark.y, z=landmark.z) for landmark in pose_landmarks
-    ])
-    solutions.drawing_utils.draw_landmarks(
-      annotated_image,
-      pose_landmarks_proto,
-      solutions.pose.POSE_CONNECTIONS,
-      solutions.drawing_styles.get_default_pose_landmarks_style())
-  return annotated_image
-
-# DATA CLEANUP AND PREPROCESSING FUNCTION - making MP's esoteric return readable for the RF model
-def preprocess(result):
+  return renderer.render(detection_result, rgb_image).copy()
+
+def exercise_specific_processing(ex):   
+    # TODO: If you implement exercises needing special processing, use this and write a call in the detect exercise private func
+    pass
+
+# One frame's worth of results, published by the camera thread as a single unit
+Pose_Snapshot = namedtuple('Pose_Snapshot', [
+    'frame',            # raw CV2 video frame (ndarray)
+    'mp_image',         # MP image the landmarker ran on
+    'mp_results',       # MediaPipe results object
+    'mp_mask',          # body shape mask (None, not implemented yet)
+    'prediction',       # exercise prediction for this frame (the same thing that got appended to ex_results)
+    'frame_id',         # sequence number, goes up by one for every published result (0 means nothing yet)
+    'timestamp',        # time.monotonic() seconds when it was published (offline/replay: when the frame was taken)
+    'annotation',       # portrait sized, mirrored RGB skeleton image (None unless annotate is on, or if it went into a frame_buffer)
+])
+Pose_Snapshot.__doc__ = '''
+Immutable bundle of everything the camera thread worked out for one frame. The camera thread builds a new one per frame
+and publishes it with a single assignment, so whoever grabs Pose_Estimation.snapshot always gets a frame, results, and
+prediction that belong together - no locks, and no waiting on the camera thread.
+'''
+
+# Picks the landmarker tier and how often to run it
+class Inference_Governor():
     '''
-    Reformats **MediaPipe Results object** into ordered list of numbers. If no
-    detection, returns None, otherwise returns a list.  
+    Watches how long each frame of inference takes on this machine, and picks the MediaPipe model tier
+    (lite, full, heavy) and inference rate that hold a target FPS - or a CPU budget, if one is given. The
+    camera thread reports every frame's latency with record and reads tier_path and next_delay; swapping the
+    landmarker itself is the camera thread's job.
+
+    Latency is smoothed with a moving average, and the tier only changes after staying past a threshold for
+    a whole window of frames (and a whole window after the last switch), so one slow frame doesn't drop a
+    tier. The thresholds are far enough apart (see down_ratio and up_ratio) that the tier settles instead of
+    flapping back and forth. Each tier also remembers how fast it was last time it ran, so a tier that was
+    too slow isn't retried until that memory gets old (retry_after).
+
+    Tiers whose model file isn't downloaded are skipped. Not thread safe by itself - record must only be
+    called by one thread at a time, which is how the camera thread uses it.
+
+    Arguments:
+    - target_fps: float, inference rate to hold (also caps it, any faster is wasted CPU)
+    - cpu_budget: float or None, fraction of one CPU core inference may use (0.5 = half), None for no limit
+    - tier_paths: list of str, MediaPipe models from fastest to slowest (defaults to lite, full, heavy)
+    - start_tier: int, index into tier_paths to start with (defaults to full, or the closest one available)
+    - window: int, how many frames of latency to average and to wait between switches
+    - down_ratio: float, drop a tier when averaged latency goes above this fraction of the allowed latency
+    - up_ratio: float, go up a tier when it looks like it'd come in under this fraction of the allowed latency
+    - retry_after: float, seconds before a tier's remembered latency is forgotten
+
+    READ-ONLY Public Variables:
+    - tier: int
+    - tier_path: str
+    - latency: float, the averaged latency of the current tier in seconds
+    - switches: int
+
+    Protected Variables:
+    - _avg: dict, tier -> (averaged latency, time.monotonic() it was last updated)
+    - _frames: int, frames recorded since the last switch
+    - _alpha: float, how much each new frame moves the average
     '''
-    # Abbreviation for...
-    body_pt = mp.solutions.pose.PoseLandmark        # the body landmark enumerations in mediapipe
-    pose_landmarks_list = result.pose_landmarks     # the result list in the media pipe return
-    # Values our model will ignore - basically eyes, lips, hands, and feet
-    ignore = [1, 2, 3, 4, 5, 6, 9, 10, 17, 18, 19, 20, 21, 22, 29, 30, 31, 32]
-    # What we return
-    parsed_list = []
-
-    # INPUT HANDLING AND DATA DISCARDING 
-    if (len(pose_landmarks_list) == 0) or (False):
-        return None
+    def __init__(self, target_fps=20, cpu_budget=None, tier_paths=None, start_tier=1, window=30,
+                 down_ratio=1.0, up_ratio=0.6, retry_after=60):
+        # Settings
+        self.target_fps = target_fps
+        self.cpu_budget = cpu_budget
+        self.window = window
+        self.down_ratio = down_ratio
+        self.up_ratio = up_ratio
+        self.retry_after = retry_after
+
+        # Only tiers that are actually downloaded
+        if tier_paths is None:
+            tier_paths = [op.Model_Paths.MP_LITE.value, op.Model_Paths.MP_FULL.value, op.Model_Paths.MP_HEAVY.value]
+        self.tier_paths = [path for path in tier_paths if os.path.isfile(path)]
+        if len(self.tier_paths) == 0:
+            # Nothing found, keep the list as is and let MediaPipe complain about the missing file
+            self.tier_paths = list(tier_paths)
+        wanted = tier_paths[min(start_tier, len(tier_paths) - 1)]
+
+        # READ-ONLY Public Variables
+        self.tier = self.tier_paths.index(wanted) if wanted in self.tier_paths else len(self.tier_paths) // 2
+        self.tier_path = self.tier_paths[self.tier]
+        self.latency = 0.0
+        self.switches = 0
 
-    # Parsing the results object to extract the landmark values we're interested in
-    for idx in range(len(pose_landmarks_list)):
-        pose_landmarks = pose_landmarks_list[idx]   # for some god unknown reason it's a 2d list with only one column
-
-        # Loop through the inner list of landmarks and add each value to the list
-        for part in body_pt:
-            # Only the values we care about
-            if part.value not in ignore:
-                parsed_list.append(pose_landmarks[part.value].x)
-                parsed_list.append(pose_landmarks[part.value].y)
-                parsed_list.append(pose_landmarks[part.value].z)
-                parsed_list.append(pose_landmarks[part.value].visibility)
+        # Protected variables
+        self._avg = {}
+        self._frames = 0
+        self._alpha = 2 / (window + 1)
+
+    def allowed_latency(self):
+        '''
+        Longest a single frame of inference may take - one frame's worth of time at the target FPS, or
+        less if that would use more CPU than the budget allows.
+        '''
+        allowed = 1 / self.target_fps
+        if self.cpu_budget is not None:
+            allowed *= self.cpu_budget
+        return allowed
+
+    def record(self, seconds):
+        '''
+        Takes the latency of one frame of inference (in seconds) and switches tiers if needed. Returns True
+        if the tier changed, in which case the camera thread should build a new landmarker with tier_path.
+        '''
+        # Moving average, starting off at the first measurement
+        now = time.monotonic()
+        if self._frames == 0 or self.tier not in self._avg:
+            avg = seconds
+        else:
+            avg = self._avg[self.tier][0] + self._alpha * (seconds - self._avg[self.tier][0])
+        self._avg[self.tier] = (avg, now)
+        self.latency = avg
+        self._frames += 1
+
+        # Not enough frames on this tier yet to judge it
+        if self._frames < self.window:
+            return False
+
+        allowed = self.allowed_latency()
+        # Too slow, drop a tier
+        if avg > allowed * self.down_ratio and self.tier > 0:
+            return self._switch(self.tier - 1)
+        # Plenty of headroom, go up a tier if it looks like it would fit
+        if self.tier < len(self.tier_paths) - 1:
+            remembered = self._avg.get(self.tier + 1)
+            if remembered is not None and now - remembered[1] < self.retry_after:
+                estimate = remembered[0]
             else:
-                pass
-    
-    # Return simple list of numbers corresponding to [x coord, y coord, visibility, x coord, y coord, visibility...]
-    # each body point landmark corresponding to some four consecutive values
-    return parsed_list
+                # Never measured (or long ago) - each tier is roughly twice the work of the one below
+                estimate = avg * 2
+            if estimate < allowed * self.up_ratio:
+                return self._switch(self.tier + 1)
+        return False
 
-def exercise_specific_processing(ex):   
-    # TODO: If you implement exercises needing special processing, use this and write a call in the detect exercise private func
-    pass
+    def _switch(self, tier):
+        '''
+        Moves to another tier and starts judging it from scratch. "Private" function.
+        '''
+        self.tier = tier
+        self.tier_path = self.tier_paths[tier]
+        self.switches += 1
+        self._frames = 0
+        return True
+
+    def next_delay(self, seconds):
+        '''
+        Takes the latency of the frame that just finished, and returns how many seconds to wait before
+        running the next one. Keeps inference from going faster than the target FPS, and from using more
+        of the CPU than the budget when even the lowest tier is too slow to fit it.
+        '''
+        interval = 1 / self.target_fps
+        if self.cpu_budget is not None:
+            interval = max(interval, self.latency / self.cpu_budget)
+        return max(0.0, interval - seconds)
+
+# Anything that isn't a camera, read like one
+IMAGE_TYPES = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+class Frames_Capture():
+    '''
+    Stands in for a cv2.VideoCapture over frames that don't come from a camera - a folder of images (read in
+    name order) or any iterable/generator of BGR frames, which can also yield (frame, timestamp_ms) tuples to
+    give their own timestamps. Only has the bits of VideoCapture the camera thread uses (read, get, set,
+    isOpened, release).
+
+    Arguments:
+    - frames: iterable of frames (or (frame, timestamp_ms) tuples), or a folder path
+    - fps: float, frame rate the frames were taken at, for timestamps when they don't come with their own
+
+    Protected Variables:
+    - _frames: iterator
+    - _index: int, frames read so far
+    - _pos_ms: float, timestamp of the last frame read
+    - _open: bool
+    '''
+    def __init__(self, frames, fps=30.0):
+        if isinstance(frames, (str, os.PathLike)):
+            folder = frames
+            names = sorted(name for name in os.listdir(folder) if name.lower().endswith(IMAGE_TYPES))
+            frames = (cv2.imread(os.path.join(folder, name)) for name in names)
+        self.fps = fps
+        self._frames = iter(frames)
+        self._index = 0
+        self._pos_ms = 0.0
+        self._open = True
+
+    def read(self):
+        if not self._open:
+            return False, None
+        try:
+            frame = next(self._frames)
+        except StopIteration:
+            self.release()
+            return False, None
+        if isinstance(frame, tuple):
+            frame, self._pos_ms = frame
+        else:
+            self._pos_ms = self._index * 1000.0 / self.fps
+        self._index += 1
+        if frame is None: # Unreadable image, skip over it
+            return self.read()
+        return True, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self._pos_ms
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self._index
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def isOpened(self):
+        return self._open
+
+    def release(self):
+        self._open = False
+
+def open_capture(source=0, fps=30.0):
+    '''
+    Opens any capture source the camera thread can read from, returning (capture, is_camera):
+    - an int, a camera index (0 is the default webcam)
+    - a path to a video file (or anything else OpenCV can open, like a stream URL)
+    - a path to a folder of images, played in name order at fps
+    - an iterable/generator of BGR frames (or (frame, timestamp_ms) tuples), at fps if they have no timestamps
+    - an already opened cv2.VideoCapture, or anything that reads like one
+
+    The capture might not be open (check isOpened) - camera unplugged, file missing, etc.
+    '''
+    if isinstance(source, int):
+        return cv2.VideoCapture(source), True
+    if isinstance(source, (str, os.PathLike)):
+        if os.path.isdir(source):
+            return Frames_Capture(source, fps), False
+        return cv2.VideoCapture(str(source)), False
+    if hasattr(source, 'read') and hasattr(source, 'isOpened'):
+        return source, False
+    return Frames_Capture(source, fps), False
+
+# Camera Frame Grabber Thread
+class Frame_Grabber(Thread):
+    '''
+    A tiny thread that does nothing but read the camera as fast as it hands out frames, keeping only the
+    newest one in a one slot buffer (latest frame wins). The pose estimation thread takes frames out of
+    that slot, so inference never waits on a blocking cap.read() and never works on a stale frame that
+    sat in the driver buffer while the last inference was running.
+
+    Setting CAP_PROP_BUFFERSIZE to 1 is supposed to do the same thing, but most backends ignore it.
+
+    Other sources (video files, image folders...) get read at the pace of their own timestamps, like a
+    camera would hand them out, and the grabber stops at the end of them.
+
+    Arguments:
+    - cap: cv2.VideoCapture (already opened, released by whoever opened it), or anything from open_capture
+    - is_camera: bool, False to pace reads to the source's timestamps and stop when it runs out
+
+    READ-ONLY Public Variables:
+    - frames_read: int
+    - frames_dropped: int
+
+    Protected Variables:
+    - _slot: tuple (frame, timestamp_ms) or None
+    - _dropped: int
+    - _slot_cond: Condition (threading)
+    - _stop_event: Event (threading)
+    '''
+    def __init__(self, cap, is_camera=True):
+        # Calling Thread parent class constructor
+        super().__init__()
+        self.daemon = True
+
+        # READ-ONLY Public Variables
+        self.cap = cap                        # The video feed we're reading from
+        self.is_camera = is_camera            # Cameras pace themselves, anything else gets paced to its timestamps
+        self.frames_read = 0                  # Total frames read from the camera
+        self.frames_dropped = 0               # Total frames overwritten before anyone took them
+
+        # Protected variables
+        self._slot = None                     # The one slot buffer - holds (frame, timestamp_ms) or None if taken
+        self._dropped = 0                     # Frames dropped since the last take
+        self._slot_cond = Condition()         # Guards the slot and wakes up whoever is waiting on a frame
+        self._stop_event = Event()            # Just an event flag for graceful exit
+
+    def run(self):
+        started = None
+        while not self._stop_event.is_set() and self.cap.isOpened():
+            # Blocking read - this is the only place that waits on the camera
+            ret, cv_frame = self.cap.read()
+            if not ret:
+                if not self.is_camera:
+                    break # End of the file/folder
+                # Camera hiccup, try again unless we're stopping
+                continue
+            timestamp_ms = int(self.cap.get(cv2.CAP_PROP_POS_MSEC))
+
+            # Not a camera - hand the frame out when a camera would have
+            if not self.is_camera:
+                if started is None:
+                    started = time.monotonic() - timestamp_ms / 1000
+                self._stop_event.wait(max(0.0, started + timestamp_ms / 1000 - time.monotonic()))
+
+            # Overwrite the slot, counting the old frame as dropped if nobody took it
+            with self._slot_cond:
+                if self._slot is not None:
+                    self._dropped += 1
+                    self.frames_dropped += 1
+                self._slot = (cv_frame, timestamp_ms)
+                self.frames_read += 1
+                self._slot_cond.notify()
+
+        # Wake up anyone still waiting so they can see we're done
+        with self._slot_cond:
+            self._slot_cond.notify_all()
+
+    def take(self, timeout=None):
+        '''
+        Takes the newest frame out of the slot, waiting up to timeout seconds for one to arrive. Returns a
+        tuple of (frame, timestamp_ms, dropped) where dropped is how many frames were thrown away since the
+        last take, or None if no frame arrived in time or the grabber is stopping.
+        '''
+        with self._slot_cond:
+            self._slot_cond.wait_for(
+                lambda: self._slot is not None or self._stop_event.is_set() or not self.is_alive(), timeout)
+            if self._slot is None:
+                return None
+
+            # Empty the slot so the next take waits for a fresh frame
+            cv_frame, timestamp_ms = self._slot
+            dropped = self._dropped
+            self._slot = None
+            self._dropped = 0
+
+        return cv_frame, timestamp_ms, dropped
+
+    def stop(self):
+        '''
+        Stops the grabber after its current read. Does not release the capture.
+        '''
+        self._stop_event.set()
+        with self._slot_cond:
+            self._slot_cond.notify_all()
 
 # Main Pose Estimation & Exercise Detection Thread
 class Pose_Estimation(Thread):
@@ -90,89 +546,204 @@ class Pose_Estimation(Thread):
 
     Only one of these threads should exist at a time (will eventually enforce singleton). Feel free
     to read the public variables at any time, or if you really care about preventing race conditions 
-    use get_results (Python's Global Interpreter Lock makes this mostly unnecessary though)
+    read snapshot (or use get_results), which always holds a matching set of results for one frame
 
     Arguments:
     - exercise: int
     - return_mask: bool
+    - mp_model_path: str
+    - ex_model_path: str
+    - engine: int (see Pose_Engines in enumoptions.py)
+    - models: Model_Cache (defaults to the model_cache shared by every camera thread)
+    - governor: Inference_Governor or None (picks the MediaPipe model and rate instead of mp_model_path)
+    - preprocessor: Frame_Preprocessor or None (defaults to one cropping to the player at full resolution)
+    - annotate: tuple (width, height) or None, draw the portrait annotation once per frame at this size
+    - annotate_hide_cam: bool, draw that annotation on black instead of the camera image
+    - frame_buffer: Shared_Frame_Buffer or None, draw that annotation straight into this (turns annotate on at its size)
+    - source: what to read frames from - camera index (default 0), video file, image folder, or a generator of
+      frames (see open_capture)
+    - offline: bool, process every frame of the source in order, as fast as possible, timed by the source's own
+      timestamps instead of the clock (always the VIDEO engine, and the governor is ignored) - for batch runs
+      over recorded sessions and tests without a camera. The thread stops at the end of the source.
+    - fps: float, frame rate for image folders and generators that don't come with timestamps
+    - landmarker: function or None, called in the camera thread with the PoseLandmarkerOptions it needs and
+      returning a landmarker that's already made (and warmed up) to use instead of making one, or None if it
+      hasn't got a matching one (see Warm_Up.take_landmarker in warmup.py)
 
     READ-ONLY Public Variables: 
+    - snapshot: Pose_Snapshot
+    - frame_id: int
     - frame: ndarray
     - mp_image: ndarray
     - mp_result: MediaPipe Object
     - mp_mask: None
     - exercise: int
-    - ex_results: deque
+    - ex_results: Prediction_Ring (predictions.py)
+    - reps: Rep_Counter (predictions.py)
+    - frames_dropped: int
+    - frames_processed: int, frames that went through the landmarker
+    - models: Model_Cache
+    - governor: Inference_Governor or None
+    - preprocessor: Frame_Preprocessor
+    - mp_model_path: str, the MediaPipe model currently in use
+    - annotate: tuple (width, height) or None
+    - annotate_hide_cam: bool
+    - frame_buffer: Shared_Frame_Buffer or None
+    - recorder: Pose_Recorder (recording.py) or None, gets every published snapshot while it's set
+    - state: int, how far along start up is (see Pipeline_States in enumoptions.py, and wait_until)
+    - state_error: str or None, why it FAILED
 
     Protected Variables:
-    - cap: cv2.VideoFeed
+    - cap: cv2.VideoFeed (or a Frames_Capture, see open_capture)
+    - _grabber: Frame_Grabber (None offline)
+    - _last_ts: int
     - _stop_event: Event (threading)
-    - _m_updated: Event (threading)
-    - _m_lock: Lock (threading)
-    - _ex_model: JobLib Object
+    - _result_cond: Condition (threading), also guards state
+    - _state_listeners: list of functions called with the new state on every change
+    - _attached: Event (threading), set while a level is using the thread (inference pauses otherwise)
+    - _in_flight: deque, (timestamp, frame, region) for each frame sent to the LIVE_STREAM landmarker
+    - _take_landmarker: function or None, the landmarker argument
+    - _ex_state: tuple (exercise, model), model being a Compact_Forest (or JobLib Object if not a random forest)
+    - _last_ex_state: tuple, the _ex_state the last stored prediction was made with
+    - _features: Feature_Extractor
+    - _renderer: Skeleton_Renderer, the camera thread's own (the module one is used by other threads)
     - _options: MediaPipe Object
     - _exists: bool
     '''
 
+    # Most LIVE_STREAM frames waiting on MediaPipe at once, any more get dropped before they're sent
+    MAX_IN_FLIGHT = 8
+
     # Protected Class Variable - TODO: Singleton Pattern
     _exists = False                           # Is there already an instance of this class in existence? 
 
     # Constructor, Inputs, & Variables
     def __init__(self, exercise=op.Exercises.CRUNCH.value, return_mask=False, 
-                 mp_model_path=op.Model_Paths.MP_FULL.value, ex_model_path=op.Model_Paths.EX_DEFAULT.value):
+                 mp_model_path=op.Model_Paths.MP_FULL.value, ex_model_path=op.Model_Paths.EX_DEFAULT.value,
+                 engine=op.Pose_Engines.VIDEO.value, models=None, governor=None,
+                 preprocessor=None, annotate=None, annotate_hide_cam=True, frame_buffer=None,
+                 source=0, offline=False, fps=30.0, landmarker=None):
         # Calling Thread parent class constructor
         super().__init__()
 
         # Setting up variables
         self.return_mask = return_mask        # Not yet implemented
+        if offline:
+            engine = op.Pose_Engines.VIDEO.value # Async landmarking drops frames when busy, offline can't
+        self.engine = engine                  # Blocking VIDEO or async LIVE_STREAM landmarking, see enumoptions.py
+        self.source = source                  # What to read frames from, see open_capture
+        self.offline = offline                # Every frame as fast as possible instead of keeping up with a camera
+        self.fps = fps                        # Frame rate of image folders/generators without their own timestamps
 
         # READ-ONLY Public Variables
         self.cap = None                       # Holds CV2's video capture feed object
+        self.snapshot = Pose_Snapshot(        # Latest results, all from the same frame (see Pose_Snapshot)
+            None, None, None, None, 0, 0, 0.0, None)
+        self.frame_id = 0                     # Goes up by one every time new results are published, see wait_for_result
         self.frame = None                     # Holds raw CV2 video frame
         self.mp_image = None                  # Holds MP image info converted from a cap video feed frame
         self.mp_results = None                # Holds all the results of the MediaPipe inference
         self.mp_mask = None                   # Holds body shape image mask returned by MediaPipe
         self.exercise = exercise              # Corresponds to the exercise the level is detecting from the list
-        self.ex_results = deque(maxlen=32)    # Holds the most recent 32 results of exercise detection (last ~2 secs)
+        self.ex_results = pr.Prediction_Ring(maxlen=32) # Exercise detection results with timestamps, windows default to the last 32 (~2 secs)
+        self.reps = pr.Rep_Counter()          # Counts reps of the current exercise from ex_results as they come in
+        self.frames_dropped = 0               # How many camera frames were skipped because inference was busy
+        self.frames_processed = 0             # How many frames got landmarked (offline, that's all of them)
+        self.models = models if models is not None else model_cache # Loaded exercise models, see preload_exercises
+        self.governor = governor              # Picks MediaPipe model tier and inference rate (None to always use mp_model_path)
+        if governor is not None:
+            mp_model_path = governor.tier_path
+        self.mp_model_path = mp_model_path    # MediaPipe model currently in use
+        self.preprocessor = preprocessor if preprocessor is not None else Frame_Preprocessor() # Crop/shrink/RGB before landmarking
+        self.annotate = annotate              # Portrait size to draw the skeleton at once per frame (None for off)
+        self.annotate_hide_cam = annotate_hide_cam # Whether that portrait is drawn on black or on the camera image
+        self.frame_buffer = frame_buffer      # Where the GUI pulls the portrait annotation from (see framebuffer.py)
+        if frame_buffer is not None and annotate is None:
+            self.annotate = (frame_buffer.shape[1], frame_buffer.shape[0])
+        self.recorder = None                  # Set to a Pose_Recorder to save every result (see recording.py)
+        self.state = op.Pipeline_States.STARTING.value # How far along start up is, see wait_until
+        self.state_error = None               # Why start up FAILED, if it did
 
         # Protected variables
+        self._grabber = None                  # Thread reading the camera, keeps only the newest frame
+        self._last_ts = -1                    # Last timestamp fed to the landmarker, must keep increasing
+        self._in_flight = deque()             # LIVE_STREAM only - (timestamp, frame, region) waiting on a result (MAX_IN_FLIGHT at most)
+        self._take_landmarker = landmarker    # Hands over an already warmed up landmarker, if there is one
         self._stop_event = Event()            # Just an event flag for graceful exit
-        self._options = PoseLandmarkerOptions(# MediaPipe settings
-            base_options=BaseOptions(model_asset_path=mp_model_path),
-            running_mode=VisionRunningMode.VIDEO)
-        self._ex_model = joblib.load(         # Loading exercise model
-            ex_model_path)
-        self._m_updated = Event()            # Flag for if ex_model is safe to run (T) or is pending update (F)...
-        self._m_updated.set()                # ...model update is rare, so putting mutex accquisition behind flag for speed
-        self._m_lock = Lock()                # Mutex for updating exercise model, see above two variables
+        self._result_cond = Condition()       # Notified on every publish and state change, so game threads can sleep until then
+        self._state_listeners = []            # Called on every state change, see add_state_listener
+        self._attached = Event()              # Cleared while no level is using us, see attach/detach
+        self._attached.set()
+        self._options = self._make_options(mp_model_path) # MediaPipe settings
+        self._ex_state = (exercise,           # Exercise and its model, always swapped together as one tuple so the
+            self.models.get(ex_model_path))   # camera thread never sees a half finished update (see set_exercise)
+        ft.check_schema(self._ex_state[1], ex_model_path)
+        self._set_rep_phases(exercise, self._ex_state[1], ex_model_path)
+        self._last_ex_state = self._ex_state  # What the last prediction was made with, to catch exercise changes
+        self._features = ft.Feature_Extractor()# Turns MP results into the model's input, shared with data_gatherer.py
+        self._renderer = Skeleton_Renderer()  # Draws the per frame annotation, only ever used by the publishing thread
         Pose_Estimation._exists = True        # Singleton Pattern - so only one instance exists at a time
     
+    # MediaPipe settings for a given model
+    def _make_options(self, mp_model_path):
+        '''
+        Builds the PoseLandmarkerOptions for a MediaPipe model file, in whichever running mode the engine
+        uses (LIVE_STREAM results get handed back through _on_async_result). "Private" function.
+        '''
+        if self.engine == op.Pose_Engines.LIVE_STREAM.value:
+            return PoseLandmarkerOptions(
+                base_options=BaseOptions(model_asset_path=mp_model_path),
+                running_mode=VisionRunningMode.LIVE_STREAM,
+                result_callback=self._on_async_result)
+        return PoseLandmarkerOptions(
+            base_options=BaseOptions(model_asset_path=mp_model_path),
+            running_mode=VisionRunningMode.VIDEO)
+
+    # Changing MediaPipe model tier mid run
+    def _swap_landmarker(self, landmarker):
+        '''
+        Closes the current landmarker and builds a new one with the model the governor picked. The camera
+        stalls for however long MediaPipe takes to load the model, which is why the governor only switches
+        rarely. Results still in flight on the old landmarker are dropped. "Private" function.
+        '''
+        landmarker.close()
+        self.frames_dropped += len(self._in_flight)
+        self._in_flight.clear()
+        self.preprocessor.reset()
+        self.mp_model_path = self.governor.tier_path
+        self._options = self._make_options(self.mp_model_path)
+        print(f"Pose model switched to {os.path.basename(self.mp_model_path)} "
+              f"(averaging {self.governor.latency * 1000:.1f} ms per frame)")
+        return PoseLandmarker.create_from_options(self._options)
+
     # Pose Estimation Call
-    def _estimate_pose(self, cap, landmarker):
+    def _estimate_pose(self, cv_frame, timestamp_ms, landmarker):
         '''
-        Uses the video feed capture and mediapipe landmarker objects (see 'def run(self):') to estimate pose and 
-        body landmark position. "Private" function.
+        Uses a frame from the video feed and the mediapipe landmarker object (see 'def run(self):') to estimate pose 
+        and body landmark position. "Private" function.
 
         Although this is technically an instance method, for data safety, it is being treated as an outside call. 
         This allows us to return the results and update the internal variables all at once. It is placed inside 
         the class purely for organizational reasons.
 
         Arguments: (besides self)
-        - cap, a cv2.VideoCapture object
+        - cv_frame, an image frame taken from the frame grabber
+        - timestamp_ms, the time in ms the frame was read at
         - landmarker, a mediapipe model object
         '''
 
-        # Get image frame and time from video feed
-        ret, cv_frame = cap.read()
-        timestamp_ms = int(cap.get(cv2.CAP_PROP_POS_MSEC))
-
-        # Convert the frame received from OpenCV to a MediaPipe’s Image object.
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=cv_frame)
+        # Crop, shrink, and convert the OpenCV frame to a MediaPipe Image object (see Frame_Preprocessor)
+        mp_image, region = self.preprocessor.prepare(cv_frame)
 
         # Send live image data to perform pose landmarking - treating it as video
         # rather than live feed because blocking makes things simpler than async
+        # (the LIVE_STREAM engine in _estimate_pose_async is the async alternative)
         pose_landmarker_result = landmarker.detect_for_video(mp_image, timestamp_ms)
 
+        # Put landmarks back in whole frame coordinates, and follow the player for the next crop
+        self.preprocessor.remap(pose_landmarker_result, region)
+        self.preprocessor.track(pose_landmarker_result)
+
         # TODO: Add image mask option
         if self.return_mask:
             mask = None
@@ -186,11 +757,80 @@ class Pose_Estimation(Thread):
         # Return the results
         return cv_frame, mp_image, pose_landmarker_result, mask
 
+    # Async Pose Estimation Call
+    def _estimate_pose_async(self, cv_frame, timestamp_ms, landmarker):
+        '''
+        LIVE_STREAM version of _estimate_pose. Hands the frame to the landmarker and returns straight away
+        so the next frame can be grabbed while this one is still being landmarked. The results come back
+        on MediaPipe's own thread through _on_async_result. "Private" function.
+
+        If MediaPipe is already MAX_IN_FLIGHT frames behind, the frame is dropped instead of sent, so every
+        result that comes back still has its frame and crop waiting for it. Returns whether it was sent.
+
+        Arguments: (besides self)
+        - cv_frame, an image frame taken from the frame grabber
+        - timestamp_ms, a monotonic time in ms, has to be larger than the last one sent
+        - landmarker, a mediapipe model object created in LIVE_STREAM mode
+        '''
+        # Too far behind - skip this one rather than forget a frame that's still being landmarked
+        # (only this thread adds to _in_flight, the callback only takes out of it)
+        if len(self._in_flight) >= Pose_Estimation.MAX_IN_FLIGHT:
+            self.frames_dropped += 1
+            return False
+
+        # Crop, shrink, and convert the OpenCV frame to a MediaPipe Image object (see Frame_Preprocessor)
+        mp_image, region = self.preprocessor.prepare(cv_frame)
+
+        # Remember the frame and crop so the callback can match them to the result, then send it off
+        self._in_flight.append((timestamp_ms, cv_frame, region))
+        landmarker.detect_async(mp_image, timestamp_ms)
+        return True
+
+    # Async Result Callback
+    def _on_async_result(self, result, output_image, timestamp_ms):
+        '''
+        Called by MediaPipe (in its own thread) whenever a LIVE_STREAM result is ready. Matches the result
+        to the frame it came from, runs exercise detection, and updates the same public variables the
+        blocking VIDEO engine does. "Private" function.
+
+        Arguments: (besides self)
+        - result, the mediapipe results object
+        - output_image, the mediapipe image the result was computed on
+        - timestamp_ms, the timestamp the frame was sent with
+        '''
+        # Let the governor know how long this one took (LIVE_STREAM timestamps are monotonic ms)
+        if self.governor is not None:
+            self.governor.record(max(0, time.monotonic() * 1000 - timestamp_ms) / 1000)
+
+        # Anything sent before this frame that never got a result was dropped by MediaPipe for being late
+        matched = None
+        while len(self._in_flight) > 0 and self._in_flight[0][0] <= timestamp_ms:
+            sent_ts, sent_frame, sent_region = self._in_flight.popleft()
+            if sent_ts == timestamp_ms:
+                matched = (sent_frame, sent_region)
+            else:
+                self.frames_dropped += 1
+
+        # No frame to go with it (sent to a landmarker _swap_landmarker already closed, and counted as
+        # dropped there) - without its crop the landmarks can't be put back in the right place, so skip it
+        if matched is None:
+            return
+        cv_frame, region = matched
+
+        # Put landmarks back in whole frame coordinates, and follow the player for the next crop
+        self.preprocessor.remap(result, region)
+        self.preprocessor.track(result)
+
+        # Use those results to detect if an exercise is being properly done, then publish them the same
+        # way the VIDEO engine does (mask still not implemented, see _estimate_pose)
+        predict = self._update_ex_results(result)
+        self._publish(cv_frame, output_image, result, None, predict)
+
     # Exercise Detection Function 
-    def _detect_exercise(self, mp_rslt, exrcs):
+    def _detect_exercise(self, mp_rslt, exrcs, ex_model):
         '''
-        Just calls a cleanup function for data preprocessing, then calls the joblib RF model and
-        feeds it the cleaned up data, then hands back the prediction to be appended to FIFO deque.
+        Just has the feature extractor clean up the data for preprocessing, then calls the RF model (the
+        compact version from forest.py) and feeds it the cleaned up data, then hands back the prediction to be appended to ex_results.
         "Private" function.
 
         Takes the mp results object as input.
@@ -198,123 +838,344 @@ class Pose_Estimation(Thread):
         Arguments: (besides self)
         - mp_rslt, the mediapipe results object
         - exrcs, what exercise or movement is being detected
+        - ex_model, the model to use for it
         '''
         
-        # Clean up MP results format
-        clean = preprocess(mp_rslt)
+        # Clean up MP results format (already a single sample float32 array, see features.py)
+        clean = self._features.extract(mp_rslt)
 
         # Check if there was a detection, then feed into model to get prediction
         if clean is not None:
-            # Making into numpy array so it can be fed into model and reshape to show single sample
-            input = np.array(clean).reshape(1, -1) 
-            prediction = self._ex_model.predict(input)
+            prediction = ex_model.predict(clean)
         else:
             # If nothing could be detected, manually make prediction false
             prediction = 0
         return prediction
+
+    # Storing exercise detection results
+    def _update_ex_results(self, mp_rslt, timestamp=None):
+        '''
+        Runs exercise detection on a mediapipe result, appends the prediction to ex_results and feeds it to the
+        rep counter, making sure no prediction from an old model sneaks in after set_exercise swapped it out.
+        timestamp is when the frame was taken (time.monotonic() seconds, defaults to now). "Private" function.
+        '''
+        # Read exercise and model once - set_exercise can swap them at any moment without waiting on us
+        ex_state = self._ex_state
+        predict = self._detect_exercise(mp_rslt, ex_state[0], ex_state[1])
+
+        # First prediction since the exercise changed - clear out anything that slipped in during the swap
+        if ex_state is not self._last_ex_state:
+            self._last_ex_state = ex_state
+            self.ex_results.clear()
+            self.reps.reset()
+
+        # Only keep it if the model wasn't swapped while we were predicting
+        if ex_state is not self._ex_state:
+            return None
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.ex_results.append(predict, timestamp)
+        self.reps.feed(predict, timestamp)
+        return predict
+
+    # Publishing results
+    def _publish(self, cv_frame, mp_image, mp_rslt, mask, predict, timestamp=None):
+        '''
+        Bundles one frame's results into a new Pose_Snapshot and publishes it with a single assignment, so
+        readers never see a half updated set of results. Also keeps the older individual public variables
+        up to date, then wakes up anyone waiting in wait_for_result. Only ever called from whichever thread
+        produces results. "Private" function.
+
+        With annotate on, this is also where the portrait annotation gets drawn - once per result, no matter
+        how often the game loop asks for it. With a frame_buffer it's drawn straight into the buffer's back image
+        (the snapshot's annotation stays None, get_annotation copies it out of the buffer if anyone asks).
+
+        timestamp goes in the snapshot, defaults to now (offline runs and replays pass the frame's own time).
+        '''
+        frame_id = self.frame_id + 1
+        annotation = None
+        annotate = self.annotate
+        frame_buffer = self.frame_buffer      # Read once, attach/detach can swap it out at any moment
+        if annotate is not None:
+            image = None if self.annotate_hide_cam or cv_frame is None else cv_frame
+            shape = cv_frame.shape if cv_frame is not None else (480, 640)
+            if frame_buffer is not None and frame_buffer.shape == (annotate[1], annotate[0], 3):
+                # Drawn right where the portrait reads it from, the only copy on its way to the screen
+                with frame_buffer.writing(frame_id) as back:
+                    self._renderer.portrait(mp_rslt, image, annotate[0], annotate[1], shape, dst=back)
+            else:
+                annotation = self._renderer.portrait(mp_rslt, image, annotate[0], annotate[1], shape)
+        self.frame, self.mp_image, self.mp_results, self.mp_mask = cv_frame, mp_image, mp_rslt, mask
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.snapshot = Pose_Snapshot(cv_frame, mp_image, mp_rslt, mask, predict, frame_id, timestamp, annotation)
+        recorder = self.recorder              # Read once too, whoever's recording can unset it at any moment
+        if recorder is not None:
+            recorder.write(self.snapshot, self.exercise)
+        with self._result_cond:
+            self.frame_id = frame_id
+            self._result_cond.notify_all()
+
+        # Still starting up - the first result through means everything is warm, the first one with a person
+        # in it means we're ready to play
+        if 0 <= self.state < op.Pipeline_States.FIRST_RESULT.value:
+            if mp_rslt is not None and len(mp_rslt.pose_landmarks) > 0:
+                self._set_state(op.Pipeline_States.FIRST_RESULT.value)
+            elif self.state < op.Pipeline_States.MODEL_WARMED.value:
+                self._set_state(op.Pipeline_States.MODEL_WARMED.value)
+
+    # Start up progress
+    def _set_state(self, state, error=None):
+        '''
+        Moves the start up state along, wakes anyone in wait_until, and tells the listeners. "Private" function.
+        '''
+        with self._result_cond:
+            self.state = state
+            if error is not None:
+                self.state_error = error
+            self._result_cond.notify_all()
+            # Called with the lock held so every listener sees the states in order
+            for listener in list(self._state_listeners):
+                listener(state)
     
     # Main Function - Running the pose estimation followed by exercise detection in continuous loop
     def run(self):
-        # Acquire lock - 99% of time will have lock
-        self._m_lock.acquire()
-
-        # Set up video feed
-        self.cap = cv2.VideoCapture(0)
-        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # Set up video feed - the webcam unless we were given something else (see open_capture)
+        self.cap, is_camera = open_capture(self.source, self.fps)
+        if not self.cap.isOpened():
+            self.cap.release()
+            what = "the camera" if is_camera else f"the capture source {self.source!r}"
+            print(f"\nERROR: Couldn't open {what}")
+            self._set_state(op.Pipeline_States.FAILED.value, f"Couldn't open {what}")
+            return None
+        # Offline reads every frame itself, in order - otherwise the grabber thread keeps only the newest
+        # (buffer size is only a hint most backends ignore, hence the grabber thread)
+        if is_camera:
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if not self.offline:
+            self._grabber = Frame_Grabber(self.cap, is_camera)
+            self._grabber.start()
+        self._set_state(op.Pipeline_States.CAMERA_OPENED.value)
 
-        # Create MediaPipe landmarker object (initializes WASM runtime then makes class isntance)
-        with PoseLandmarker.create_from_options(self._options) as landmarker:
+        # Create MediaPipe landmarker object (initializes WASM runtime then makes class isntance), unless we
+        # were handed one that's ready to go
+        try:
+            landmarker = None
+            if self._take_landmarker is not None:
+                landmarker = self._take_landmarker(self._options)
+            if landmarker is None:
+                landmarker = PoseLandmarker.create_from_options(self._options)
+            else:
+                self._last_ts = max(self._last_ts, 0) # It's already seen a frame at timestamp 0
+        except Exception as e: # Usually the .task model file missing
+            self._close_capture()
+            print(f"\nERROR: Couldn't create the pose landmarker: {e}")
+            self._set_state(op.Pipeline_States.FAILED.value, f"Couldn't create the pose landmarker: {e}")
+            return None
+        self._set_state(op.Pipeline_States.LANDMARKER_READY.value)
+        idle = False
+        clock = time.monotonic()      # Offline, predictions are timed by the source's timestamps counting from here
+        started = time.perf_counter()
+        try:
             # Start detection loop
-            while not self._stop_event.is_set() and self.cap.isOpened():
-                # Perform pose estimation and store updated results
-                self.frame, self.mp_image, self.mp_results, self.mp_mask = self._estimate_pose(self.cap, landmarker)
-                
-                # Use those results to detect if an exercise is being properly done
-                predict = self._detect_exercise(self.mp_results, self.exercise)
-                self.ex_results.append(predict)
-
-                # Check if the main thread wants to update the model or read something
-                if not self._m_updated.is_set():
-                    # Give permission to update
-                    self._m_lock.release()
-                    # Wait until finished updating
-                    self._m_updated.wait()
-                    # Regain control of mutex when update done
-                    self._m_lock.acquire()
-
-        # Clean up
-        print(f"Camera thread closed")
-        self._m_lock.release()
+            while not self._stop_event.is_set():
+                # No level attached - keep the camera and landmarker open for the next one, but don't run anything
+                if not self._attached.is_set():
+                    idle = True
+                    self._attached.wait(0.5)
+                    continue
+
+                if self.offline:
+                    # Every frame, as soon as the last one's done
+                    ret, cv_frame = self.cap.read()
+                    if not ret:
+                        break # End of the source
+                    timestamp_ms, dropped = int(self.cap.get(cv2.CAP_PROP_POS_MSEC)), 0
+                else:
+                    # Take the freshest frame, anything older that piled up in the meantime was dropped
+                    grabbed = self._grabber.take(timeout=1.0)
+                    if grabbed is None:
+                        if not self._grabber.is_alive():
+                            break # Camera gone, or the end of a file/folder
+                        continue
+                    cv_frame, timestamp_ms, dropped = grabbed
+                if not idle: # Frames skipped while detached weren't dropped, nobody wanted them
+                    self.frames_dropped += dropped
+                idle = False
+
+                # Landmarker needs strictly increasing timestamps, and not every backend reports real ones
+                if self.engine == op.Pose_Engines.LIVE_STREAM.value:
+                    timestamp_ms = int(time.monotonic() * 1000)
+                timestamp_ms = max(timestamp_ms, self._last_ts + 1)
+                self._last_ts = timestamp_ms
+
+                frame_started = time.perf_counter()
+                if self.engine == op.Pose_Engines.LIVE_STREAM.value:
+                    # Send it off and go straight back to grabbing, the callback does the rest
+                    sent = self._estimate_pose_async(cv_frame, timestamp_ms, landmarker)
+                    spent = 0.0 # the callback tells the governor how long it really took
+                else:
+                    # Perform pose estimation
+                    cv_frame, mp_image, mp_rslt, mask = self._estimate_pose(cv_frame, timestamp_ms, landmarker)
+                    
+                    # Use those results to detect if an exercise is being properly done, then publish them
+                    timestamp = clock + timestamp_ms / 1000 if self.offline else None
+                    predict = self._update_ex_results(mp_rslt, timestamp)
+                    self._publish(cv_frame, mp_image, mp_rslt, mask, predict, timestamp)
+                    spent = time.perf_counter() - frame_started
+                    if self.governor is not None and not self.offline:
+                        self.governor.record(spent)
+                    sent = True
+                if sent:
+                    self.frames_processed += 1
+
+                # Let the governor change model tier and hold back the rate if needed (never offline, where
+                # every frame has to go through the same model as fast as it can)
+                if self.governor is not None and not self.offline:
+                    if self.governor.tier_path != self.mp_model_path:
+                        landmarker = self._swap_landmarker(landmarker)
+                    # Frames that come in while waiting just get dropped by the grabber
+                    self._stop_event.wait(self.governor.next_delay(spent))
+        finally:
+            landmarker.close()
+
+        # Clean up - grabber first so nothing is reading when the capture is released
+        self._close_capture()
+        if self.offline:
+            seconds = time.perf_counter() - started
+            print(f"Offline run done ({self.frames_processed} frames in {seconds:.1f} s, "
+                  f"{self.frames_processed / max(seconds, 1e-9):.1f} fps)")
+        else:
+            print(f"Camera thread closed ({self.frames_dropped} stale frames dropped)")
+        self._set_state(op.Pipeline_States.STOPPED.value)
         return None
+
+    def _close_capture(self):
+        '''
+        Stops the grabber (if there is one) then releases the capture. "Private" function.
+        '''
+        if self._grabber is not None:
+            self._grabber.stop()
+            self._grabber.join()
+        self.cap.release()
     
     #
     # Below this point are public functions - ones that are meant to be called repeatedly, anyway
     #
 
-    # Run the default mediapipe annotations (thread safe optional)
-    def get_default_annotation(self, hide_cam=True, safer=False):
+    # Sleep until the camera thread has something new
+    def wait_for_result(self, after_id=None, timeout=None):
         '''
-        Returns the default mediapipe annotation results as an image in ndarray form. 
-        Two optional arguments, first if true hides the camera and annotates a black background.
-        Second if true makes it fully thread safe but slightly slower.
+        Blocks until results newer than frame after_id are published, then returns that newest snapshot.
+        Lets a game loop sleep between inferences instead of spinning and redrawing the same frame over and
+        over - keep the frame_id of the snapshot you got and pass it back in next time.
+
+        Arguments
+        - after_id, the frame_id of the last snapshot you handled (None means whatever the newest one is now)
+        - timeout, the most seconds to wait (None waits forever - not recommended, see below)
+
+        Returns the newest Pose_Snapshot, or None if it timed out or the thread was stopped. Use a timeout in
+        game loops so they still notice game_loop being cleared while the camera has nothing new.
         '''
+        with self._result_cond:
+            if after_id is None:
+                after_id = self.frame_id
+            self._result_cond.wait_for(
+                lambda: self.frame_id > after_id or self._stop_event.is_set(), timeout)
+            if self.frame_id <= after_id:
+                return None
+            return self.snapshot
 
-        # Quicker vs thread safe
-        if not safer:
-            mp_rslts = self.mp_results
-            if not hide_cam:
-                img_input = self.frame
-            else:
-                width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                img_input = np.zeros((height, width, 3), dtype=np.uint8)
-        else:
-            self._m_updated.clear()
-            self._m_lock.acquire()
-            mp_rslts = self.mp_results
-            if not hide_cam:
-                img_input = self.frame
-            else:
-                width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                img_input = np.zeros((height, width, 3), dtype=np.uint8)
-            self._m_lock.release()
-            self._m_updated.set()
-        
-        # Use the default mp draw annotations example function 
-        anntd_img = draw_landmarks_on_image(img_input, mp_rslts)
-        return anntd_img
+    # Sleep until the camera thread is far enough along starting up
+    def wait_until(self, state=op.Pipeline_States.FIRST_RESULT.value, timeout=None):
+        '''
+        Blocks until the camera thread reaches a start up state (see Pipeline_States in enumoptions.py) - by
+        default FIRST_RESULT, the first result with the player in it, which is when a level can really start.
+
+        Returns True once it's there, or False if it timed out, failed, or was stopped (state_error says why
+        it failed). Like wait_for_result, use a timeout in a loop so clearing game_loop still gets noticed.
+        '''
+        with self._result_cond:
+            self._result_cond.wait_for(
+                lambda: self.state >= state or self.state < 0 or self._stop_event.is_set(), timeout)
+            return self.state >= state
+
+    # Get told about start up progress
+    def add_state_listener(self, listener):
+        '''
+        Calls listener(state) every time the start up state changes, and once right away with the current one.
+        It gets called from the camera thread (or MediaPipe's), so keep it quick and use invoke for anything
+        touching the GUI.
+        '''
+        with self._result_cond:
+            self._state_listeners.append(listener)
+            listener(self.state)
+
+    def remove_state_listener(self, listener):
+        with self._result_cond:
+            if listener in self._state_listeners:
+                self._state_listeners.remove(listener)
+
+    # Run the default mediapipe annotations (always thread safe now)
+    def get_default_annotation(self, hide_cam=True, safer=False, width=None):
+        '''
+        Returns the default mediapipe annotation results as an image in ndarray form (BGR, drawn by
+        Skeleton_Renderer). Optional argument hide_cam, if true hides the camera and annotates a black background.
+        Optional argument width draws it straight at that width (like the player portrait's) instead of full size.
+
+        The image is one of the renderer's reused canvases, so it gets drawn over again a few calls later -
+        fine for handing to update_frame, copy it if you want to keep it.
+
+        Always thread safe, since it draws from a single snapshot - safer is only kept so older
+        levels that pass it still work.
+        '''
+        # One consistent frame + results pair, no locking needed
+        snap = self.snapshot
+        if snap.mp_results is None:
+            # Nothing published yet, just a blank frame
+            blank = renderer.canvas(480, 640)
+            blank.fill(0)
+            return blank
+
+        # Skeleton drawn straight onto a reused canvas (black, or a copy of the camera frame)
+        frame_shape = snap.frame.shape if snap.frame is not None else (480, 640)
+        if hide_cam or snap.frame is None:
+            return renderer.render(snap.mp_results, None, width, frame_shape)
+        return renderer.render(snap.mp_results, snap.frame, width)
+
+    # The once per frame portrait annotation
+    def get_annotation(self):
+        '''
+        Returns the newest portrait annotation - the skeleton already drawn at portrait size, mirrored and in
+        RGB, so it can go straight to update_frame with preformatted=True. It's drawn once per new result by the
+        camera thread, so calling this as often as you like costs nothing.
+
+        Only works with annotate turned on (pass annotate=(width, height) when creating the thread), returns
+        None otherwise, or if nothing has been published yet. With a frame_buffer, the annotation only goes into
+        the buffer, so this returns a copy of the buffer's newest frame (reading the buffer saves that copy).
+        '''
+        annotation = self.snapshot.annotation
+        frame_buffer = self.frame_buffer
+        if annotation is None and frame_buffer is not None and frame_buffer.frame_id > 0:
+            with frame_buffer.latest() as (image, frame_id):
+                annotation = image.copy()
+        return annotation
 
     # Dump all results (thread safe)
     def get_results(self):
         '''
         Returns the camera frame (ndarray), the mediapipe results (its own object), the exercise detection
-        results (deque), and the mask (None if show mask set to false, not implemented yet so always none)
+        results (Prediction_Ring), and the mask (None if show mask set to false, not implemented yet so always none)
         in a thread safe way. 
         
-        However, in practice, you can just read these variables at any time directly since race conditions
-        are not too troublesome in this context. If you need speed and don't care about race conditions,
-        just access them like you would any class variable.
+        The frame, results, and mask all come from the same snapshot, so they always match, and reading
+        them never makes the camera thread wait. If you want the prediction and frame number too, just
+        read snapshot directly.
 
         No Arguments. Returns frm, mp_rslts, ex_rslts, msk.
         '''
-
-        # Make flag false to get thread to release lock
-        self._m_updated.clear()
-        # Wait for thread to give permission to update (since this func will be called from Main thread)
-        self._m_lock.acquire()
-
-        # Store all results in temporary variables
-        frm = self.frame
-        mp_rslts = self.mp_results
-        ex_rslts = self.ex_results
-        msk = self.mp_mask
-
-        # Release lock and fix flag again
-        self._m_lock.release()
-        self._m_updated.set()
-
-        return frm, mp_rslts, ex_rslts, msk
+        snap = self.snapshot
+        return snap.frame, snap.mp_results, self.ex_results, snap.mp_mask
     
     # Get a specific result, like a body part (thread safe optional)
     def get_body_part(self, body_part=op.Body_Parts.NOSE.value, mp_rslts=None, safer=False):
@@ -322,23 +1183,17 @@ class Pose_Estimation(Thread):
         Returns xyz coordinates and visibility of a given body part from a mediapipe results object. 
         With no arguments, returns the nose. See enumoptions.py for list of body parts. 
         
-        Accepts an int corresponding to the body part, a mediapipe object to parse (put None to get
-        the most recent result), and a bool that forces this to be slower but thread safe if trying 
-        to get most recent result.
+        Accepts an int corresponding to the body part and a mediapipe object to parse (put None to get
+        the most recent result). Reading the most recent result is always thread safe now, safer is only
+        kept so older levels that pass it still work.
         '''
         # If user doesn't input a specific result, grab most recent
-        if mp_rslts is None and not safer:
-            # Faster, technically not thread safe but Python's GIL makes this perfectly fine
-            mp_rslts = self.mp_results
-        elif mp_rslts is None and safer:
-            # Fully thread safe, make flag false so cam thread gives up lock
-            self._m_updated.clear()
-            self._m_lock.acquire()
-            # Store in temp variable
-            mp_rslts = self.mp_results
-            # Return lock and flag to how they were
-            self._m_lock.release()
-            self._m_updated.set()
+        if mp_rslts is None:
+            mp_rslts = self.snapshot.mp_results
+
+        # If nothing published yet
+        if mp_rslts is None:
+            return (0.0, 0.0, 0.0), 0.0
 
         # Abbreviation for...
         pose_landmarks_list = mp_rslts.pose_landmarks     # the result list in the media pipe return
@@ -359,27 +1214,87 @@ class Pose_Estimation(Thread):
         # Returning as a tuple and a float
         return (x, y, z), v
 
+    # Handing the thread from level to level
+    def attach(self, exercise=None, frame_buffer=None, annotate=None):
+        '''
+        Gets the thread ready for a new level without restarting anything - the camera, the landmarker and the
+        loaded models all stay as they are. Sets the exercise (through the model cache, so preload it), clears
+        the old level's exercise results, starts cropping from the whole frame again, and swaps in the new
+        level's portrait frame_buffer/annotate (same as the constructor arguments). Then resumes inference if
+        it was detached. Returns the thread.
+
+        Detach the last level first.
+        '''
+        if exercise is not None:
+            self.set_exercise(exercise)
+        else:
+            self.ex_results.clear()
+            self.reps.reset()
+        self.preprocessor.reset()
+        if frame_buffer is not None and annotate is None:
+            annotate = (frame_buffer.shape[1], frame_buffer.shape[0])
+        self.frame_buffer = frame_buffer
+        self.annotate = annotate
+        self._attached.set()
+        return self
+
+    def detach(self):
+        '''
+        Lets go of the current level - stops drawing into its frame buffer, forgets its state and rep
+        listeners, and pauses inference (the camera and landmarker stay open) until the next attach. Call stop
+        instead when you're done with the thread for good.
+        '''
+        self._attached.clear()
+        self.frame_buffer = None
+        self.annotate = None
+        with self._result_cond:
+            self._state_listeners.clear()
+        self.reps.reset(listeners=True)
+
     # Changes the exercise being detected and possibly the model (thread safe)
     def set_exercise(self, new_exercise: int):
         '''
         Update the exercise being detected. See Exercises in enumoptions.py for a list of possible inputs.
+
+        Never pauses the camera thread - the model comes out of the model cache (instantly if the level
+        preloaded it with preload_exercises, otherwise it gets loaded here in the calling thread) and is
+        swapped in with a single assignment.
         '''
-        # Make flag false to show model will be updating and not safe to use
-        self._m_updated.clear()
-        # Wait for thread to give permission to update (since this will be called from Main thread)
-        self._m_lock.acquire()
+        # Get the model first, refusing models trained on a different feature layout before touching anything
+        model_path = op.exercise_to_model[new_exercise]
+        new_model = self.models.get(model_path)
+        ft.check_schema(new_model, model_path)
+        self._set_rep_phases(new_exercise, new_model, model_path)
 
-        # Actually update the model, if new exercise calls for updating it
-        if op.exercise_to_model[new_exercise] is not op.exercise_to_model[self.exercise]:
-            self._ex_model = joblib.load(op.exercise_to_model[new_exercise])
-        
-        # Clear results for new data types to come through
-        self.ex_results.clear()
+        # Swap exercise and model in one go, then clear results for new data types to come through
+        self._ex_state = (new_exercise, new_model)
         self.exercise = new_exercise
+        self.ex_results.clear()
+        self.reps.reset()
+
+    def _set_rep_phases(self, exercise, model, model_path):
+        '''
+        Sets which classes the rep counter counts reps with for an exercise (see exercise_rep_phases in
+        enumoptions.py), and warns if the model can't predict them. "Private" function.
+        '''
+        self.reps.set_phases(*op.exercise_rep_phases.get(exercise, (1, 2)))
+        classes = getattr(model, 'classes_', None)
+        if classes is not None:
+            self.reps.check_classes(classes, model_path)
 
-        # Finished - give back lock and set flag to let thread know model was updated (order is important)
-        self._m_lock.release()
-        self._m_updated.set()
+    # Loads the models for a list of exercises ahead of time
+    def preload_exercises(self, exercises, wait=False):
+        '''
+        Loads and warms up the models for a list of exercises (see Exercises in enumoptions.py) in the
+        background, so set_exercise can switch to them instantly later. Levels should call this with
+        every exercise they plan to use. Pass wait=True to block until they're loaded.
+        '''
+        # Several exercises can share one model, only load each once
+        model_paths = []
+        for exercise in exercises:
+            if op.exercise_to_model[exercise] not in model_paths:
+                model_paths.append(op.exercise_to_model[exercise])
+        return self.models.preload(model_paths, wait)
     
     # Gracefully exits
     def stop(self):
@@ -387,5 +1302,12 @@ class Pose_Estimation(Thread):
         Gracefully terminates thread. Don't forget "del thread_name" to release name binding.
         '''
         self._stop_event.set()
-        self.cap.release()
+        self._attached.set() # Don't leave it waiting for a level
+        if self._grabber is not None:
+            self._grabber.stop()
+        with self._result_cond:
+            self._result_cond.notify_all()
+        # Never started - nothing else is going to say it's stopped
+        if not self.is_alive() and self.state == op.Pipeline_States.STARTING.value:
+            self._set_state(op.Pipeline_States.STOPPED.value)
         Pose_Estimation._exists = False
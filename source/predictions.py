@@ -0,0 +1,404 @@
+from threading import Lock, Condition
+from collections import namedtuple
+import numpy as np
+import time
+
+'''
+Storage for the stream of exercise predictions the camera thread makes, one per frame.
+
+The old deque of 1 element arrays meant every check a level made turned it into a list, padded it, and summed it
+in Python. Prediction_Ring keeps them as int8 in a preallocated ring with a timestamp for each, plus running
+counts of every class, so "how many positives in the last 32 frames", "how long has it been class 2 for" and
+"how were the last 3 seconds split between classes" are a couple of array lookups no matter the window size.
+
+Rep_Counter goes one step further and turns the predictions into reps as they come in, so levels can react to
+the player finishing one instead of checking windows every couple of seconds.
+
+No Qt in here - the camera thread writes to it, the level thread reads from it.
+'''
+
+def as_class(value):
+    '''
+    Turns a prediction (int, numpy int, or the 1 element array the models' predict returns) into a plain int.
+    '''
+    if isinstance(value, np.ndarray):
+        return int(value.reshape(-1)[0])
+    return int(value)
+
+class Prediction_Ring():
+    '''
+    Ring buffer of class predictions (small non negative ints) and when they were made, with running per class
+    counts. One thread appends (the camera thread), any thread can read.
+
+    Windows are either the last n predictions or the last seconds worth of them, never reaching back past the
+    last clear or further than capacity. Frame windows cost O(1) (O(n_classes) for whole histograms), time
+    windows add a binary search over the timestamps to find where they start.
+
+    Works as a stand in for the deque(maxlen=32) ex_results used to be - append, clear, len and iterating all
+    do the same thing over the last maxlen predictions, so older levels that do list(ex_results) still work.
+
+    Arguments:
+    - maxlen: int, the default window (what len and iterating cover, and n defaults to), default 32 (~2 secs)
+    - capacity: int, how many predictions are kept for longer windows
+    - n_classes: int, predictions have to be from 0 to n_classes - 1
+
+    READ-ONLY Public Variables:
+    - total: int, predictions appended since the last clear
+
+    Protected Variables:
+    - _values: ndarray (2 * capacity) int8, every prediction written twice (see view)
+    - _times: ndarray (2 * capacity) float64, same for their timestamps
+    - _counts: ndarray (capacity + 1, n_classes) int64, running counts - row k % (capacity + 1) holds how many
+      of each class came before the kth prediction ever appended
+    - _appended: int, predictions appended ever (clear doesn't reset it, only total)
+    - _streak: int, how many of the newest predictions in a row were the same class
+    - _lock: Lock (threading)
+    '''
+    def __init__(self, maxlen=32, capacity=1024, n_classes=8):
+        if maxlen > capacity:
+            raise ValueError(f"maxlen ({maxlen}) can't be more than capacity ({capacity})")
+        # Arguments
+        self.maxlen = maxlen
+        self.capacity = capacity
+        self.n_classes = n_classes
+
+        # READ-ONLY Public Variables
+        self.total = 0
+
+        # Protected Variables
+        self._values = np.zeros(2 * capacity, dtype=np.int8)
+        self._times = np.zeros(2 * capacity, dtype=np.float64)
+        self._counts = np.zeros((capacity + 1, n_classes), dtype=np.int64)
+        self._appended = 0
+        self._streak = 0
+        self._lock = Lock()
+
+    def append(self, value, timestamp=None):
+        '''
+        Adds the newest prediction, made at timestamp (time.monotonic() seconds, defaults to now).
+        '''
+        value = as_class(value)
+        if not 0 <= value < self.n_classes:
+            raise ValueError(f"Prediction {value} is outside of 0 to {self.n_classes - 1}")
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        with self._lock:
+            k = self._appended
+            slot = k % self.capacity
+            # Written twice, half a ring apart, so the newest n always sit next to each other (see view)
+            self._values[slot] = self._values[slot + self.capacity] = value
+            self._times[slot] = self._times[slot + self.capacity] = timestamp
+
+            # Running counts for the next prediction are this one's plus one of this class
+            rows = self.capacity + 1
+            self._counts[(k + 1) % rows] = self._counts[k % rows]
+            self._counts[(k + 1) % rows, value] += 1
+
+            # Streak carries on if it's the same class as the last one
+            if self.total > 0 and self._values[(k - 1) % self.capacity] == value:
+                self._streak += 1
+            else:
+                self._streak = 1
+            self._appended = k + 1
+            self.total += 1
+
+    def clear(self):
+        '''
+        Forgets every prediction so far (the memory is kept, nothing gets reallocated).
+        '''
+        with self._lock:
+            self.total = 0
+            self._streak = 0
+
+    def _window(self, n, seconds):
+        '''
+        How many of the newest predictions a window covers. Call with the lock held. "Private" function.
+        '''
+        available = min(self.total, self.capacity)
+        if seconds is not None:
+            end = self._appended % self.capacity + self.capacity
+            times = self._times[end - available:end]
+            available -= int(np.searchsorted(times, times[-1] - seconds, side="left")) if available > 0 else 0
+        if n is None and seconds is None:
+            n = self.maxlen
+        return available if n is None else min(n, available)
+
+    def histogram(self, n=None, seconds=None):
+        '''
+        How many of each class are in a window - the last n predictions, the last seconds (counted back from
+        the newest one), or both (whichever is shorter). Neither means the last maxlen. Returns an int64 ndarray
+        with n_classes counts.
+        '''
+        with self._lock:
+            size = self._window(n, seconds)
+            rows = self.capacity + 1
+            return self._counts[self._appended % rows] - self._counts[(self._appended - size) % rows]
+
+    def count(self, cls, n=None, seconds=None):
+        '''
+        How many predictions of one class are in a window (see histogram for n and seconds).
+        '''
+        with self._lock:
+            size = self._window(n, seconds)
+            rows = self.capacity + 1
+            return int(self._counts[self._appended % rows, cls] - self._counts[(self._appended - size) % rows, cls])
+
+    def window_sum(self, n=None, seconds=None):
+        '''
+        Sum of the predictions in a window, the same number sum(list(ex_results)) used to give for the last 32.
+        '''
+        return int(self.histogram(n, seconds) @ np.arange(self.n_classes))
+
+    def fraction(self, cls=None, n=None, seconds=None):
+        '''
+        Fraction (0 to 1) of a window that's class cls - or anything but 0 (ie doing the exercise at all) if cls is
+        None. 0.0 for an empty window.
+        '''
+        counts = self.histogram(n, seconds)
+        size = counts.sum()
+        if size == 0:
+            return 0.0
+        hits = size - counts[0] if cls is None else counts[cls]
+        return float(hits / size)
+
+    def streak(self, cls=None):
+        '''
+        How many of the newest predictions in a row have been the same class - or 0 if cls is given and the
+        newest one isn't that class.
+        '''
+        with self._lock:
+            if self.total == 0:
+                return 0
+            if cls is not None and self._values[(self._appended - 1) % self.capacity] != cls:
+                return 0
+            return self._streak
+
+    def latest(self):
+        '''
+        (prediction, timestamp) of the newest one, or None if there's nothing since the last clear.
+        '''
+        with self._lock:
+            if self.total == 0:
+                return None
+            slot = (self._appended - 1) % self.capacity
+            return int(self._values[slot]), float(self._times[slot])
+
+    def view(self, n=None, seconds=None):
+        '''
+        The predictions and timestamps in a window (oldest first), as read only ndarray views straight into the
+        ring - no copying. They stay correct until capacity - n more predictions come in (the camera thread
+        adds ~16 a second), so use them right away or copy them.
+        '''
+        with self._lock:
+            size = self._window(n, seconds)
+            end = self._appended % self.capacity + self.capacity
+            values = self._values[end - size:end]
+            times = self._times[end - size:end]
+        values.flags.writeable = False
+        times.flags.writeable = False
+        return values, times
+
+    # Deque stand ins, over the last maxlen
+    def __len__(self):
+        return min(self.total, self.maxlen)
+
+    def __iter__(self):
+        return iter(self.view()[0].tolist())
+
+# One finished rep. Times are the same clock as the predictions (time.monotonic() seconds unless told otherwise).
+Rep = namedtuple('Rep', [
+    'count',        # which rep this was (1 for the first since the last reset)
+    'start',        # when the first phase started
+    'turn',         # when the second phase started
+    'end',          # when the first phase came back, finishing it (and starting the next one)
+    'duration',     # end - start, seconds
+    'interval',     # seconds since the last rep ended, None for the first one
+])
+
+class Rep_Counter():
+    '''
+    Turns the stream of exercise predictions into reps. Most exercise models are trained on three classes (see
+    randforest_creator.py) - 0 for resting, 1 for the first phase of the exercise and 2 for the second - so a
+    rep is 1 -> 2 -> 1. The closing 1 also starts the next rep, so 1 2 1 2 1 is two reps. Models with other
+    classes need other first/second classes (set_phases) - check_classes says if a model can't ever make a rep.
+
+    A phase only counts once min_frames predictions in a row agree on it, so the odd misclassified frame can't
+    flip it back and forth (it's backdated to the first of those frames, so the times stay accurate). Resting for
+    min_frames, or taking longer than max_rep_seconds, throws away a half done rep. Everything is a few
+    comparisons per prediction, no windows get looked at again.
+
+    Pose_Estimation feeds its own one (cam_thread.reps) every prediction. Levels can read count, block in
+    wait_for_rep, or add a listener - listeners get called with each Rep from the camera thread, so keep them
+    short and use hlp.invoke for anything Qt.
+
+    Arguments:
+    - first: int, class of the phase a rep starts and ends with (default 1)
+    - second: int, class of the phase in between (default 2)
+    - rest: int, resting class (default 0)
+    - min_frames: int, predictions in a row it takes to believe a phase changed (default 3, ~0.2 secs)
+    - max_rep_seconds: float, longest a rep can take before it's thrown away
+    - tempo_smoothing: float, 0 to 1, how much each rep moves tempo (bigger reacts faster)
+
+    READ-ONLY Public Variables:
+    - count: int, reps since the last reset
+    - phase: int, the class the counter currently believes in (-1 before it's seen anything)
+    - last_rep: Rep or None
+    - tempo: float, smoothed reps per minute (0.0 until there have been two reps)
+
+    Protected Variables:
+    - _stage: int, 0 waiting for a first phase, 1 in the first phase, 2 in the second phase
+    - _start: float, when the first phase of the rep in progress started
+    - _turn: float, when its second phase started
+    - _candidate: int, the class the newest predictions have been
+    - _candidate_run: int, how many of them in a row
+    - _candidate_since: float, timestamp of the first of them
+    - _listeners: list of functions called with every Rep
+    - _cond: Condition (threading), held while updating, notified on every rep
+    '''
+    def __init__(self, first=1, second=2, rest=0, min_frames=3, max_rep_seconds=10.0, tempo_smoothing=0.3):
+        # Arguments
+        self.first = first
+        self.second = second
+        self.rest = rest
+        self.min_frames = min_frames
+        self.max_rep_seconds = max_rep_seconds
+        self.tempo_smoothing = tempo_smoothing
+
+        # READ-ONLY Public Variables
+        self.count = 0
+        self.phase = -1
+        self.last_rep = None
+        self.tempo = 0.0
+
+        # Protected Variables
+        self._stage = 0
+        self._start = 0.0
+        self._turn = 0.0
+        self._candidate = -1
+        self._candidate_run = 0
+        self._candidate_since = 0.0
+        self._listeners = []
+        self._cond = Condition()
+
+    def set_phases(self, first, second):
+        '''
+        Changes which classes a rep goes through (first -> second -> first), like for an exercise whose model
+        has different classes, and resets the counter.
+        '''
+        with self._cond:
+            self.first = first
+            self.second = second
+        self.reset()
+
+    def check_classes(self, classes, source='model'):
+        '''
+        Checks a model's classes (its classes_) include both rep phases. If they don't, the counter could never
+        count a rep with it, so this prints a warning saying so and returns False. Returns True if they're fine.
+        '''
+        classes = {as_class(cls) for cls in classes}
+        missing = [cls for cls in (self.first, self.second) if cls not in classes]
+        if len(missing) == 0:
+            return True
+        print(f"WARNING: {source} only predicts classes {sorted(classes)}, but a rep goes {self.first} -> "
+              f"{self.second} -> {self.first}, so no reps will be counted - set the exercise's phases in "
+              f"exercise_rep_phases (enumoptions.py)")
+        return False
+
+    def feed(self, value, timestamp=None):
+        '''
+        Takes the newest prediction (same as Prediction_Ring.append). Returns the Rep if this one finished a rep,
+        otherwise None.
+        '''
+        value = as_class(value)
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        with self._cond:
+            # Debounce - only act the moment a new class has held for min_frames
+            if value == self._candidate:
+                self._candidate_run += 1
+            else:
+                self._candidate, self._candidate_run, self._candidate_since = value, 1, timestamp
+            if self._candidate_run != self.min_frames or value == self.phase:
+                return None
+            self.phase = value
+            since = self._candidate_since
+
+            # Half done reps that took too long don't count
+            if self._stage != 0 and since - self._start > self.max_rep_seconds:
+                self._stage = 0
+
+            rep = None
+            if value == self.first:
+                if self._stage == 2:
+                    rep = self._finish(since)
+                self._stage, self._start = 1, since
+            elif value == self.second and self._stage == 1:
+                self._stage, self._turn = 2, since
+            else:
+                # Resting (or some other class) - start over
+                self._stage = 0
+            if rep is None:
+                return None
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+
+        # Outside the lock, so listeners can read the counter (or reset it)
+        for listener in listeners:
+            listener(rep)
+        return rep
+
+    def _finish(self, end):
+        '''
+        Counts a rep ending at end and updates the tempo. Call with the lock held. "Private" function.
+        '''
+        interval = None
+        if self.last_rep is not None:
+            interval = end - self.last_rep.end
+            if interval > 0:
+                rpm = 60.0 / interval
+                self.tempo = rpm if self.tempo == 0.0 else self.tempo + self.tempo_smoothing * (rpm - self.tempo)
+        self.count += 1
+        self.last_rep = Rep(self.count, self._start, self._turn, end, end - self._start, interval)
+        return self.last_rep
+
+    def wait_for_rep(self, after_count=None, timeout=None):
+        '''
+        Sleeps until count moves on from after_count (the current count if None), then returns the newest Rep.
+        Returns None on timeout (so keep it short enough to notice the level ending) or if the counter got reset.
+        '''
+        with self._cond:
+            if after_count is None:
+                after_count = self.count
+            if not self._cond.wait_for(lambda: self.count != after_count, timeout):
+                return None
+            return self.last_rep
+
+    def add_listener(self, listener):
+        '''
+        Calls listener(rep) with every Rep from now on (from whichever thread feeds the counter).
+        '''
+        with self._cond:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._cond:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def reset(self, listeners=False):
+        '''
+        Back to zero reps and no phase, ie for a new exercise or level. Pass listeners=True to forget them too.
+        '''
+        with self._cond:
+            self.count = 0
+            self.phase = -1
+            self.last_rep = None
+            self.tempo = 0.0
+            self._stage = 0
+            self._candidate = -1
+            self._candidate_run = 0
+            if listeners:
+                self._listeners.clear()
+            self._cond.notify_all()
@@ -0,0 +1,145 @@
+import mediapipe as mp
+import cv2
+
+'''
+Getting camera frames ready for the landmarker - cropping to the player and converting to RGB.
+
+Both the game (poseestim.py) and the training data collector (models/exercise_model/data_gatherer.py) import this
+file, so models get trained on frames prepared exactly like the ones they'll see in the game. It only needs OpenCV
+and MediaPipe, so importing it doesn't start anything up (no model cache, no camera thread).
+
+If you change how frames get prepared here in a way that changes the landmarks, bump PREPROCESSING in
+features.py so models trained the old way can be told apart.
+'''
+
+# Getting camera frames ready for the landmarker
+class Frame_Preprocessor():
+    '''
+    Turns a raw camera frame into the image the landmarker actually looks at, and maps the landmarks it finds
+    back onto the whole frame afterwards. Three steps:
+    - Crops to a padded box around where the player was last frame, so the landmarker spends its pixels on
+      the player instead of the room around them
+    - Optionally shrinks the crop so its longest side is at most infer_size pixels (the landmarker works on
+      256x256 internally anyway, so converting and copying a full HD frame every time is wasted work)
+    - Converts OpenCV's BGR colour order to the RGB order MediaPipe expects
+
+    The crop box is sticky - it only moves when the player gets near its edge or takes up much less of it
+    than they used to. MediaPipe tracks the player between frames by itself, and a box that jumps around
+    every frame would keep throwing that off. When nobody is detected (and every refresh_every frames, in
+    case someone new walked in) the whole frame is used.
+
+    After remap, landmark x and y are normalized to the whole camera frame again (and z is rescaled to
+    match), so everything reading the results works exactly like it did without cropping.
+
+    Arguments:
+    - crop: bool, whether to crop to the player at all
+    - infer_size: int or None, longest side in pixels of the image handed to MediaPipe (None to keep as is)
+    - pad: float, padding around the player's landmarks as a fraction of their size
+    - min_size: float, smallest the crop box can get, as a fraction of the frame
+    - min_visibility: float, landmarks less visible than this don't count towards the box
+    - refresh_every: int, frames between full frame checks (0 to never check)
+
+    READ-ONLY Public Variables:
+    - region: tuple (x, y, width, height), the next crop box, normalized to the whole frame
+
+    Protected Variables:
+    - _frames: int, frames cropped since the last full frame
+    '''
+    FULL = (0.0, 0.0, 1.0, 1.0)               # The whole frame as a region
+
+    def __init__(self, crop=True, infer_size=None, pad=0.3, min_size=0.25, min_visibility=0.5, refresh_every=60):
+        # Settings
+        self.crop = crop
+        self.infer_size = infer_size
+        self.pad = pad
+        self.min_size = min_size
+        self.min_visibility = min_visibility
+        self.refresh_every = refresh_every
+
+        # READ-ONLY Public Variables
+        self.region = Frame_Preprocessor.FULL
+
+        # Protected variables
+        self._frames = 0
+
+    def prepare(self, cv_frame):
+        '''
+        Crops, shrinks, and colour converts a BGR camera frame. Returns the MediaPipe image and the region it
+        was cut from (pass that to remap along with the results).
+        '''
+        # Whole frame every so often, in case the box lost track of someone
+        region = self.region
+        if self.refresh_every and self._frames >= self.refresh_every:
+            region = Frame_Preprocessor.FULL
+        self._frames = 0 if region == Frame_Preprocessor.FULL else self._frames + 1
+
+        # Crop to whole pixels, then work out exactly what region those pixels cover
+        height, width = cv_frame.shape[:2]
+        x0, y0 = int(region[0] * width), int(region[1] * height)
+        x1 = min(width, int(round((region[0] + region[2]) * width)))
+        y1 = min(height, int(round((region[1] + region[3]) * height)))
+        image = cv_frame[y0:y1, x0:x1]
+        used = (x0 / width, y0 / height, (x1 - x0) / width, (y1 - y0) / height)
+
+        # Shrink before converting, so the conversion has fewer pixels to touch
+        if self.infer_size is not None and max(image.shape[:2]) > self.infer_size:
+            scale = self.infer_size / max(image.shape[:2])
+            size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+        # OpenCV frames are BGR, MediaPipe wants RGB (also makes the crop contiguous again)
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb), used
+
+    def remap(self, result, region):
+        '''
+        Maps landmarks found in a cropped image back to the whole frame, in place. World landmarks are in
+        meters around the hips, so they don't need it.
+        '''
+        if region == Frame_Preprocessor.FULL:
+            return result
+        x0, y0, width, height = region
+        for pose_landmarks in result.pose_landmarks:
+            for landmark in pose_landmarks:
+                landmark.x = x0 + landmark.x * width
+                landmark.y = y0 + landmark.y * height
+                landmark.z = landmark.z * width   # z is on the same scale as x
+        return result
+
+    def track(self, result):
+        '''
+        Updates the crop box for the next frame from (already remapped) results.
+        '''
+        if not self.crop or len(result.pose_landmarks) == 0:
+            self.region = Frame_Preprocessor.FULL
+            return
+
+        # Bounding box of the landmarks we're fairly sure about
+        xs = [lm.x for lm in result.pose_landmarks[0] if lm.visibility >= self.min_visibility]
+        ys = [lm.y for lm in result.pose_landmarks[0] if lm.visibility >= self.min_visibility]
+        if len(xs) < 4:
+            self.region = Frame_Preprocessor.FULL
+            return
+        left, right, top, bottom = min(xs), max(xs), min(ys), max(ys)
+
+        # Keep the current box while the player is comfortably inside it and still fills a decent part of it
+        new_w = max(self.min_size, (right - left) * (1 + 2 * self.pad))
+        new_h = max(self.min_size, (bottom - top) * (1 + 2 * self.pad))
+        x, y, w, h = self.region
+        margin_x, margin_y = (right - left) * self.pad / 3, (bottom - top) * self.pad / 3
+        inside = (left - margin_x >= x and right + margin_x <= x + w and
+                  top - margin_y >= y and bottom + margin_y <= y + h)
+        if inside and new_w * new_h * 2 >= w * h:
+            return
+
+        # New box - padded, no smaller than min_size, and inside the frame
+        w, h = new_w, new_h
+        x = min(max(0.0, (left + right - w) / 2), 1.0 - min(w, 1.0))
+        y = min(max(0.0, (top + bottom - h) / 2), 1.0 - min(h, 1.0))
+        self.region = (x, y, min(w, 1.0), min(h, 1.0))
+
+    def reset(self):
+        '''
+        Goes back to the whole frame (like after the landmarker gets swapped out and loses its tracking).
+        '''
+        self.region = Frame_Preprocessor.FULL
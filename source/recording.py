@@ -0,0 +1,428 @@
+from collections import namedtuple
+from threading import Lock
+import argparse
+import struct
+import json
+import time
+import os
+import numpy as np
+import enumoptions as op
+import predictions as pr
+import poseestim as pe
+
+# MediaPipe result containers, so replayed results look exactly like live ones to everything reading them
+from mediapipe.tasks.python.components.containers.landmark import NormalizedLandmark
+
+'''
+Records what the camera thread works out (landmarks, timestamps, exercise predictions) to a compact file, and plays
+it back through a Pose_Estimation that reads the file instead of the camera - so a level, the rep counter or a new
+exercise model can be run against the same session over and over, with nobody in front of the webcam.
+
+Recording (the camera thread writes one row per published result, see Pose_Estimation.recorder):
+
+    cam_thread.recorder = rec.Pose_Recorder(os.path.join(op.root_dir, "saves", "session.pkrec"))
+    ...
+    cam_thread.recorder.close()
+    cam_thread.recorder = None
+
+Replaying (stands in for Pose_Estimation anywhere, ie levels.start_level(page, 0, replay)):
+
+    replay = rec.Replay_Estimation("session.pkrec")               # real time, like the camera
+    replay = rec.Replay_Estimation("session.pkrec", speed=None)   # as fast as it can go, for benchmarks/tests
+    replay = rec.Replay_Estimation("session.pkrec", repredict=True) # run today's exercise model on the old poses
+
+File layout (little endian):
+- header: MAGIC, version (uint32), data offset (uint32), stride (uint32, float32s per row), landmarks per row
+  (uint32), keyframe_every (uint32, 0 = every row is absolute), then UTF-8 JSON metadata, padded to ALIGN bytes
+- rows, each stride float32s: ROW_FIELDS, then N_LANDMARKS * LANDMARK_VALUES landmark values (x, y, z,
+  visibility, presence for each)
+
+Rows only ever get appended, so a recording cut short by a crash is still readable up to the last whole row, and
+the rows can be memory mapped as one (rows, stride) float32 array. With delta encoding on, landmark values are
+stored as the change since the row before, except on keyframes (flagged, at least every keyframe_every rows and
+whenever the person reappears). Deltas are taken from the decoded previous row, so decoding adds them back up to
+exactly what the writer saw - no drift. Rows stay the same size either way, but deltas are mostly tiny numbers
+and zip down far better for sharing/archiving.
+
+Only the first pose's normalized landmarks are kept (the camera thread only ever asks MediaPipe for one pose and
+nothing reads the world landmarks) - no camera frames.
+'''
+
+MAGIC = b"PKRC"
+VERSION = 1
+ALIGN = 64
+HEADER = struct.Struct("<4sIIIII")
+
+N_LANDMARKS = 33
+LANDMARK_VALUES = ('x', 'y', 'z', 'visibility', 'presence')
+# Values at the start of every row, before the landmarks
+ROW_FIELDS = ('time', 'prediction', 'exercise', 'flags', 'frame_w', 'frame_h')
+T, PREDICTION, EXERCISE, FLAGS, FRAME_W, FRAME_H = range(len(ROW_FIELDS))
+STRIDE = len(ROW_FIELDS) + N_LANDMARKS * len(LANDMARK_VALUES)
+
+# Bits in the flags value
+PERSON = 1          # landmarks were found (otherwise they're all zero)
+KEYFRAME = 2        # landmarks are absolute, not a delta
+
+# One recorded result, as Pose_Recording hands them out
+Recorded_Frame = namedtuple('Recorded_Frame', [
+    'index',            # row number
+    'timestamp',        # seconds since the recording started
+    'prediction',       # exercise prediction (int), or None if the camera thread didn't keep one for this frame
+    'exercise',         # exercise being detected (see Exercises in enumoptions.py)
+    'frame_shape',      # (height, width) of the camera frame it came from
+    'landmarks',        # ndarray (N_LANDMARKS, 5) float32, x y z visibility presence, or None with no person
+])
+
+class Pose_Recorder():
+    '''
+    Appends camera thread results to a recording file, one fixed size row each. Set one as a
+    Pose_Estimation's recorder and it gets every published snapshot - writing a row is a few numpy
+    assignments and a buffered file write, so it doesn't slow the camera thread down.
+
+    Can be used as a context manager (closes the file at the end).
+
+    Arguments:
+    - path: str, the file to write (overwritten)
+    - delta: bool, store landmarks as changes since the last row (see the top of this file)
+    - keyframe_every: int, with delta on, rows between absolute ones (how far back a random read has to go)
+    - meta: dict, anything JSON-able to store in the header (the exercise, who recorded it...)
+
+    READ-ONLY Public Variables:
+    - path: str
+    - rows: int, rows written so far
+
+    Protected Variables:
+    - _file: the open file
+    - _row: ndarray (STRIDE) float32, reused for every row
+    - _last: ndarray (N_LANDMARKS, 5) float32, the landmarks the last row decodes to (delta only)
+    - _since_key: int, rows since the last keyframe
+    - _start: float, timestamp of the first row (times are stored relative to it)
+    - _lock: Lock (threading), so close can't land halfway through a write
+    '''
+    def __init__(self, path, delta=False, keyframe_every=64, meta=None):
+        # Arguments
+        self.delta = delta
+        self.keyframe_every = keyframe_every if delta else 0
+
+        # READ-ONLY Public Variables
+        self.path = str(path)
+        self.rows = 0
+
+        # Protected Variables
+        self._row = np.zeros(STRIDE, dtype=np.float32)
+        self._last = None
+        self._since_key = 0
+        self._start = None
+        self._lock = Lock()
+
+        # Header, padded so the rows start aligned
+        info = {"recorded": time.strftime("%Y-%m-%d %H:%M:%S"), "landmark_values": LANDMARK_VALUES,
+                "row_fields": ROW_FIELDS, "meta": meta or {}}
+        info = json.dumps(info).encode("utf-8")
+        offset = HEADER.size + len(info)
+        offset += -offset % ALIGN
+        self._file = open(self.path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, offset, STRIDE, N_LANDMARKS, self.keyframe_every))
+        self._file.write(info.ljust(offset - HEADER.size, b" "))
+
+    def write(self, snapshot, exercise=-1):
+        '''
+        Appends one Pose_Snapshot (or anything with mp_results, prediction, timestamp and frame). Pose_Estimation
+        calls this itself when it has a recorder.
+        '''
+        with self._lock:
+            if self._file is None:
+                return
+            if self._start is None:
+                self._start = snapshot.timestamp
+            row = self._row
+            row[T] = snapshot.timestamp - self._start
+            row[PREDICTION] = -1 if snapshot.prediction is None else pr.as_class(snapshot.prediction)
+            row[EXERCISE] = exercise
+            height, width = snapshot.frame.shape[:2] if snapshot.frame is not None else (0, 0)
+            row[FRAME_W], row[FRAME_H] = width, height
+
+            landmarks = row[len(ROW_FIELDS):].reshape(N_LANDMARKS, len(LANDMARK_VALUES))
+            results = snapshot.mp_results
+            if results is None or len(results.pose_landmarks) == 0:
+                # Nobody there - zeros, and the next person starts from a keyframe
+                flags = 0
+                landmarks[:] = 0.0
+                self._last = None
+            else:
+                flags = PERSON
+                for i, lm in enumerate(results.pose_landmarks[0][:N_LANDMARKS]):
+                    landmarks[i] = (lm.x, lm.y, lm.z, lm.visibility or 0.0, lm.presence or 0.0)
+                if self.delta:
+                    if self._last is None or self._since_key >= self.keyframe_every:
+                        flags |= KEYFRAME
+                        self._last = landmarks.copy()
+                        self._since_key = 0
+                    else:
+                        # Delta from what the reader will have decoded, then decode it the same way it will
+                        landmarks -= self._last
+                        self._last += landmarks
+                    self._since_key += 1
+                else:
+                    flags |= KEYFRAME
+            row[FLAGS] = flags
+            self._file.write(row.tobytes())
+            self.rows += 1
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Pose_Recording():
+    '''
+    A recording file opened for reading. The rows are memory mapped read only, so opening even a long one is
+    instant and only the parts actually read get loaded. Can be opened while it's still being recorded - it sees
+    the rows that were there when it was opened.
+
+    Arguments:
+    - path: str
+
+    READ-ONLY Public Variables:
+    - path: str
+    - info: dict, the header metadata (with "meta" being whatever the recorder was given)
+    - keyframe_every: int, 0 if the landmarks aren't delta encoded
+    - rows: ndarray (n, STRIDE) float32, memory mapped, read only
+    - timestamps: ndarray (n) float32, view of the time column
+    - predictions: ndarray (n) float32, view of the prediction column (-1 for none)
+    '''
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, "rb") as f:
+            magic, version, offset, stride, n_landmarks, keyframe_every = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{self.path} isn't a version {VERSION} pose recording")
+            if stride != STRIDE or n_landmarks != N_LANDMARKS:
+                raise ValueError(f"{self.path} has {n_landmarks} landmarks per row, this version reads {N_LANDMARKS}")
+            self.info = json.loads(f.read(offset - HEADER.size).decode("utf-8"))
+        self.keyframe_every = keyframe_every
+
+        # Only whole rows - a recording cut short can end partway through one
+        n = (os.path.getsize(self.path) - offset) // (STRIDE * 4)
+        if n > 0:
+            self.rows = np.memmap(self.path, dtype=np.float32, mode="r", offset=offset, shape=(n, STRIDE))
+        else:
+            self.rows = np.zeros((0, STRIDE), dtype=np.float32)
+        self.timestamps = self.rows[:, T]
+        self.predictions = self.rows[:, PREDICTION]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _frame(self, index, landmarks):
+        '''
+        Wraps a row and its decoded landmarks up as a Recorded_Frame. "Private" function.
+        '''
+        row = self.rows[index]
+        prediction = int(row[PREDICTION])
+        return Recorded_Frame(index, float(row[T]), None if prediction < 0 else prediction, int(row[EXERCISE]),
+                              (int(row[FRAME_H]), int(row[FRAME_W])), landmarks)
+
+    def landmarks(self, index):
+        '''
+        Decoded (N_LANDMARKS, 5) landmarks of one row, or None if there was nobody in it. With delta encoding
+        this adds up the rows since the last keyframe (at most keyframe_every of them).
+        '''
+        row = self.rows[index]
+        flags = int(row[FLAGS])
+        if not flags & PERSON:
+            return None
+        if flags & KEYFRAME:
+            return np.array(row[len(ROW_FIELDS):], dtype=np.float32).reshape(N_LANDMARKS, -1)
+        start = index
+        while not int(self.rows[start, FLAGS]) & KEYFRAME:
+            start -= 1
+        # float32 adds in the same order the recorder did, so it comes out exactly the same
+        decoded = np.array(self.rows[start, len(ROW_FIELDS):], dtype=np.float32)
+        for i in range(start + 1, index + 1):
+            decoded += self.rows[i, len(ROW_FIELDS):]
+        return decoded.reshape(N_LANDMARKS, -1)
+
+    def frame(self, index):
+        return self._frame(index, self.landmarks(index))
+
+    def frames(self, start=0):
+        '''
+        Every Recorded_Frame from start on, decoding as it goes (constant work per row, even with deltas).
+        '''
+        decoded = None
+        for index in range(start, len(self.rows)):
+            flags = int(self.rows[index, FLAGS])
+            if not flags & PERSON:
+                decoded = None
+            elif decoded is None or flags & KEYFRAME:
+                decoded = self.landmarks(index) # Absolute, or the first row we read with deltas
+            else:
+                decoded = decoded + self.rows[index, len(ROW_FIELDS):].reshape(N_LANDMARKS, -1)
+            yield self._frame(index, decoded)
+
+def to_mp_result(landmarks):
+    '''
+    Turns decoded landmarks (or None) back into a MediaPipe PoseLandmarkerResult, so anything that reads live
+    results (get_body_part, the feature extractor, the skeleton renderer...) reads replayed ones too. World
+    landmarks aren't recorded, so those come back empty.
+    '''
+    if landmarks is None:
+        return pe.PoseLandmarkerResult(pose_landmarks=[], pose_world_landmarks=[])
+    pose = [NormalizedLandmark(x=float(x), y=float(y), z=float(z), visibility=float(v), presence=float(p))
+            for x, y, z, v, p in landmarks.tolist()]
+    return pe.PoseLandmarkerResult(pose_landmarks=[pose], pose_world_landmarks=[])
+
+class Replay_Estimation(pe.Pose_Estimation):
+    '''
+    A Pose_Estimation that plays a recording back instead of opening the camera - same public variables, same
+    snapshot/wait_for_result/wait_until/attach/detach, same ex_results and reps, so levels and tests can't tell
+    the difference (except snapshot.frame being a blank frame the size of the original camera's, since frames
+    aren't recorded).
+
+    Prediction timestamps are the recorded ones (offset to when playback started), so time windows and rep tempo
+    come out the same at any speed.
+
+    Arguments (on top of Pose_Estimation's):
+    - path: str, the recording
+    - speed: float, 1.0 plays it back in real time, 2.0 twice as fast... None for as fast as possible
+    - repredict: bool, run the current exercise model on the recorded landmarks instead of using the
+      recorded predictions (for checking a retrained model against an old session)
+    - loop: bool, start over at the end instead of stopping
+
+    READ-ONLY Public Variables (on top of Pose_Estimation's):
+    - recording: Pose_Recording
+    - frames_replayed: int
+
+    Protected Variables:
+    - _blanks: dict, (height, width) -> blank frame stood in for the camera's
+    '''
+    def __init__(self, path, speed=1.0, repredict=False, loop=False, **kwargs):
+        super().__init__(**kwargs)
+        # Arguments
+        self.speed = speed
+        self.repredict = repredict
+        self.loop = loop
+
+        # READ-ONLY Public Variables
+        self.recording = Pose_Recording(path)
+        self.frames_replayed = 0
+
+        # Protected Variables
+        self._blanks = {}
+
+    def _blank(self, shape):
+        '''
+        Read only black frame standing in for a camera frame of this size. "Private" function.
+        '''
+        if shape[0] <= 0 or shape[1] <= 0:
+            shape = (480, 640)
+        blank = self._blanks.get(shape)
+        if blank is None:
+            blank = np.zeros((shape[0], shape[1], 3), dtype=np.uint8)
+            blank.flags.writeable = False
+            self._blanks[shape] = blank
+        return blank
+
+    def run(self):
+        if len(self.recording) == 0:
+            print(f"\nERROR: {self.recording.path} has no frames in it")
+            self._set_state(op.Pipeline_States.FAILED.value, f"{self.recording.path} has no frames in it")
+            return None
+        # No camera or landmarker to set up, but go through the same states so nothing waiting on them hangs
+        self._set_state(op.Pipeline_States.CAMERA_OPENED.value)
+        self._set_state(op.Pipeline_States.LANDMARKER_READY.value)
+
+        base = time.monotonic() # Recording time 0 as a timestamp
+        wall = base             # When recording time 0 plays (only used with a speed)
+        offset = 0.0            # Added to recorded times, so every pass of a loop carries on from the last
+        while not self._stop_event.is_set():
+            last = 0.0
+            for recorded in self.recording.frames():
+                if self._stop_event.is_set():
+                    break
+                # Detached - hold the playback where it is, and don't count the pause as recording time
+                if not self._attached.is_set():
+                    paused = time.monotonic()
+                    while not self._attached.wait(0.5):
+                        pass
+                    base += time.monotonic() - paused
+                    wall += time.monotonic() - paused
+                    if self._stop_event.is_set():
+                        break
+
+                last = recorded.timestamp
+                if self.speed is not None:
+                    self._stop_event.wait(max(0.0, wall + (offset + last) / self.speed - time.monotonic()))
+                self._replay(recorded, base + offset + last)
+
+            if not self.loop:
+                break
+            offset += last + 1 / 16 # Next pass starts a frame after this one ended
+
+        print(f"Replay closed ({self.frames_replayed} frames replayed)")
+        self._set_state(op.Pipeline_States.STOPPED.value)
+        return None
+
+    def _replay(self, recorded, timestamp):
+        '''
+        Publishes one recorded frame like the camera thread would have. "Private" function.
+        '''
+        mp_rslt = to_mp_result(recorded.landmarks)
+        if self.repredict:
+            predict = self._update_ex_results(mp_rslt, timestamp)
+        else:
+            predict = recorded.prediction
+            if predict is not None:
+                self.ex_results.append(predict, timestamp)
+                self.reps.feed(predict, timestamp)
+        self._publish(self._blank(recorded.frame_shape), None, mp_rslt, None, predict, timestamp)
+        self.frames_replayed += 1
+
+def record_offline(source, path, exercise=op.Exercises.CRUNCH.value, delta=False, fps=30.0, **kwargs):
+    '''
+    Runs a video file/image folder through pose estimation offline (every frame, as fast as possible) and records
+    the results to path. Returns the finished Pose_Estimation, whose frames_processed and state say how it went.
+    '''
+    cam_thread = pe.Pose_Estimation(exercise=exercise, source=source, offline=True, fps=fps, **kwargs)
+    cam_thread.set_exercise(exercise) # Makes sure the exercise's own model is the one used
+    with Pose_Recorder(path, delta=delta, meta={"source": str(source), "exercise": exercise}) as recorder:
+        cam_thread.recorder = recorder
+        cam_thread.start()
+        cam_thread.join()
+        cam_thread.recorder = None
+    return cam_thread
+
+# Quick look at a recording, or making one from a video
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize a pose recording, or make one from a video file/image folder.")
+    parser.add_argument("path", help="the recording file")
+    parser.add_argument("--from", dest="source", help="video file or image folder to process into the recording first")
+    parser.add_argument("--exercise", type=int, default=op.Exercises.CRUNCH.value, help="exercise to detect (see enumoptions.py)")
+    parser.add_argument("--fps", type=float, default=30.0, help="frame rate of an image folder")
+    parser.add_argument("--delta", action="store_true", help="delta encode the landmarks")
+    args = parser.parse_args()
+    if args.source is not None:
+        cam_thread = record_offline(args.source, args.path, args.exercise, args.delta, args.fps)
+        if cam_thread.state_error is not None:
+            raise SystemExit(cam_thread.state_error)
+    recording = Pose_Recording(args.path)
+    n = len(recording)
+    seconds = float(recording.timestamps[-1]) if n else 0.0
+    people = int(np.count_nonzero(recording.rows[:, FLAGS].astype(np.int32) & PERSON)) if n else 0
+    print(f"{args.path}: {n} frames over {seconds:.1f} s ({n / max(seconds, 1e-9):.1f} fps), "
+          f"person in {people}, delta encoded: {recording.keyframe_every > 0}")
+    print(f"Recorded {recording.info['recorded']}, meta: {recording.info['meta']}")
@@ -0,0 +1,201 @@
+from threading import Thread, Event, Lock, current_thread
+from contextlib import contextmanager
+from time import perf_counter
+import importlib
+import json
+import time
+import os
+import enumoptions as op
+
+'''
+Start up timing, and the background warm-up that loads the heavy stuff while the player is still on the menu.
+
+Importing levels pulls in poseestim, and with it MediaPipe (which drags in protobuf and matplotlib), scikit-learn
+through joblib, and OpenCV - well over a second before the first window could be drawn. So app.py only imports
+what the menu needs, shows it, and starts a Warm_Up thread that imports the rest, loads the default exercise
+model into poseestim's model cache, and makes a PoseLandmarker and runs it once. That landmarker is kept, and
+the first camera thread takes it over (see take_landmarker) instead of building its own graph while the player
+waits on the first level.
+
+Everything is timed - wrap a step in timed(label), or call mark(label) for a point in time - and report() breaks
+it all down per import/step, so a slower cold start on the kiosks shows up as a line that grew. Warm_Up prints
+the report when it's done and can append it to a log file too (one JSON line per run).
+
+This file only uses the standard library (and enumoptions), so importing it first costs nothing and it can time
+everything imported after it.
+'''
+
+start = perf_counter()  # Roughly when the app started, everything is reported relative to this
+steps = []              # (thread name, label, seconds) for each timed step, in the order they finished
+marks = []              # (thread name, label, seconds since start) for each mark
+_lock = Lock()
+
+@contextmanager
+def timed(label):
+    '''
+    Times whatever runs inside the with block and records it under label:
+
+        with warmup.timed("import PySide6"):
+            from PySide6.QtWidgets import QApplication
+    '''
+    t = perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            steps.append((current_thread().name, label, perf_counter() - t))
+
+def mark(label):
+    '''
+    Records that something happened now (ie the main menu being up).
+    '''
+    with _lock:
+        marks.append((current_thread().name, label, perf_counter() - start))
+
+def timed_import(name):
+    '''
+    Imports a module by name, timed. Anything it imports that wasn't already loaded counts towards it, so the
+    order matters - import dependencies first to see them separately. Returns the module.
+    '''
+    with timed("import " + name):
+        return importlib.import_module(name)
+
+def report():
+    '''
+    The timings so far as a readable table (milliseconds).
+    '''
+    with _lock:
+        rows = [(name, label, f"{seconds * 1000:8.1f} ms") for name, label, seconds in steps]
+        rows += [(name, label, f"{seconds * 1000:8.1f} ms since start") for name, label, seconds in marks]
+    lines = ["Startup times:"]
+    for name, label, ms in rows:
+        lines.append(f"  {name:<12} {label:<32} {ms}")
+    return "\n".join(lines)
+
+def save_report(path):
+    '''
+    Appends the timings so far to a log file as one JSON line, so runs can be compared over time.
+    '''
+    with _lock:
+        line = {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "steps": {f"{name}: {label}": round(seconds * 1000, 1) for name, label, seconds in steps},
+                "marks": {f"{name}: {label}": round(seconds * 1000, 1) for name, label, seconds in marks}}
+    with open(path, "a") as f:
+        f.write(json.dumps(line) + "\n")
+
+# Imported in this order, dependencies first, so each line of the report is that module's own cost (numpy is
+# already in by now, helpers needs it for the player portrait - OpenCV isn't, helpers only imports it when a
+# frame first gets reformatted)
+HEAVY_IMPORTS = ["cv2", "google.protobuf", "matplotlib", "mediapipe", "joblib", "sklearn", "poseestim", "levels"]
+
+class Warm_Up(Thread):
+    '''
+    Thread that imports the heavy modules and warms up pose estimation while the menu is up. Daemon, so it
+    never holds up closing the app. Start it once the menu is showing (app.py does it from a zero length
+    QTimer, so it doesn't hold up the first paint either).
+
+    Nothing has to wait for it - importing levels later just finishes (or waits for) the import already
+    running here, the exercise model is already sitting in the cache, and the camera thread takes over the
+    landmarker (pass take_landmarker to Pose_Estimation, or levels.start_pipeline).
+
+    Arguments:
+    - imports: list of module names to import, in order (default HEAVY_IMPORTS)
+    - ex_model_path: exercise model to load into poseestim.model_cache (default EX_DEFAULT, the model of the
+      exercise levels attach with - see start_exercise in levels.py)
+    - mp_model_path: MediaPipe model to build a landmarker with (default MP_FULL, the one start_pipeline's
+      governor starts with - skipped if it's missing)
+    - log_path: file to append the report to when done, or None to just print it
+
+    READ-ONLY Public Variables:
+    - done: Event (threading), set when the warm-up is finished (whether it worked or not)
+    - error: the exception that stopped it, if one did
+
+    Protected Variables:
+    - _landmarker: PoseLandmarker (VIDEO mode) warmed up and waiting to be taken, or None
+    - _landmarker_lock: Lock (threading), guards _landmarker
+    '''
+    def __init__(self, imports=HEAVY_IMPORTS, ex_model_path=op.Model_Paths.EX_DEFAULT.value,
+                 mp_model_path=op.Model_Paths.MP_FULL.value, log_path=None):
+        super().__init__(name="warm-up", daemon=True)
+        # Arguments
+        self.imports = imports
+        self.ex_model_path = ex_model_path
+        self.mp_model_path = mp_model_path
+        self.log_path = log_path
+
+        # READ-ONLY Public Variables
+        self.done = Event()
+        self.error = None
+
+        # Protected Variables
+        self._landmarker = None
+        self._landmarker_lock = Lock()
+
+    def run(self):
+        try:
+            for name in self.imports:
+                timed_import(name)
+            pe = importlib.import_module("poseestim")
+
+            # Default exercise model, loaded and warmed by the cache (first level gets it instantly)
+            with timed("exercise model"):
+                pe.model_cache.get(self.ex_model_path)
+
+            # Landmarker - loads MediaPipe's graph and the model file, then runs it once on a blank frame so
+            # the inference delegate is set up too. Kept for the camera thread to take over
+            if os.path.isfile(self.mp_model_path):
+                with timed("pose landmarker"):
+                    self._warm_landmarker(pe)
+            else:
+                print(f"\nWarm-up: no MediaPipe model at {self.mp_model_path}, skipping the landmarker")
+        except Exception as e:
+            self.error = e
+            print(f"\nWarm-up stopped early: {e!r}")
+        finally:
+            mark("warm-up done")
+            self.done.set()
+            print("\n" + report())
+            if self.log_path is not None:
+                try:
+                    save_report(self.log_path)
+                except OSError as e:
+                    print(f"Couldn't save the startup report to {self.log_path}: {e!r}")
+
+    def _warm_landmarker(self, pe):
+        '''
+        Makes a landmarker, runs one blank frame through it (at timestamp 0), and keeps it for take_landmarker.
+        "Private" function.
+        '''
+        import mediapipe as mp # Both already imported by now, this just fetches them
+        import numpy as np
+        options = pe.PoseLandmarkerOptions(
+            base_options=pe.BaseOptions(model_asset_path=self.mp_model_path),
+            running_mode=pe.VisionRunningMode.VIDEO)
+        landmarker = pe.PoseLandmarker.create_from_options(options)
+        try:
+            blank = np.zeros((480, 640, 3), dtype=np.uint8)
+            landmarker.detect_for_video(mp.Image(image_format=mp.ImageFormat.SRGB, data=blank), 0)
+        except Exception:
+            landmarker.close()
+            raise
+        with self._landmarker_lock:
+            self._landmarker = landmarker
+
+    def take_landmarker(self, options):
+        '''
+        Hands over the warmed up landmarker, if it was made with the same model and running mode as options
+        (PoseLandmarkerOptions) - otherwise closes it. Only works once, after that (or if there isn't one) it
+        returns None and the caller makes its own. Waits for the warm-up to finish first, so call it from the
+        camera thread (Pose_Estimation does, given it as its landmarker argument) - not the GUI thread.
+        '''
+        self.done.wait()
+        with self._landmarker_lock:
+            landmarker, self._landmarker = self._landmarker, None
+        if landmarker is None:
+            return None
+        pe = importlib.import_module("poseestim")
+        if (options.base_options.model_asset_path != self.mp_model_path
+                or options.running_mode != pe.VisionRunningMode.VIDEO):
+            landmarker.close()
+            return None
+        return landmarker